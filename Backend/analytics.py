@@ -0,0 +1,124 @@
+"""
+Long-range nutrition trends computed on NumPy arrays.
+
+Per-day totals arrive as sparse rows (one per logged day). They are scattered into
+dense float arrays with NaN on unlogged days, and every statistic below is a whole-
+array operation: rolling means are differences of cumulative sums, weekly buckets and
+chart points are reshapes, and target deviation is a broadcast against the targets.
+"""
+import math
+from datetime import date, timedelta
+
+import numpy as np
+
+NUTRIENTS = ("calories", "protein", "carbs", "fat")
+TARGET_KEYS = {"calories": "calories", "protein": "protein_g", "carbs": "carbs_g", "fat": "fat_g"}
+
+# A logged day "adheres" when it lands within this fraction of the target
+ADHERENCE_TOLERANCE = 0.10
+
+
+def dense_series(rows, start_date: date, days: int) -> dict:
+    """Scatter daily_totals rows into one float array per nutrient, NaN where nothing was logged."""
+    series = {n: np.full(days, np.nan) for n in NUTRIENTS}
+    if not rows:
+        return series
+    offsets = np.fromiter(((row["day"] - start_date).days for row in rows), dtype=np.int64, count=len(rows))
+    for n in NUTRIENTS:
+        series[n][offsets] = np.fromiter((float(row[n]) for row in rows), dtype=np.float64, count=len(rows))
+    return series
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """Mean of the logged days among the last `window` days, along the last axis
+    (NaN where none were logged)."""
+    logged = ~np.isnan(values)
+    zeros = np.zeros(values.shape[:-1] + (1,))
+    sums = np.concatenate((zeros, np.cumsum(np.where(logged, values, 0.0), axis=-1)), axis=-1)
+    counts = np.concatenate((zeros, np.cumsum(logged, axis=-1)), axis=-1)
+    ends = np.arange(1, values.shape[-1] + 1)
+    starts = np.maximum(ends - window, 0)
+    window_sums = sums[..., ends] - sums[..., starts]
+    window_counts = counts[..., ends] - counts[..., starts]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(window_counts > 0, window_sums / window_counts, np.nan)
+
+
+def bucket_means(values: np.ndarray, size: int):
+    """(means, logged counts) over consecutive buckets of `size` days along the last axis.
+    The first bucket is the short one, so the last bucket always ends on the most recent day."""
+    pad = -values.shape[-1] % size
+    padding = np.full(values.shape[:-1] + (pad,), np.nan)
+    buckets = np.concatenate((padding, values), axis=-1).reshape(values.shape[:-1] + (-1, size))
+    logged = ~np.isnan(buckets)
+    counts = logged.sum(axis=-1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(counts > 0, np.where(logged, buckets, 0.0).sum(axis=-1) / counts, np.nan), counts
+
+
+def _as_list(values: np.ndarray, digits: int = 1) -> list:
+    """JSON-ready list: rounded floats, None for NaN and infinities."""
+    return [v if math.isfinite(v) else None for v in np.round(values, digits).tolist()]
+
+
+def _bucket_starts(start_date: date, days: int, size: int) -> list:
+    pad = -days % size
+    return [str(start_date + timedelta(days=max(i * size - pad, 0))) for i in range((days + pad) // size)]
+
+
+def compute_trends(rows, start_date: date, days: int, targets: dict, window: int = 7,
+                   max_points: int = 60) -> dict:
+    """Rolling averages, weekly buckets and adherence for `days` days starting at start_date.
+
+    The daily series is downsampled to at most max_points chart points by averaging
+    consecutive days; `bucket_days` in the result says how many days each point covers.
+    """
+    series = dense_series(rows, start_date, days)
+    target = np.array([targets[TARGET_KEYS[n]] for n in NUTRIENTS], dtype=np.float64)
+    # Deviation from a zero target is undefined, so those nutrients report None
+    has_target = target > 0
+    divisor = np.where(has_target, target, np.nan)[:, None]
+
+    daily = np.vstack([series[n] for n in NUTRIENTS])           # (nutrients, days)
+    logged = ~np.isnan(daily[0])
+    rolling = rolling_mean(daily, window)
+    deviation = (daily - divisor) / divisor * 100
+    within = np.abs(deviation) <= ADHERENCE_TOLERANCE * 100
+
+    logged_days = int(logged.sum())
+    missing = np.full(len(NUTRIENTS), np.nan)
+    averages = np.nanmean(daily, axis=1) if logged_days else missing
+    # The mean of the daily deviations is the deviation of the mean
+    mean_deviation = (averages - divisor[:, 0]) / divisor[:, 0] * 100
+    adherence = np.where(has_target, within[:, logged].mean(axis=1) * 100, np.nan) if logged_days else missing
+    # How far the rolling average moved over the most recent window
+    delta = rolling[:, -1] - rolling[:, -1 - window] if days > window else missing
+
+    bucket_days = max(1, math.ceil(days / max_points))
+    points, counts = bucket_means(daily, bucket_days)
+    rolling_points, _ = bucket_means(rolling, bucket_days)
+    weeks, week_counts = bucket_means(daily, 7)
+
+    return {
+        "window": window,
+        "targets": targets,
+        "summary": {
+            "logged_days": logged_days,
+            "average": dict(zip(NUTRIENTS, _as_list(averages))),
+            "deviation_pct": dict(zip(NUTRIENTS, _as_list(mean_deviation))),
+            "adherence_pct": dict(zip(NUTRIENTS, _as_list(adherence))),
+            "delta": dict(zip(NUTRIENTS, _as_list(delta))),
+        },
+        "bucket_days": bucket_days,
+        "series": {
+            "date": _bucket_starts(start_date, days, bucket_days),
+            "logged_days": counts[0].tolist(),
+            **{n: _as_list(points[i]) for i, n in enumerate(NUTRIENTS)},
+            **{f"{n}_avg": _as_list(rolling_points[i]) for i, n in enumerate(NUTRIENTS)},
+        },
+        "weekly": {
+            "week_start": _bucket_starts(start_date, days, 7),
+            "logged_days": week_counts[0].tolist(),
+            **{n: _as_list(weeks[i]) for i, n in enumerate(NUTRIENTS)},
+        },
+    }
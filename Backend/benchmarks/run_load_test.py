@@ -0,0 +1,363 @@
+"""
+Load-test the API end to end and report per-endpoint latency percentiles and throughput.
+
+Boots server.py (gevent, cooperative mode) against the Postgres and Redis configured by
+the usual DB_* / REDIS_* variables, with the Anthropic SDK pointed at a local stub that
+answers like the Messages API after --llm-latency seconds (one tool call, then text).
+Seeds --users users with --days days of intake, drives each endpoint in turn for
+--duration seconds at --concurrency, then deletes the seeded users.
+
+Prints one JSON document (also written to --output) that can be compared across commits:
+
+    {"meta": {"commit": ..., "concurrency": ..., ...},
+     "endpoints": {"/dv_summation": {"requests": 812, "errors": 0, "rps": 81.2,
+                                     "p50_ms": ..., "p95_ms": ..., "p99_ms": ..., ...}, ...}}
+
+With --compare BASELINE.json every endpoint also gets the relative change of rps and the
+percentiles against that earlier run.
+
+Usage (from Backend/):
+    python benchmarks/run_load_test.py [--users 20] [--days 30] [--concurrency 16] [--duration 10]
+                                   [--endpoints insert_log,retrieve_log,history_7days,dv_summation,chat]
+                                   [--llm-latency 0.5] [--output results.json] [--compare baseline.json]
+"""
+import argparse
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import psycopg2
+import requests
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# name: kcal, protein, carbs, fat per 100 g
+FOODS = {
+    "Oatmeal": (68, 2.4, 12.0, 1.4),
+    "Banana": (89, 1.1, 22.8, 0.3),
+    "Greek Yogurt": (59, 10.2, 3.6, 0.4),
+    "Scrambled Eggs": (149, 10.0, 1.6, 11.0),
+    "Whole Wheat Bread": (247, 13.0, 41.0, 3.4),
+    "Chicken Breast": (165, 31.0, 0.0, 3.6),
+    "Brown Rice": (112, 2.3, 23.5, 0.8),
+    "Broccoli": (34, 2.8, 6.6, 0.4),
+    "Salmon": (208, 20.0, 0.0, 13.0),
+    "Sweet Potato": (86, 1.6, 20.1, 0.1),
+    "Black Beans": (132, 8.9, 23.7, 0.5),
+    "Avocado": (160, 2.0, 8.5, 14.7),
+    "Almonds": (579, 21.2, 21.6, 49.9),
+    "Cheddar Cheese": (403, 24.9, 1.3, 33.1),
+    "Pasta": (131, 5.0, 25.0, 1.1),
+    "Ground Beef": (254, 17.2, 0.0, 20.0),
+    "Apple": (52, 0.3, 13.8, 0.2),
+    "Spinach": (23, 2.9, 3.6, 0.4),
+    "Peanut Butter": (588, 25.1, 20.0, 50.4),
+    "Orange Juice": (45, 0.7, 10.4, 0.2),
+}
+MEALS = ("breakfast", "lunch", "dinner", "snack")
+ENDPOINTS = ("insert_log", "retrieve_log", "history_7days", "dv_summation", "chat")
+
+
+def log(message: str):
+    print(message, file=sys.stderr, flush=True)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class StubLLM(BaseHTTPRequestHandler):
+    """Answers POST /v1/messages like the Anthropic API: a get_today_nutrition tool call
+    first, and a text reply once the request carries its tool_result."""
+    latency = 0.5
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        time.sleep(self.latency)
+        last = body["messages"][-1]["content"]
+        has_result = isinstance(last, list) and any(block.get("type") == "tool_result" for block in last)
+        if has_result:
+            content = [{"type": "text", "text": "You are on track today. Keep protein up at dinner."}]
+            stop_reason = "end_turn"
+        else:
+            content = [{"type": "tool_use", "id": f"toolu_{uuid.uuid4().hex[:12]}",
+                        "name": "get_today_nutrition", "input": {}}]
+            stop_reason = "tool_use"
+        payload = json.dumps({
+            "id": f"msg_{uuid.uuid4().hex[:12]}", "type": "message", "role": "assistant",
+            "model": body.get("model", "stub"), "content": content, "stop_reason": stop_reason,
+            "stop_sequence": None, "usage": {"input_tokens": 120, "output_tokens": 30},
+        }).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+def start_stub_llm(latency: float) -> ThreadingHTTPServer:
+    StubLLM.latency = latency
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubLLM)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def boot_server(port: int, llm_url: str, verbose: bool) -> subprocess.Popen:
+    env = dict(os.environ)
+    env.update({
+        "ENVIRONMENT": "development",   # never the production database URI
+        "PORT": str(port),
+        "SERVER_PORT": str(port),
+        "LLM_PROVIDER": "anthropic",
+        "ANTHROPIC_API_KEY": "load-test",
+        "ANTHROPIC_BASE_URL": llm_url,
+    })
+    output = None if verbose else subprocess.DEVNULL
+    process = subprocess.Popen([sys.executable, "server.py"], cwd=BACKEND_DIR, env=env,
+                               stdout=output, stderr=output)
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise SystemExit(f"server.py exited with {process.returncode}")
+        try:
+            if requests.get(f"http://127.0.0.1:{port}/health", timeout=1).ok:
+                return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.kill()
+    raise SystemExit("server.py did not become healthy within 30s")
+
+
+def db_connect():
+    return psycopg2.connect(host=os.getenv("DB_HOST", "localhost"), port=int(os.getenv("DB_PORT", 5432)),
+                            dbname=os.getenv("DB_NAME"), user=os.getenv("DB_USER"),
+                            password=os.getenv("DB_PASSWORD"))
+
+
+def seed_foods():
+    """Put the benchmark foods in the catalog so no request falls through to USDA."""
+    with db_connect() as conn, conn.cursor() as cur:
+        for name, (calories, protein, carbs, fat) in FOODS.items():
+            cur.execute("""
+                INSERT INTO food (name, calories, protein, carbs, fat)
+                SELECT %s, %s, %s, %s, %s
+                WHERE NOT EXISTS (SELECT 1 FROM food WHERE LOWER(name) = LOWER(%s))
+            """, (name, calories, protein, carbs, fat, name))
+    conn.close()
+
+
+def random_entry(rng: random.Random, max_days_back: int) -> dict:
+    return {
+        "food_name": rng.choice(list(FOODS)),
+        "quantity": rng.choice((50, 80, 100, 120, 150, 200, 250)),
+        "intake_date": str(date.today() - timedelta(days=rng.randrange(max_days_back))),
+        "meal_type": rng.choice(MEALS),
+    }
+
+
+def seed_users(base_url: str, prefix: str, users: int, days: int, seed: int) -> list:
+    """Register users through the API and log 3-6 entries per day for each."""
+    rng = random.Random(seed)
+    tokens = []
+    for i in range(users):
+        result = requests.post(f"{base_url}/register", json={
+            "username": f"{prefix}{i}", "password": "load-test",
+            "age": rng.randint(18, 70), "sex": rng.choice(("male", "female")),
+            "height": rng.randint(150, 200), "weight": rng.randint(50, 110),
+            "activity_level": rng.choice(("sedentary", "light", "moderate", "active")),
+            "goal": rng.choice(("cut", "maintain", "bulk")),
+        }, timeout=30).json()
+        if result["code"] != 200:
+            raise SystemExit(f"register failed: {result}")
+        token = result["data"]["token"]
+        tokens.append(token)
+
+        entries = []
+        for day in range(days):
+            for _ in range(rng.randint(3, 6)):
+                entry = random_entry(rng, 1)
+                entry["intake_date"] = str(date.today() - timedelta(days=day))
+                entries.append(entry)
+        for start in range(0, len(entries), 400):
+            result = requests.post(f"{base_url}/logs/batch", json={"inserts": entries[start:start + 400]},
+                                   headers={"Authorization": f"Bearer {token}"}, timeout=60).json()
+            if result["code"] != 200:
+                raise SystemExit(f"seeding intake failed: {result}")
+    return tokens
+
+
+def cleanup(prefix: str):
+    with db_connect() as conn, conn.cursor() as cur:
+        cur.execute("DELETE FROM users WHERE username LIKE %s", (prefix + "%",))
+    conn.close()
+
+
+def build_request(endpoint: str, rng: random.Random):
+    """(method, path, json body) for one request to the scenario `endpoint`."""
+    if endpoint == "insert_log":
+        return "post", "/insert_log", random_entry(rng, 7)
+    if endpoint == "retrieve_log":
+        return "get", "/retrieve_log?limit=50", None
+    if endpoint == "history_7days":
+        return "get", "/history_7days", None
+    if endpoint == "dv_summation":
+        return "get", "/dv_summation", None
+    if endpoint == "chat":
+        # A fresh question each time, so the recommendation cache never answers
+        return "post", "/api/chat", {"message": f"How is my intake today? ({uuid.uuid4().hex[:8]})"}
+    raise ValueError(endpoint)
+
+
+def percentile(sorted_values: list, pct: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    if not sorted_values:
+        return None
+    rank = max(1, -(-len(sorted_values) * pct // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(latencies: list, errors: int, elapsed: float) -> dict:
+    values = sorted(latencies)
+    as_ms = lambda seconds: None if seconds is None else round(seconds * 1000, 2)
+    return {
+        "requests": len(values),
+        "errors": errors,
+        "seconds": round(elapsed, 3),
+        "rps": round(len(values) / elapsed, 2) if elapsed else 0.0,
+        "p50_ms": as_ms(percentile(values, 50)),
+        "p95_ms": as_ms(percentile(values, 95)),
+        "p99_ms": as_ms(percentile(values, 99)),
+        "mean_ms": as_ms(sum(values) / len(values)) if values else None,
+        "max_ms": as_ms(values[-1]) if values else None,
+    }
+
+
+def drive(base_url: str, endpoint: str, tokens: list, concurrency: int, duration: float, seed: int) -> dict:
+    """Run `concurrency` closed-loop clients against one endpoint for `duration` seconds."""
+    deadline = time.monotonic() + duration
+
+    def worker(index: int):
+        rng = random.Random(seed * 1000 + index)
+        session = requests.Session()
+        latencies, errors = [], 0
+        while time.monotonic() < deadline:
+            method, path, body = build_request(endpoint, rng)
+            headers = {"Authorization": f"Bearer {rng.choice(tokens)}"}
+            start = time.perf_counter()
+            try:
+                result = getattr(session, method)(f"{base_url}{path}", json=body, headers=headers, timeout=60)
+                ok = result.status_code == 200 and result.json().get("code") == 200
+            except (requests.RequestException, ValueError):
+                ok = False
+            latency = time.perf_counter() - start
+            if ok:
+                latencies.append(latency)
+            else:
+                errors += 1
+        return latencies, errors
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.monotonic() - start
+    return summarize([l for latencies, _ in results for l in latencies], sum(e for _, e in results), elapsed)
+
+
+def compare(endpoints: dict, baseline: dict) -> dict:
+    """Relative change (percent) of rps and latency percentiles versus a previous run."""
+    for name, stats in endpoints.items():
+        before = baseline.get("endpoints", {}).get(name)
+        if not before:
+            continue
+        stats["vs_baseline_pct"] = {
+            key: round((stats[key] - before[key]) / before[key] * 100, 1)
+            for key in ("rps", "p50_ms", "p95_ms", "p99_ms")
+            if stats.get(key) is not None and before.get(key)
+        }
+    return endpoints
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=BACKEND_DIR,
+                                       text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--days", type=int, default=30, help="days of seeded intake per user")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10.0, help="seconds per endpoint")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS))
+    parser.add_argument("--llm-latency", type=float, default=0.5, help="seconds per stub LLM call")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="also write the JSON report here")
+    parser.add_argument("--compare", help="earlier report to compute deltas against")
+    parser.add_argument("--keep-data", action="store_true", help="leave the seeded users in the database")
+    parser.add_argument("--verbose", action="store_true", help="show the server's output")
+    args = parser.parse_args(argv)
+
+    endpoints = [e.strip() for e in args.endpoints.split(",") if e.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"unknown endpoints: {', '.join(sorted(unknown))}")
+
+    port = free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    prefix = f"lt_{uuid.uuid4().hex[:6]}_"
+    llm = start_stub_llm(args.llm_latency)
+    server = boot_server(port, f"http://127.0.0.1:{llm.server_port}", args.verbose)
+    report = {"meta": {
+        "commit": git_commit(),
+        "started_at": datetime.now().isoformat(timespec="seconds"),
+        "users": args.users,
+        "days": args.days,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "llm_latency": args.llm_latency,
+        "seed": args.seed,
+    }, "endpoints": {}}
+    try:
+        seed_foods()
+        log(f"seeding {args.users} users x {args.days} days")
+        tokens = seed_users(base_url, prefix, args.users, args.days, args.seed)
+        for endpoint in endpoints:
+            path = "/api/chat" if endpoint == "chat" else f"/{endpoint}"
+            log(f"driving {path} for {args.duration}s at concurrency {args.concurrency}")
+            report["endpoints"][path] = drive(base_url, endpoint, tokens, args.concurrency, args.duration, args.seed)
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+        llm.shutdown()
+        if not args.keep_data:
+            cleanup(prefix)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(report["endpoints"], json.load(f))
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
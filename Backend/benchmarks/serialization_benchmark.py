@@ -0,0 +1,61 @@
+"""
+Compare the JSON backends on a response shaped like a large log page.
+
+Usage (from Backend/):
+    python benchmarks/serialization_benchmark.py [--rows 2000] [--repeat 200]
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import serialization
+
+
+def build_payload(rows: int) -> dict:
+    start = datetime(2024, 1, 1, 7, 30)
+    logs = []
+    for i in range(rows):
+        created_at = start + timedelta(minutes=37 * i)
+        logs.append({
+            'id': i + 1,
+            'user_id': 1,
+            'food_id': i % 300 + 1,
+            'food_name': f'Food item {i % 300}',
+            'quantity': Decimal(f'{50 + i % 250}.5'),
+            'intake_date': created_at.date(),
+            'meal_type': ('breakfast', 'lunch', 'dinner', 'snack')[i % 4],
+            'status': 'ready',
+            'created_at': created_at,
+            'updated_at': created_at,
+        })
+    return {'code': 200, 'message': 'Logs retrieved successfully', 'data': {'logs': logs, 'next_cursor': None}}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args(argv)
+
+    payload = build_payload(args.rows)
+    results = {}
+    for name in serialization.BACKENDS:
+        backend = serialization.load_backend(name)
+        body = backend.dumps(payload)
+        seconds = min(timeit.repeat(lambda: backend.dumps(payload), number=args.repeat, repeat=3)) / args.repeat
+        results[name] = seconds
+        print(f"{name:>7}: {seconds * 1000:8.3f} ms/response  {len(body) / 1024:8.1f} KiB")
+
+    if 'orjson' in results:
+        print(f"orjson speedup: {results['stdlib'] / results['orjson']:.1f}x")
+    else:
+        print("orjson is not installed; only the stdlib backend was measured")
+
+
+if __name__ == '__main__':
+    main()
@@ -56,3 +56,22 @@ def process_llm_message(self, api_key: str, messages: list, tools: list, usernam
             raise self.retry(exc=e, countdown=2 ** self.request.retries)
         return {"error": f"LLM processing failed after retries: {str(e)}"}
 
+
+@celery_app.task(bind=True, max_retries=3)
+def resolve_pending_intake(self, intake_id: int):
+    """Background task to resolve the food of an intake entry logged in async mode."""
+    from server import app
+    from sqlalchemy import exc
+    from database import db
+    from functions import FoodLookupUnavailable, finalize_pending_log
+
+    with app.app_context():
+        final_attempt = self.request.retries >= self.max_retries
+        try:
+            return finalize_pending_log(intake_id, final_attempt=final_attempt)
+        except (FoodLookupUnavailable, exc.SQLAlchemyError) as e:
+            # Database errors reading or settling the entry are retried as well; once the
+            # retries run out Celery re-raises the last one
+            db.session.rollback()
+            print(f"Food resolution deferred for intake {intake_id} (attempt {self.request.retries + 1}): {e}")
+            raise self.retry(exc=e, countdown=60 * 2 ** self.request.retries)
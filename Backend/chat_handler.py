@@ -1,13 +1,28 @@
 import json
 import os
 import hashlib
-from flask import Request
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from flask import (
+    Request, Response, copy_current_request_context, current_app, g, has_app_context, has_request_context,
+    stream_with_context
+)
 from flask_jwt_extended import get_jwt_identity
 from functions import response
 import traceback
+import metrics
+import request_timing
+import serialization
+from tool_memo import ToolMemo
 
 from redis_client import cache_get, cache_set, get_cache_key_for_recommendation, get_cache_key_for_chat
 
+# Model turns per chat message; each turn may run a round of tool calls
+MAX_TOOL_ITERATIONS = 5
+# Tool calls from one turn that may run at once; each holds its own DB connection
+CHAT_TOOL_CONCURRENCY = int(os.getenv('CHAT_TOOL_CONCURRENCY', 4))
+
 
 def get_mcp_tools_for_llm():
     """Convert MCP tools to Anthropic function calling format."""
@@ -47,7 +62,10 @@ def get_mcp_tools_for_llm():
     return tools
 
 
-def call_mcp_tool(tool_name: str, arguments: dict, username: str = None) -> str:
+def call_mcp_tool(tool_name: str, arguments: dict, username: str = None, memo: ToolMemo = None,
+                  call_info: dict = None) -> str:
+    """Run a tool. With a memo, repeated invocations within the chat turn reuse the first
+    result, and call_info (the tools_called entry) records whether this one did."""
     try:
         from mcp_tools import get_user_profile, get_today_nutrition, calculate_daily_needs, get_user_daily_needs
         
@@ -63,13 +81,18 @@ def call_mcp_tool(tool_name: str, arguments: dict, username: str = None) -> str:
         
         tool_func = tool_map[tool_name]
         
-        # Pass username to tools that need it
+        # Pass username to tools that need it (on a copy: the model's input is echoed back)
+        arguments = dict(arguments or {})
         if tool_name in ["get_user_profile", "get_today_nutrition", "get_user_daily_needs"]:
-            if not arguments:
-                arguments = {}
             arguments['username'] = username
         
-        result = tool_func(**arguments) if arguments else tool_func()
+        run = lambda: tool_func(**arguments) if arguments else tool_func()
+        if memo is None:
+            result = run()
+        else:
+            result, hit = memo.call(tool_name, arguments, run)
+            if call_info is not None:
+                call_info["memo_hit"] = hit
         return result if isinstance(result, str) else json.dumps(result)
         
     except Exception as e:
@@ -78,145 +101,173 @@ def call_mcp_tool(tool_name: str, arguments: dict, username: str = None) -> str:
         return json.dumps({"error": f"Tool execution error: {str(e)}"})
 
 
-def handle_chat_message(request: Request):
-    """Handle chat message with extensive error handling."""
-    try:
-        username = get_jwt_identity()
-        if not username:
-            return response(401, "Authentication required")
+def prepare_chat(request: Request):
+    """Validate a chat request and build the conversation for the LLM.
 
-        try:
-            data = request.get_json()
-        except Exception as e:
-            print(f"Failed to parse JSON: {e}")
-            return response(400, "Invalid JSON in request body")
-        
-        if not data:
-            return response(400, "Empty request body")
-        
-        if 'message' not in data:
-            return response(400, "Missing 'message' field in request body")
+    Returns (chat, None), with everything both chat endpoints need, or (None, error response).
+    """
+    username = get_jwt_identity()
+    if not username:
+        return None, response(401, "Authentication required")
 
+    try:
+        data = request.get_json()
+    except Exception as e:
+        print(f"Failed to parse JSON: {e}")
+        return None, response(400, "Invalid JSON in request body")
+    
+    if not data:
+        return None, response(400, "Empty request body")
+    
+    if 'message' not in data:
+        return None, response(400, "Missing 'message' field in request body")
 
-        user_message = data.get('message')
-        conversation_history = data.get('history', [])
 
-        if user_message is None:
-            return response(400, "Message field cannot be null")
-        
-        if not isinstance(user_message, str):
-            try:
-                user_message = str(user_message)
-            except:
-                return response(400, "Message must be a string")
-        
-        if len(user_message.strip()) == 0:
-            return response(400, "Message cannot be empty")
-        
-        # Validate history
-        if not isinstance(conversation_history, list):
-            print(f"Warning: history is not a list, got {type(conversation_history)}")
-            conversation_history = []
+    user_message = data.get('message')
+    conversation_history = data.get('history', [])
 
+    if user_message is None:
+        return None, response(400, "Message field cannot be null")
+    
+    if not isinstance(user_message, str):
         try:
-            llm_provider = os.getenv('LLM_PROVIDER', 'anthropic').lower()
-            api_key = os.getenv('ANTHROPIC_API_KEY')
-        except Exception as e:
-            print(f"Config error: {e}")
-            traceback.print_exc()
-            return response(500, f"Configuration error: {str(e)}")
-        
-        if not api_key or api_key in ['YOUR_ANTHROPIC_API_KEY_HERE', 'YOUR_OPENAI_API_KEY_HERE']:
-            return response(500, "LLM API key not configured")
+            user_message = str(user_message)
+        except:
+            return None, response(400, "Message must be a string")
+    
+    if len(user_message.strip()) == 0:
+        return None, response(400, "Message cannot be empty")
+    
+    # Validate history
+    if not isinstance(conversation_history, list):
+        print(f"Warning: history is not a list, got {type(conversation_history)}")
+        conversation_history = []
 
-        try:
-            tools = get_mcp_tools_for_llm()
-            messages = []
-            
-            system_message = """You are a helpful nutrition coach assistant. You can help users with:
+    try:
+        llm_provider = os.getenv('LLM_PROVIDER', 'anthropic').lower()
+        api_key = os.getenv('ANTHROPIC_API_KEY')
+    except Exception as e:
+        print(f"Config error: {e}")
+        traceback.print_exc()
+        return None, response(500, f"Configuration error: {str(e)}")
+    
+    if not api_key or api_key in ['YOUR_ANTHROPIC_API_KEY_HERE', 'YOUR_OPENAI_API_KEY_HERE']:
+        return None, response(500, "LLM API key not configured")
+
+    try:
+        tools = get_mcp_tools_for_llm()
+        messages = []
+        
+        system_message = """You are a helpful nutrition coach assistant. You can help users with:
 - Viewing their profile and nutrition goals
 - Checking their daily nutrition intake
 - Calculating their daily calorie and macro needs
 - Providing nutrition advice based on their data
 
 Use the available tools to get user information when needed. Be conversational and helpful."""
-            
-            messages.append({"role": "system", "content": system_message})
-            
-            # Process conversation history with extensive error handling
-            for i, msg in enumerate(conversation_history[-10:]):
-                try:
-                    if not isinstance(msg, dict):
-                        print(f"Warning: history[{i}] is not a dict, skipping")
-                        continue
-                    
-                    role = msg.get("role", "user")
-                    content = msg.get("content", "")
-                    
-                    if not content:
-                        print(f"Warning: history[{i}] has empty content, skipping")
-                        continue
-                    
-                    if not isinstance(content, str):
-                        print(f"Warning: history[{i}] content is not string, converting")
-                        content = str(content)
-                    
-                    content = content.strip()
-                    if len(content) > 0:
-                        messages.append({"role": role, "content": content})
-                    else:
-                        print(f"Warning: history[{i}] content is empty after strip, skipping")
-                        
-                except Exception as e:
-                    print(f"Error processing history[{i}]: {e}")
+        
+        messages.append({"role": "system", "content": system_message})
+        
+        # Process conversation history with extensive error handling
+        for i, msg in enumerate(conversation_history[-10:]):
+            try:
+                if not isinstance(msg, dict):
+                    print(f"Warning: history[{i}] is not a dict, skipping")
                     continue
-            
-            # Add current message
-            messages.append({"role": "user", "content": user_message.strip()})
-            
-        except Exception as e:
-            print(f"Error building messages: {e}")
-            traceback.print_exc()
-            return response(500, f"Error building messages: {str(e)}")
+                
+                role = msg.get("role", "user")
+                content = msg.get("content", "")
+                
+                if not content:
+                    print(f"Warning: history[{i}] has empty content, skipping")
+                    continue
+                
+                if not isinstance(content, str):
+                    print(f"Warning: history[{i}] content is not string, converting")
+                    content = str(content)
+                
+                content = content.strip()
+                if len(content) > 0:
+                    messages.append({"role": role, "content": content})
+                else:
+                    print(f"Warning: history[{i}] content is empty after strip, skipping")
+                    
+            except Exception as e:
+                print(f"Error processing history[{i}]: {e}")
+                continue
+        
+        # Add current message
+        messages.append({"role": "user", "content": user_message.strip()})
+        
+    except Exception as e:
+        print(f"Error building messages: {e}")
+        traceback.print_exc()
+        return None, response(500, f"Error building messages: {str(e)}")
+    
+    query_hash = hashlib.md5(user_message.strip().lower().encode()).hexdigest()
+    return {
+        "username": username,
+        "user_message": user_message.strip(),
+        "history": conversation_history,
+        "messages": messages,
+        "tools": tools,
+        "llm_provider": llm_provider,
+        "api_key": api_key,
+        "cache_key": get_cache_key_for_recommendation(username, query_hash),
+    }, None
+
+
+def save_user_turn(chat: dict) -> list:
+    """Store the chat history with the new user message in Redis and return it."""
+    chat_history = chat["history"] + [{"role": "user", "content": chat["user_message"]}]
+    try:
+        cache_set(get_cache_key_for_chat(chat["username"]), chat_history, ttl=86400 * 7)
+    except Exception as e:
+        print(f"Failed to cache chat history: {e}")
+    return chat_history
+
+
+def save_assistant_turn(chat: dict, chat_history: list, result: dict):
+    """Cache a successful answer and append it to the chat history."""
+    cache_set(chat["cache_key"], result, ttl=3600)
+    try:
+        updated_history = chat_history + [{"role": "assistant", "content": result.get("message", "")}]
+        cache_set(get_cache_key_for_chat(chat["username"]), updated_history, ttl=86400 * 7)  # 7 days
+    except Exception as e:
+        print(f"Failed to update chat history with AI response: {e}")
+
+
+def handle_chat_message(request: Request):
+    """Handle chat message with extensive error handling."""
+    try:
+        chat, error = prepare_chat(request)
+        if error:
+            return error
         
         # Step 6: Check cache for similar recommendations
-        query_hash = hashlib.md5(user_message.strip().lower().encode()).hexdigest()
-        cache_key = get_cache_key_for_recommendation(username, query_hash)
-        cached_response = cache_get(cache_key)
+        cached_response = cache_get(chat["cache_key"])
         
         if cached_response:
-            print(f"Cache hit for query: {user_message[:50]}...")
+            print(f"Cache hit for query: {chat['user_message'][:50]}...")
             return response(200, "Cached recommendation", cached_response)
         
         # Step 7: Store chat history in Redis
-        try:
-            chat_key = get_cache_key_for_chat(username)
-            chat_history = conversation_history + [{"role": "user", "content": user_message.strip()}]
-            cache_set(chat_key, chat_history, ttl=86400 * 7)
-        except Exception as e:
-            print(f"Failed to cache chat history: {e}")
+        chat_history = save_user_turn(chat)
         
         # Step 8: Process LLM call synchronously
         try:
-            if llm_provider == 'anthropic':
-                result = call_anthropic_api(api_key, messages, tools, username)
+            if chat["llm_provider"] == 'anthropic':
+                result = call_anthropic_api(chat["api_key"], chat["messages"], chat["tools"], chat["username"])
             else:
-                return response(400, f"Unsupported LLM provider: {llm_provider}")
+                return response(400, f"Unsupported LLM provider: {chat['llm_provider']}")
             
             # Handle result (can be dict with error or success data)
             if isinstance(result, dict):
                 if "error" in result:
                     return response(500, result["error"])
                 else:
-                    # Cache successful responses
-                    cache_set(cache_key, result, ttl=3600)
-                    # Update chat history with AI response
-                    try:
-                        chat_key = get_cache_key_for_chat(username)
-                        updated_history = chat_history + [{"role": "assistant", "content": result.get("message", "")}]
-                        cache_set(chat_key, updated_history, ttl=86400 * 7)  # 7 days
-                    except Exception as e:
-                        print(f"Failed to update chat history with AI response: {e}")
+                    # Cache successful responses and update chat history with AI response
+                    save_assistant_turn(chat, chat_history, result)
                     return response(200, "Chat response generated", result)
             else:
                 # Legacy response object
@@ -224,7 +275,7 @@ Use the available tools to get user information when needed. Be conversational a
                     try:
                         result_data = json.loads(result.get_data(as_text=True))
                         if result_data.get('code') == 200:
-                            cache_set(cache_key, result_data.get('data', {}), ttl=3600)
+                            cache_set(chat["cache_key"], result_data.get('data', {}), ttl=3600)
                     except:
                         pass
                 return result
@@ -240,35 +291,171 @@ Use the available tools to get user information when needed. Be conversational a
         return response(500, f"Internal server error: {str(e)}")
 
 
+def sse_event(event: str, data) -> bytes:
+    """One server-sent event; JSON never contains a raw newline, so data fits on one line."""
+    return b"event: %s\ndata: %s\n\n" % (event.encode(), serialization.dumps(data))
+
+
+def handle_chat_stream(request: Request):
+    """Streaming /api/chat: the answer arrives as server-sent events while it is generated.
+
+    Events: start (sent at once), text {delta}, tool_call {name} when the model starts a
+    tool call, tool_result {name, arguments} once it has run, then done with the same data
+    /api/chat returns (plus "cached" for a cached answer), or error {message}. Requests
+    that fail validation get the usual JSON response instead of a stream.
+    """
+    try:
+        chat, error = prepare_chat(request)
+        if error:
+            return error
+        if chat["llm_provider"] != 'anthropic':
+            return response(400, f"Unsupported LLM provider: {chat['llm_provider']}")
+    except Exception as e:
+        print(f"Unhandled chat error: {e}")
+        traceback.print_exc()
+        return response(500, f"Internal server error: {str(e)}")
+
+    def events():
+        yield sse_event("start", {})
+        try:
+            cached_response = cache_get(chat["cache_key"])
+            if cached_response:
+                print(f"Cache hit for query: {chat['user_message'][:50]}...")
+                yield sse_event("text", {"delta": cached_response.get("message", "")})
+                yield sse_event("done", {**cached_response, "cached": True})
+                return
+
+            chat_history = save_user_turn(chat)
+            for event, data in stream_anthropic_api(chat["api_key"], chat["messages"], chat["tools"],
+                                                    chat["username"]):
+                if event == "done":
+                    save_assistant_turn(chat, chat_history, data)
+                yield sse_event(event, data)
+        except Exception as e:
+            print(f"Chat stream error: {e}")
+            traceback.print_exc()
+            yield sse_event("error", {"message": f"Internal server error: {str(e)}"})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+def to_anthropic_messages(messages: list):
+    """(system prompt, non-empty user/assistant messages) for the Messages API."""
+    anthropic_messages = []
+    system_content = None
+    
+    for msg in messages:
+        if msg["role"] == "system":
+            system_content = msg["content"]
+        else:
+            content = msg.get("content", "")
+            if content and isinstance(content, str) and len(content.strip()) > 0:
+                anthropic_messages.append({"role": msg["role"], "content": content.strip()})
+    return system_content, anthropic_messages
+
+
+def tool_use_message(tool_use_blocks) -> dict:
+    """The assistant turn that requested `tool_use_blocks`, to send back with their results."""
+    return {"role": "assistant", "content": [
+        {"type": "tool_use", "id": block.id, "name": block.name, "input": block.input}
+        for block in tool_use_blocks
+    ]}
+
+
+def run_tool_call(block, username: str, memo: ToolMemo = None, call_info: dict = None) -> dict:
+    """Run one tool_use block and return its tool_result block."""
+    try:
+        tool_result = call_mcp_tool(block.name, block.input, username, memo, call_info)
+        return {
+            "type": "tool_result",
+            "tool_use_id": block.id,
+            "content": tool_result
+        }
+    except Exception as e:
+        print(f"Tool execution error: {e}")
+        return {
+            "type": "tool_result",
+            "tool_use_id": block.id,
+            "content": json.dumps({"error": f"Tool execution failed: {str(e)}"})
+        }
+
+
+def in_worker_context(func):
+    """Wrap func to run once on another thread inside a copy of the current context.
+
+    Call this on the request's thread, once per task. The copy brings its own app context, so Flask-SQLAlchemy hands the worker its own
+    session (closed when the worker finishes). The request's g (decoded JWT, identity)
+    is carried over, except that the worker charges Server-Timing to a fresh dict of its
+    own, exposed as run.request_timings for request_timing.merge_concurrent().
+    """
+    if has_request_context():
+        request_globals = dict(g.__dict__)
+        timings = {}
+
+        @copy_current_request_context
+        def run():
+            g.__dict__.update(request_globals)
+            g.request_timings = timings
+            return func()
+        run.request_timings = timings
+        return run
+    if has_app_context():
+        app = current_app._get_current_object()
+
+        def run():
+            with app.app_context():
+                return func()
+        return run
+    return func
+
+
+def run_tool_calls(tool_use_blocks, username: str, tools_called: list, memo: ToolMemo = None) -> list:
+    """Run the requested tools and return their tool_result blocks, in block order.
+
+    The calls of one turn are independent, so they run concurrently on up to
+    CHAT_TOOL_CONCURRENCY threads.
+    """
+    calls = [{"name": block.name, "arguments": block.input} for block in tool_use_blocks]
+    tools_called.extend(calls)
+    if len(tool_use_blocks) <= 1 or CHAT_TOOL_CONCURRENCY <= 1:
+        return [run_tool_call(block, username, memo, call) for block, call in zip(tool_use_blocks, calls)]
+
+    tasks = [in_worker_context(partial(run_tool_call, block, username, memo, call))
+             for block, call in zip(tool_use_blocks, calls)]
+    workers = min(len(tasks), CHAT_TOOL_CONCURRENCY)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chat-tool") as pool:
+        futures = [pool.submit(task) for task in tasks]
+        results = [future.result() for future in futures]
+    request_timing.merge_concurrent(getattr(task, "request_timings", {}) for task in tasks)
+    return results
+
+
 def call_anthropic_api(api_key: str, messages: list, tools: list, username: str = None):
     """Call Anthropic API with improved error handling."""
     try:
         import anthropic
         
         client = anthropic.Anthropic(api_key=api_key)
-        
-        anthropic_messages = []
-        system_content = None
-        
-        for msg in messages:
-            if msg["role"] == "system":
-                system_content = msg["content"]
-            else:
-                content = msg.get("content", "")
-                if content and isinstance(content, str) and len(content.strip()) > 0:
-                    anthropic_messages.append({"role": msg["role"], "content": content.strip()})
+        system_content, anthropic_messages = to_anthropic_messages(messages)
         
         if len(anthropic_messages) == 0:
             return {"error": "No valid messages to process"}
         
-        max_iterations = 5
+        max_iterations = MAX_TOOL_ITERATIONS
         iteration = 0
         tools_called = []
+        # One memo per chat message, shared by all its model turns
+        memo = ToolMemo()
+        
+        model = os.getenv('LLM_MODEL', 'claude-3-5-haiku-20241022')
         
         while iteration < max_iterations:
+            start = time.perf_counter()
+            api_response = None
             try:
                 api_response = client.messages.create(
-                    model=os.getenv('LLM_MODEL', 'claude-3-5-haiku-20241022'),
+                    model=model,
                     max_tokens=1024,
                     system=system_content,
                     messages=anthropic_messages,
@@ -292,6 +479,11 @@ def call_anthropic_api(api_key: str, messages: list, tools: list, username: str
                 print(error_msg)
                 traceback.print_exc()
                 return {"error": error_msg}
+            finally:
+                usage = getattr(api_response, "usage", None)
+                metrics.observe_llm("anthropic", model, "ok" if api_response is not None else "error",
+                                    time.perf_counter() - start,
+                                    getattr(usage, "input_tokens", 0), getattr(usage, "output_tokens", 0))
             
             assistant_content = []
             tool_use_blocks = []
@@ -309,39 +501,13 @@ def call_anthropic_api(api_key: str, messages: list, tools: list, username: str
                         "input_tokens": api_response.usage.input_tokens,
                         "output_tokens": api_response.usage.output_tokens
                     },
-                    "tools_called": tools_called
+                    "tools_called": tools_called,
+                    "tool_memo": memo.stats()
                 }
             
             if tool_use_blocks:
-                assistant_message_content = []
-                for block in tool_use_blocks:
-                    assistant_message_content.append({
-                        "type": "tool_use",
-                        "id": block.id,
-                        "name": block.name,
-                        "input": block.input
-                    })
-                
-                anthropic_messages.append({"role": "assistant", "content": assistant_message_content})
-                
-                tool_results = []
-                for block in tool_use_blocks:
-                    tools_called.append({"name": block.name, "arguments": block.input})
-                    try:
-                        tool_result = call_mcp_tool(block.name, block.input, username)
-                        tool_results.append({
-                            "type": "tool_result",
-                            "tool_use_id": block.id,
-                            "content": tool_result
-                        })
-                    except Exception as e:
-                        print(f"Tool execution error: {e}")
-                        tool_results.append({
-                            "type": "tool_result",
-                            "tool_use_id": block.id,
-                            "content": json.dumps({"error": f"Tool execution failed: {str(e)}"})
-                        })
-                
+                anthropic_messages.append(tool_use_message(tool_use_blocks))
+                tool_results = run_tool_calls(tool_use_blocks, username, tools_called, memo)
                 anthropic_messages.append({"role": "user", "content": tool_results})
                 iteration += 1
                 continue
@@ -359,3 +525,80 @@ def call_anthropic_api(api_key: str, messages: list, tools: list, username: str
         return {"error": error_msg}
 
 
+def stream_anthropic_api(api_key: str, messages: list, tools: list, username: str = None):
+    """Streaming call_anthropic_api: yields (event, data) pairs while the answer is generated.
+
+    Text deltas are passed on as the SDK delivers them; tool calls run between model
+    turns as in call_anthropic_api. Ends with ("done", result) or ("error", {"message"}).
+    """
+    try:
+        import anthropic
+    except ImportError:
+        yield "error", {"message": "Anthropic SDK not installed"}
+        return
+
+    client = anthropic.Anthropic(api_key=api_key)
+    system_content, anthropic_messages = to_anthropic_messages(messages)
+    if not anthropic_messages:
+        yield "error", {"message": "No valid messages to process"}
+        return
+
+    model = os.getenv('LLM_MODEL', 'claude-3-5-haiku-20241022')
+    tools_called = []
+    memo = ToolMemo()
+
+    for _ in range(MAX_TOOL_ITERATIONS):
+        start = time.perf_counter()
+        final_message = None
+        try:
+            with client.messages.stream(
+                model=model,
+                max_tokens=1024,
+                system=system_content,
+                messages=anthropic_messages,
+                tools=tools if tools else None,
+                timeout=30.0
+            ) as stream:
+                for event in stream:
+                    if event.type == "text":
+                        yield "text", {"delta": event.text}
+                    elif event.type == "content_block_start" and event.content_block.type == "tool_use":
+                        yield "tool_call", {"name": event.content_block.name}
+                final_message = stream.get_final_message()
+        except Exception as e:
+            error_msg = f"Anthropic API error: {str(e)}"
+            print(error_msg)
+            yield "error", {"message": error_msg}
+            return
+        finally:
+            usage = getattr(final_message, "usage", None)
+            metrics.observe_llm("anthropic", model, "ok" if final_message is not None else "error",
+                                time.perf_counter() - start,
+                                getattr(usage, "input_tokens", 0), getattr(usage, "output_tokens", 0))
+
+        # Like call_anthropic_api, the answer is the last turn's text; preamble streamed
+        # before a tool call is not part of it
+        text_parts = [block.text for block in final_message.content if block.type == "text"]
+        tool_use_blocks = [block for block in final_message.content if block.type == "tool_use"]
+
+        if not tool_use_blocks:
+            if text_parts:
+                yield "done", {
+                    "message": " ".join(text_parts),
+                    "usage": {
+                        "input_tokens": final_message.usage.input_tokens,
+                        "output_tokens": final_message.usage.output_tokens
+                    },
+                    "tools_called": tools_called,
+                    "tool_memo": memo.stats()
+                }
+                return
+            continue
+
+        anthropic_messages.append(tool_use_message(tool_use_blocks))
+        tool_results = run_tool_calls(tool_use_blocks, username, tools_called, memo)
+        for block in tool_use_blocks:
+            yield "tool_result", {"name": block.name, "arguments": block.input}
+        anthropic_messages.append({"role": "user", "content": tool_results})
+
+    yield "error", {"message": "Max iterations reached in tool calling"}
@@ -0,0 +1,83 @@
+"""
+Circuit breaker for calls to an optional backing service (Redis).
+
+closed     calls go through; consecutive failures are counted
+open       calls fail fast until the backoff elapses
+half_open  one caller probes the service; success closes the breaker,
+           failure re-opens it with the backoff doubled (up to max_backoff)
+"""
+import threading
+import time
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+
+class CircuitBreaker:
+
+    def __init__(self, failure_threshold: int = 3, base_backoff: float = 1.0, max_backoff: float = 60.0):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.state = CLOSED
+        self.consecutive_failures = 0
+        self.open_count = 0
+        self.backoff = 0.0
+        self.opened_at = None
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow_request(self) -> bool:
+        """True if the caller may use the service. After the backoff, exactly one caller gets True
+        and must report the outcome of its probe; everyone else keeps failing fast meanwhile."""
+        if self.state == CLOSED:
+            return True
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self.opened_at >= self.backoff:
+                self.state = HALF_OPEN
+                return True
+            return self.state == CLOSED
+
+    def record_success(self):
+        if self.state == CLOSED and not self.consecutive_failures:
+            return
+        with self._lock:
+            self.state = CLOSED
+            self.consecutive_failures = 0
+            self.open_count = 0
+            self.backoff = 0.0
+            self.opened_at = None
+
+    def record_failure(self, error: Exception = None):
+        with self._lock:
+            self.last_error = repr(error) if error else None
+            self.consecutive_failures += 1
+            if self.state == OPEN:
+                # Stragglers that were already in flight when the breaker opened
+                return
+            if self.state == HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                self.open_count += 1
+                self.backoff = min(self.base_backoff * 2 ** (self.open_count - 1), self.max_backoff)
+                self.opened_at = time.monotonic()
+                self.state = OPEN
+
+    def trip(self, error: Exception = None):
+        """Open immediately, e.g. when connecting or the half-open probe fails."""
+        with self._lock:
+            self.consecutive_failures = max(self.consecutive_failures, self.failure_threshold - 1)
+        self.record_failure(error)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            retry_in = None
+            if self.state == OPEN:
+                retry_in = round(max(self.backoff - (time.monotonic() - self.opened_at), 0.0), 3)
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "open_count": self.open_count,
+                "backoff_seconds": self.backoff,
+                "retry_in_seconds": retry_in,
+                "last_error": self.last_error,
+            }
@@ -0,0 +1,63 @@
+"""
+Cooperative I/O for the gevent server.
+
+pywsgi serves every request in its own greenlet, but greenlets only switch on I/O
+that gevent knows about. enable() makes all the blocking I/O in the app cooperative:
+
+    monkey.patch_all()   socket, ssl, select, time.sleep and threading, which covers
+                         redis-py, requests (USDA lookups) and the httpx client inside
+                         the Anthropic/OpenAI SDKs
+    psycopg2             its C library does its own socket I/O, so it gets a wait
+                         callback that yields to the hub while a query is in flight
+
+It must run before anything imports socket, ssl or threading; server.py calls it first
+thing when started as the main program (GEVENT_COOPERATIVE=false turns it off).
+Importers of server.py (tests, Celery, manage.py) are never patched.
+
+With the wait callback installed psycopg2 refuses COPY, so the bulk FDC loader keeps
+running outside the server process.
+"""
+import os
+
+GEVENT_COOPERATIVE = os.getenv('GEVENT_COOPERATIVE', 'true').lower() == 'true'
+
+_enabled = False
+
+
+def gevent_wait_callback(conn, timeout=None):
+    """psycopg2 wait callback: poll the connection, parking this greenlet until its socket is ready."""
+    import psycopg2
+    from psycopg2 import extensions
+    from gevent.socket import wait_read, wait_write
+
+    while True:
+        state = conn.poll()
+        if state == extensions.POLL_OK:
+            break
+        elif state == extensions.POLL_READ:
+            wait_read(conn.fileno(), timeout=timeout)
+        elif state == extensions.POLL_WRITE:
+            wait_write(conn.fileno(), timeout=timeout)
+        else:
+            raise psycopg2.OperationalError(f"Bad result from poll: {state!r}")
+
+
+def patch_psycopg():
+    from psycopg2 import extensions
+    extensions.set_wait_callback(gevent_wait_callback)
+
+
+def enable():
+    """Monkey-patch the stdlib and make psycopg2 cooperative. Safe to call more than once."""
+    global _enabled
+    if _enabled:
+        return
+    from gevent import monkey
+    monkey.patch_all()
+    patch_psycopg()
+    _enabled = True
+    print("gevent cooperative mode enabled")
+
+
+def is_enabled() -> bool:
+    return _enabled
@@ -25,31 +25,89 @@ CREATE TABLE IF NOT EXISTS food (
     carbs NUMERIC NOT NULL,
     fat NUMERIC NOT NULL,
     serving_unit VARCHAR(50) DEFAULT 'g',
+    fdc_id INTEGER,
     created_at TIMESTAMP DEFAULT NOW(),
     updated_at TIMESTAMP DEFAULT NOW()
 );
 
+-- FoodData Central id for foods loaded from a release file (NULL for foods added by live lookups)
+ALTER TABLE food ADD COLUMN IF NOT EXISTS fdc_id INTEGER;
+
 -- User intake table
 CREATE TABLE IF NOT EXISTS user_intake (
     id SERIAL PRIMARY KEY,
     user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
-    food_id INTEGER NOT NULL REFERENCES food(id) ON DELETE CASCADE,
+    food_id INTEGER REFERENCES food(id) ON DELETE CASCADE,
+    pending_food_name VARCHAR(255),
+    status VARCHAR(20) NOT NULL DEFAULT 'ready',
     quantity NUMERIC NOT NULL,
     intake_date DATE NOT NULL,
     meal_type VARCHAR(50),
-    created_at TIMESTAMP DEFAULT NOW(),
+    created_at TIMESTAMP NOT NULL DEFAULT NOW(),
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- created_at is part of the retrieve_log keyset, where a NULL would drop the row from
+-- every page after the first; older rows without one take their last update or log date
+UPDATE user_intake SET created_at = COALESCE(updated_at, intake_date::timestamp) WHERE created_at IS NULL;
+ALTER TABLE user_intake ALTER COLUMN created_at SET DEFAULT NOW();
+ALTER TABLE user_intake ALTER COLUMN created_at SET NOT NULL;
+
+-- Entries logged in async mode wait for their food ('pending') until a worker resolves it ('ready' or 'failed')
+ALTER TABLE user_intake ALTER COLUMN food_id DROP NOT NULL;
+ALTER TABLE user_intake ADD COLUMN IF NOT EXISTS pending_food_name VARCHAR(255);
+ALTER TABLE user_intake ADD COLUMN IF NOT EXISTS status VARCHAR(20) NOT NULL DEFAULT 'ready';
+
+-- USDA lookup cache keyed by normalized query: 'found' rows point at the food, 'not_found' rows (food_id NULL)
+-- remember misses, and a 'pending' row is a worker's claim while it calls USDA. Errors are never cached
+CREATE TABLE IF NOT EXISTS usda_lookup_cache (
+    query_key TEXT PRIMARY KEY,
+    food_id INTEGER REFERENCES food(id) ON DELETE CASCADE,
+    status VARCHAR(20) NOT NULL,
+    expires_at TIMESTAMP NOT NULL,
+    updated_at TIMESTAMP DEFAULT NOW()
+);
+
+-- Per-day nutrition rollup, maintained by the intake write paths in the same transaction
+CREATE TABLE IF NOT EXISTS daily_totals (
+    user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+    day DATE NOT NULL,
+    calories NUMERIC NOT NULL DEFAULT 0,
+    protein NUMERIC NOT NULL DEFAULT 0,
+    carbs NUMERIC NOT NULL DEFAULT 0,
+    fat NUMERIC NOT NULL DEFAULT 0,
+    entry_count INTEGER NOT NULL DEFAULT 0,
+    updated_at TIMESTAMP DEFAULT NOW(),
+    PRIMARY KEY (user_id, day)
+);
+
+-- Checkpoints for resumable FoodData Central bulk loads (python manage.py load-fdc)
+CREATE TABLE IF NOT EXISTS fdc_import_progress (
+    source TEXT PRIMARY KEY,
+    rows_done INTEGER NOT NULL DEFAULT 0,
     updated_at TIMESTAMP DEFAULT NOW()
 );
 
 -- Create indexes for better performance
 CREATE INDEX IF NOT EXISTS idx_user_intake_user_id ON user_intake(user_id);
 CREATE INDEX IF NOT EXISTS idx_user_intake_date ON user_intake(intake_date);
+-- Keyset pagination of a user's log, newest first (retrieve_log)
+CREATE INDEX IF NOT EXISTS idx_user_intake_keyset ON user_intake (user_id, intake_date DESC, created_at DESC, id DESC);
 CREATE INDEX IF NOT EXISTS idx_food_name ON food(name);
+CREATE UNIQUE INDEX IF NOT EXISTS idx_food_fdc_id ON food(fdc_id);
+
+-- Food name search: LOWER(name) equality and prefix lookups, trigram fuzzy matching
+CREATE EXTENSION IF NOT EXISTS pg_trgm;
+CREATE INDEX IF NOT EXISTS idx_food_name_lower ON food (LOWER(name) text_pattern_ops);
+CREATE INDEX IF NOT EXISTS idx_food_name_trgm ON food USING gist (LOWER(name) gist_trgm_ops);
 
 -- Add comments
 COMMENT ON TABLE users IS 'User profiles and authentication';
 COMMENT ON TABLE food IS 'Food items with nutrition data';
 COMMENT ON TABLE user_intake IS 'User food intake logs';
+COMMENT ON TABLE usda_lookup_cache IS 'Remembered USDA FoodData Central lookups: found, not found, or pending claims';
+COMMENT ON TABLE daily_totals IS 'Per-user daily calorie and macro totals (rollup of user_intake)';
+COMMENT ON TABLE fdc_import_progress IS 'Foods processed per FoodData Central release load';
 
 
 
@@ -1,3 +1,233 @@
+"""
+Database handle and connection-pool configuration.
+
+DB_POOL_MODE
+    queue  (default) keep up to DB_POOL_SIZE + DB_MAX_OVERFLOW connections open,
+           recycled after DB_POOL_RECYCLE seconds and optionally pinged on checkout
+    null   open a connection per checkout and close it on checkin, for running behind a
+           transaction-mode pooler (Supabase on port 6543, PgBouncer) that already pools
+
+Transaction-mode poolers hand each transaction to an arbitrary server connection, so
+nothing may rely on session state between transactions. psycopg2 interpolates
+parameters client-side and never creates server-side prepared statements; for the
+psycopg 3 driver automatic preparation is switched off in engine_options().
+
+Both pool classes time every checkout, so get_pool_stats() can tell pool waits apart
+from query time. Checkout waits and the latency of every SQL statement are also
+exported as Prometheus metrics (see metrics.py).
+
+Statements slower than SLOW_QUERY_MS are printed as one "Slow query:" JSON line
+with the SQL, the types (never the values) of its parameters, the duration, the app
+function that issued it and, inside a request, the handler, path and user.
+"""
+import json
+import os
+import sys
+import threading
+import time
+
+from flask import has_request_context, request
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, exc
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import NullPool, QueuePool
+
+import metrics
+
+DB_POOL_MODE = os.getenv('DB_POOL_MODE', 'queue').lower()
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', 5))
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', 10))
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', 30))
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', 1800))
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'
+DB_CONNECT_TIMEOUT = int(os.getenv('DB_CONNECT_TIMEOUT', 10))
+SLOW_QUERY_MS = float(os.getenv('SLOW_QUERY_MS', 200))   # 0 turns the log off
+SLOW_QUERY_MAX_SQL = 2000
+
+_THIS_FILE = os.path.abspath(__file__)
+BACKEND_DIR = os.path.dirname(_THIS_FILE)
+
+db = SQLAlchemy()
+
+
+class PoolStats:
+    """Checkout counters and wait times shared by every instrumented pool in the process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.checkouts = 0
+            self.checked_out = 0
+            self.connects = 0
+            self.timeouts = 0
+            self.wait_seconds_total = 0.0
+            self.wait_seconds_max = 0.0
+
+    def record_wait(self, seconds: float, timed_out: bool = False):
+        with self._lock:
+            self.wait_seconds_total += seconds
+            self.wait_seconds_max = max(self.wait_seconds_max, seconds)
+            if timed_out:
+                self.timeouts += 1
+
+    def record_checkout(self):
+        with self._lock:
+            self.checkouts += 1
+            self.checked_out += 1
+            metrics.set_pool_checked_out(self.checked_out)
+
+    def record_checkin(self):
+        with self._lock:
+            self.checked_out -= 1
+            metrics.set_pool_checked_out(self.checked_out)
+
+    def record_connect(self):
+        with self._lock:
+            self.connects += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "checkouts": self.checkouts,
+                "checked_out": self.checked_out,
+                "connects": self.connects,
+                "timeouts": self.timeouts,
+                "wait_seconds_total": round(self.wait_seconds_total, 6),
+                "wait_seconds_max": round(self.wait_seconds_max, 6),
+                "wait_seconds_avg": round(self.wait_seconds_total / self.checkouts, 6) if self.checkouts else 0.0,
+            }
+
+
+pool_stats = PoolStats()
+
+
+class _TimedCheckout:
+    """Times _do_get, i.e. waiting for a free connection (and opening one when the pool may grow)."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        timed_out = False
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            timed_out = True
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            pool_stats.record_wait(waited, timed_out)
+            metrics.observe_pool_wait(waited, timed_out)
+            self._report_overflow()
+
+    def _do_return_conn(self, conn):
+        super()._do_return_conn(conn)
+        self._report_overflow()
+
+    def _report_overflow(self):
+        pass
+
+
+class InstrumentedQueuePool(_TimedCheckout, QueuePool):
+    def _report_overflow(self):
+        metrics.set_pool_overflow(self.overflow())
+
+
+class InstrumentedNullPool(_TimedCheckout, NullPool):
+    pass
+
+
+for _pool_class in (InstrumentedQueuePool, InstrumentedNullPool):
+    event.listen(_pool_class, 'connect', lambda dbapi_connection, record: pool_stats.record_connect())
+    event.listen(_pool_class, 'checkout', lambda dbapi_connection, record, proxy: pool_stats.record_checkout())
+    event.listen(_pool_class, 'checkin', lambda dbapi_connection, record: pool_stats.record_checkin())
+
+
+# Every statement on every engine, including the query()/execute() helpers in functions.py
+@event.listens_for(Engine, 'before_cursor_execute')
+def _start_statement_timer(conn, cursor, statement, parameters, context, executemany):
+    context._statement_start = time.perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_statement_time(conn, cursor, statement, parameters, context, executemany):
+    seconds = time.perf_counter() - context._statement_start
+    metrics.observe_db_query(statement, seconds)
+    if 0 < SLOW_QUERY_MS <= seconds * 1000:
+        log_slow_query(statement, parameters, seconds, executemany)
+
+
+def parameter_shape(parameters, executemany: bool = False):
+    """Names and types of bound parameters, without their values."""
+    if executemany and isinstance(parameters, (list, tuple)):
+        return {"rows": len(parameters), "row": parameter_shape(parameters[0]) if parameters else None}
+    if isinstance(parameters, dict):
+        return {name: type(value).__name__ for name, value in parameters.items()}
+    if isinstance(parameters, (list, tuple)):
+        return [type(value).__name__ for value in parameters]
+    return None
+
+
+def _calling_function():
+    """file:line and name of the innermost app frame outside this module and the query helpers."""
+    frame = sys._getframe(1)
+    while frame is not None:
+        code = frame.f_code
+        filename = os.path.abspath(code.co_filename)
+        helper = filename.endswith('functions.py') and code.co_name in ('query', 'execute')
+        if filename.startswith(BACKEND_DIR) and filename != _THIS_FILE and not helper:
+            return f"{os.path.relpath(filename, BACKEND_DIR)}:{frame.f_lineno} {code.co_name}"
+        frame = frame.f_back
+    return None
+
+
+def _request_user():
+    try:
+        from flask_jwt_extended import get_jwt_identity
+        return get_jwt_identity()
+    except Exception:
+        return None
+
+
+def log_slow_query(statement: str, parameters, seconds: float, executemany: bool = False):
+    entry = {
+        "duration_ms": round(seconds * 1000, 1),
+        "sql": " ".join(statement.split())[:SLOW_QUERY_MAX_SQL],
+        "params": parameter_shape(parameters, executemany),
+        "caller": _calling_function(),
+    }
+    if has_request_context():
+        entry.update(handler=request.endpoint, method=request.method, path=request.path, user=_request_user())
+    print(f"Slow query: {json.dumps(entry, default=str)}")
+
+
+def engine_options(database_uri: str = '') -> dict:
+    """SQLALCHEMY_ENGINE_OPTIONS for the configured DB_POOL_MODE."""
+    connect_args = {'connect_timeout': DB_CONNECT_TIMEOUT}
+    if database_uri.startswith('postgresql+psycopg:'):
+        connect_args['prepare_threshold'] = None
+
+    if DB_POOL_MODE == 'null':
+        return {'poolclass': InstrumentedNullPool, 'connect_args': connect_args}
+    if DB_POOL_MODE != 'queue':
+        print(f"Unknown DB_POOL_MODE '{DB_POOL_MODE}', using queue")
+    return {
+        'poolclass': InstrumentedQueuePool,
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+        'connect_args': connect_args,
+    }
+
 
-db = SQLAlchemy()
\ No newline at end of file
+def get_pool_stats(engine=None) -> dict:
+    """Checkout counters and wait times, plus the live pool status when an engine is given."""
+    stats = {"mode": DB_POOL_MODE, **pool_stats.snapshot()}
+    pool = getattr(engine, 'pool', None)
+    if isinstance(pool, QueuePool):
+        stats.update(size=pool.size(), overflow=pool.overflow(), idle=pool.checkedin(),
+                     max_overflow=DB_MAX_OVERFLOW)
+    return stats
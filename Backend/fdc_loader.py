@@ -0,0 +1,299 @@
+"""
+Offline bulk loader for USDA FoodData Central release files.
+
+Reads a release from local disk, either the CSV download (a directory holding
+food.csv, nutrient.csv and food_nutrient.csv) or the JSON download (one file per
+data type, e.g. FoodData_Central_foundation_food_json_*.json). Every food goes
+through extract_usda_macros, the same nutrient mapping the live USDA lookup uses,
+and lands in the food table through Postgres COPY in batches.
+
+Loads are idempotent (food.fdc_id is unique and conflicting rows are skipped) and
+resumable: each batch commits together with a checkpoint in fdc_import_progress,
+so an interrupted load picks up after the last committed batch.
+"""
+import csv
+import io
+import json
+import os
+import sys
+import time
+from sqlalchemy import text
+from database import db
+from functions import extract_usda_macros
+
+DEFAULT_DATA_TYPES = ('foundation', 'sr_legacy', 'survey_fndds')
+DEFAULT_BATCH_SIZE = 5000
+
+# data_type values in food.csv and the top-level keys of the JSON downloads
+CSV_DATA_TYPES = {
+    'foundation': 'foundation_food',
+    'sr_legacy': 'sr_legacy_food',
+    'survey_fndds': 'survey_fndds_food',
+    'branded': 'branded_food',
+}
+JSON_DATA_TYPES = {
+    'foundation': 'FoundationFoods',
+    'sr_legacy': 'SRLegacyFoods',
+    'survey_fndds': 'SurveyFoods',
+    'branded': 'BrandedFoods',
+}
+
+# Nutrients extract_usda_macros can use: the macro IDs plus anything its name-based fallback matches
+MACRO_NUTRIENT_IDS = {1008, 1062, 1003, 1005, 1004}
+MACRO_NAME_KEYWORDS = ('energy', 'prot', 'carb', 'cho', 'lipid', 'fat')
+
+NAME_MAX_LENGTH = 255
+
+csv.field_size_limit(sys.maxsize)
+
+
+def is_macro_nutrient(nutrient_id, name: str) -> bool:
+    name = (name or '').lower()
+    return nutrient_id in MACRO_NUTRIENT_IDS or any(keyword in name for keyword in MACRO_NAME_KEYWORDS)
+
+
+def _to_int(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_csv(path):
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        yield from csv.DictReader(f)
+
+
+def iter_csv_foods(release_dir: str, data_types=DEFAULT_DATA_TYPES):
+    """Yield (fdc_id, description, food_nutrients) for the selected data types of a CSV release.
+
+    food_nutrients uses the search API shape so it can go straight into extract_usda_macros.
+    Only macro nutrients are kept in memory; food.csv itself is streamed.
+    """
+    wanted_types = {CSV_DATA_TYPES[data_type] for data_type in data_types}
+
+    nutrients = {}
+    for row in _read_csv(os.path.join(release_dir, 'nutrient.csv')):
+        nutrient_id = _to_int(row.get('id'))
+        if nutrient_id is not None and is_macro_nutrient(nutrient_id, row.get('name')):
+            nutrients[nutrient_id] = (row.get('name', ''), row.get('unit_name', ''))
+
+    food_ids = set()
+    for row in _read_csv(os.path.join(release_dir, 'food.csv')):
+        if row.get('data_type') in wanted_types:
+            fdc_id = _to_int(row.get('fdc_id'))
+            if fdc_id is not None:
+                food_ids.add(fdc_id)
+
+    food_nutrients = {}
+    for row in _read_csv(os.path.join(release_dir, 'food_nutrient.csv')):
+        fdc_id = _to_int(row.get('fdc_id'))
+        nutrient_id = _to_int(row.get('nutrient_id'))
+        if fdc_id not in food_ids or nutrient_id not in nutrients:
+            continue
+        name, unit = nutrients[nutrient_id]
+        food_nutrients.setdefault(fdc_id, []).append({
+            'nutrientId': nutrient_id,
+            'nutrientName': name,
+            'unitName': unit,
+            'value': row.get('amount'),
+        })
+
+    for row in _read_csv(os.path.join(release_dir, 'food.csv')):
+        if row.get('data_type') not in wanted_types:
+            continue
+        fdc_id = _to_int(row.get('fdc_id'))
+        if fdc_id is None:
+            continue
+        yield fdc_id, row.get('description', ''), food_nutrients.pop(fdc_id, [])
+
+
+def _search_shape(food_nutrients):
+    """Convert release JSON nutrient entries ({"nutrient": {...}, "amount": ...}) to the search API shape."""
+    for entry in food_nutrients or []:
+        nutrient = entry.get('nutrient') or {}
+        yield {
+            'nutrientId': nutrient.get('id'),
+            'nutrientName': nutrient.get('name', ''),
+            'unitName': nutrient.get('unitName', ''),
+            'value': entry.get('amount'),
+        }
+
+
+def iter_json_foods(path: str, data_types=DEFAULT_DATA_TYPES):
+    """Yield (fdc_id, description, food_nutrients) from a JSON release file.
+
+    Streams with ijson when it is installed; otherwise the whole file is parsed in memory.
+    """
+    wanted_keys = [JSON_DATA_TYPES[data_type] for data_type in data_types]
+    try:
+        import ijson
+    except ImportError:
+        ijson = None
+
+    if ijson:
+        with open(path, 'rb') as f:
+            for key in wanted_keys:
+                f.seek(0)
+                for food in ijson.items(f, f'{key}.item', use_float=True):
+                    yield food.get('fdcId'), food.get('description', ''), list(_search_shape(food.get('foodNutrients')))
+        return
+
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    for key in wanted_keys:
+        for food in data.get(key, []):
+            yield food.get('fdcId'), food.get('description', ''), list(_search_shape(food.get('foodNutrients')))
+
+
+def iter_release_foods(path: str, data_types=DEFAULT_DATA_TYPES):
+    if os.path.isdir(path):
+        return iter_csv_foods(path, data_types)
+    return iter_json_foods(path, data_types)
+
+
+def to_food_row(fdc_id, description, food_nutrients):
+    """Map a release food to a food table row, or None when it lacks usable nutrition data."""
+    if fdc_id is None or not description:
+        return None
+    macros = extract_usda_macros(food_nutrients)
+    if not macros:
+        return None
+    return {
+        'fdc_id': int(fdc_id),
+        'name': ' '.join(description.split())[:NAME_MAX_LENGTH],
+        **macros,
+        'serving_unit': 'g',
+    }
+
+
+def _copy_value(value):
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def copy_food_batch(rows, source: str, rows_done: int) -> int:
+    """COPY a batch into the food table and advance the checkpoint in the same transaction.
+
+    Returns the number of foods inserted (rows whose fdc_id already exists are skipped).
+    """
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write('\t'.join(_copy_value(row[column]) for column in
+                               ('fdc_id', 'name', 'calories', 'protein', 'carbs', 'fat', 'serving_unit')))
+        buffer.write('\n')
+    buffer.seek(0)
+
+    connection = db.engine.raw_connection()
+    try:
+        cursor = connection.cursor()
+        cursor.execute("""
+            CREATE TEMP TABLE fdc_food_stage (
+                fdc_id INTEGER,
+                name VARCHAR(255),
+                calories NUMERIC,
+                protein NUMERIC,
+                carbs NUMERIC,
+                fat NUMERIC,
+                serving_unit VARCHAR(50)
+            ) ON COMMIT DROP
+        """)
+        cursor.copy_expert(
+            "COPY fdc_food_stage (fdc_id, name, calories, protein, carbs, fat, serving_unit) FROM STDIN",
+            buffer
+        )
+        cursor.execute("""
+            INSERT INTO food (fdc_id, name, calories, protein, carbs, fat, serving_unit)
+            SELECT DISTINCT ON (fdc_id) fdc_id, name, calories, protein, carbs, fat, serving_unit
+            FROM fdc_food_stage
+            ORDER BY fdc_id
+            ON CONFLICT (fdc_id) DO NOTHING
+        """)
+        inserted = cursor.rowcount
+        cursor.execute("""
+            INSERT INTO fdc_import_progress (source, rows_done)
+            VALUES (%s, %s)
+            ON CONFLICT (source) DO UPDATE SET rows_done = EXCLUDED.rows_done, updated_at = NOW()
+        """, (source, rows_done))
+        connection.commit()
+        return inserted
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+
+def get_progress(source: str) -> int:
+    row = db.session.execute(
+        text("SELECT rows_done FROM fdc_import_progress WHERE source = :source"),
+        {"source": source}
+    ).fetchone()
+    db.session.commit()
+    return row[0] if row else 0
+
+
+def reset_progress(source: str):
+    db.session.execute(text("DELETE FROM fdc_import_progress WHERE source = :source"), {"source": source})
+    db.session.commit()
+
+
+def progress_source(path: str, data_types) -> str:
+    return f"{os.path.abspath(path)}|{','.join(sorted(data_types))}"
+
+
+def load_fdc_release(path: str, data_types=DEFAULT_DATA_TYPES, batch_size: int = DEFAULT_BATCH_SIZE,
+                     restart: bool = False, total: int = None, report=print):
+    """Load a FoodData Central release into the food table.
+
+    Returns a summary dict with the number of release foods read, foods inserted,
+    foods skipped for missing nutrition data and the checkpoint it started from.
+    """
+    data_types = tuple(data_types)
+    unknown = [data_type for data_type in data_types if data_type not in CSV_DATA_TYPES]
+    if unknown:
+        raise ValueError(f"Unknown FoodData Central data type(s): {', '.join(unknown)}")
+
+    source = progress_source(path, data_types)
+    if restart:
+        reset_progress(source)
+    resume_from = get_progress(source)
+    if resume_from:
+        report(f"Resuming {path} after {resume_from} food(s)")
+
+    started = time.monotonic()
+    position = 0
+    inserted = 0
+    skipped = 0
+    batch = []
+
+    def flush():
+        nonlocal inserted, batch
+        inserted += copy_food_batch(batch, source, position)
+        batch = []
+        elapsed = max(time.monotonic() - started, 1e-6)
+        rate = (position - resume_from) / elapsed
+        percent = f" ({position * 100 / total:.1f}%)" if total else ""
+        report(f"{position} food(s) processed{percent}, {inserted} inserted, {rate:.0f} foods/s")
+
+    for fdc_id, description, food_nutrients in iter_release_foods(path, data_types):
+        position += 1
+        if position <= resume_from:
+            continue
+        row = to_food_row(fdc_id, description, food_nutrients)
+        if row is None:
+            skipped += 1
+        else:
+            batch.append(row)
+        if position % batch_size == 0:
+            flush()
+
+    if position > resume_from and (batch or position % batch_size):
+        flush()
+
+    return {
+        "read": position,
+        "inserted": inserted,
+        "skipped": skipped,
+        "resumed_from": resume_from,
+        "seconds": round(time.monotonic() - started, 2),
+    }
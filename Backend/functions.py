@@ -1,13 +1,21 @@
+import base64
+import binascii
 import json
 import os
+import time
 import requests
 from datetime import date, datetime, timedelta
-from decimal import Decimal
 from flask import Request, make_response
 from werkzeug.security import generate_password_hash, check_password_hash
-from flask_jwt_extended import create_access_token, get_jwt_identity
-from sqlalchemy import text
+from flask_jwt_extended import create_access_token
+from sqlalchemy import exc, text
 from database import db
+from identity import get_current_identity, remember_user_id, token_claims
+import serialization
+import metrics
+import request_timing
+from nutrition_needs import InvalidProfile, needs_for_profile
+from analytics import compute_trends
 
 
 def response(code: int, message: str, data: any = None):
@@ -15,27 +23,39 @@ def response(code: int, message: str, data: any = None):
     if data is not None:
         res['data'] = data.__dict__ if hasattr(data, '__dict__') else data
 
-    def json_serial(obj):
-        if isinstance(obj, (datetime, date)):
-            return obj.isoformat()
-        elif isinstance(obj, Decimal):
-            return float(obj)
-        raise TypeError(f"Type {type(obj)} not serializable")
-
-    return make_response(
-        json.dumps(res, sort_keys=True, ensure_ascii=False, default=json_serial),
-        200
-    )
+    start = time.perf_counter()
+    body = serialization.dumps(res)
+    request_timing.add('serialize', time.perf_counter() - start)
+    resp = make_response(body, 200)
+    # The HTTP status is always 200; metrics label requests by this instead
+    resp.api_code = code
+    return resp
+
+def raw_response(body: bytes):
+    """Send a body that is already in response() format, e.g. one read from the cache."""
+    resp = make_response(body, 200)
+    resp.api_code = 200
+    return resp
+
+def encode_cacheable_response(message: str, data):
+    """Bodies for response(200, message, data) and for its "(cached)" replay, encoding data once."""
+    start = time.perf_counter()
+    encoded = serialization.dumps(data)
+    bodies = (serialization.encode_response(200, message, encoded),
+              serialization.encode_response(200, f"{message} (cached)", encoded))
+    request_timing.add('serialize', time.perf_counter() - start)
+    return bodies
 
 def query(sql: str, param=None):
     res = db.session.execute(text(sql), param)
     data = [dict(zip(result.keys(), result)) for result in res]
     return data
 
-def execute(sql: str, param=None):
+def execute(sql: str, param=None, commit: bool = True):
     try:
         result = db.session.execute(text(sql), param)
-        db.session.commit()
+        if commit:
+            db.session.commit()
         return result
     except Exception as e:
         db.session.rollback()
@@ -94,8 +114,10 @@ def register_user(request: Request):
         if not row:
             return response(500, 'Failed to register user')
 
+        remember_user_id(username, row['id'])
         access_token = create_access_token(
             identity=username,
+            additional_claims=token_claims(row['id']),
             expires_delta=timedelta(hours=5)
         )
 
@@ -134,8 +156,10 @@ def login_user(request: Request):
         if not check_password_hash(user['password_hash'], password):
             return response(400, 'Invalid username or password')
 
+        remember_user_id(user['username'], user['id'])
         access_token = create_access_token(
             identity=username,
+            additional_claims=token_claims(user['id']),
             expires_delta=timedelta(hours=5)
         )
 
@@ -154,16 +178,16 @@ def login_user(request: Request):
         return response(500, 'Internal server error')
 
 def get_my_profile():
-    username = get_jwt_identity()
-    if not username:
+    identity = get_current_identity()
+    if not identity:
         return response(400, "Authentication required")
 
     try:
         sql = """
             SELECT username, age, sex, height_cm, weight_kg, activity_level, goal
-            FROM users WHERE username = :username
+            FROM users WHERE id = :user_id
         """
-        result = query(sql, {"username": username})
+        result = query(sql, {"user_id": identity.user_id})
         return response(200, "Profile retrieved successfully", result[0])
     except Exception as e:
         db.session.rollback()
@@ -171,7 +195,10 @@ def get_my_profile():
         return response(500, "Failed to retrieve profile")
 
 def profile_edit(request: Request):
-    current_username = get_jwt_identity()
+    identity = get_current_identity()
+    if not identity:
+        return response(400, 'User not found')
+    current_username = identity.username
 
     data = request.get_json()
     if not data:
@@ -180,7 +207,7 @@ def profile_edit(request: Request):
     allowed_fields = {'age', 'sex', 'height_cm', 'weight_kg', 'activity_level', 'goal'}
 
     updates = {}
-    params = {'username': current_username}
+    params = {'user_id': identity.user_id}
 
     for key, value in data.items():
         if key not in allowed_fields:
@@ -198,7 +225,7 @@ def profile_edit(request: Request):
         return response(400, 'No valid fields provided to update')
 
     set_clause = ', '.join(f"{col} = :{col}" for col in updates)
-    sql = f"UPDATE users SET {set_clause} WHERE username = :username"
+    sql = f"UPDATE users SET {set_clause} WHERE id = :user_id"
 
     try:
         result = execute(sql, params)
@@ -206,13 +233,10 @@ def profile_edit(request: Request):
         if result.rowcount == 0:
             return response(400, 'User not found')
 
-        # Invalidate cache for daily needs (7-day history cache contains daily_needs)
-        # Also invalidate all nutrition-related cache since profile affects daily needs calculation
+        # The profile drives daily needs, which the cached history embeds
         try:
-            from redis_client import invalidate_nutrition_cache, cache_delete, get_cache_key_for_7day_history
-            # Invalidate 7-day history cache which contains daily_needs
-            cache_delete(get_cache_key_for_7day_history(current_username))
-            # Also invalidate all nutrition cache to ensure fresh data
+            from redis_client import invalidate_nutrition_cache, invalidate_profile_cache
+            invalidate_profile_cache(identity.user_id)
             invalidate_nutrition_cache(current_username)
         except Exception as e:
             print(f"Cache invalidation error in profile_edit: {e}")
@@ -225,12 +249,32 @@ def profile_edit(request: Request):
         return response(500, 'Failed to update profile')
 
 
+USDA_FOUND_TTL = int(os.getenv('USDA_FOUND_TTL', 86400 * 90))
+USDA_NOT_FOUND_TTL = int(os.getenv('USDA_NOT_FOUND_TTL', 86400))
+# A request calling USDA for a query holds a 'pending' claim row this long (longer than the
+# 10s request timeout); others asking for the same query poll for its result meanwhile
+USDA_CLAIM_TTL = int(os.getenv('USDA_CLAIM_TTL', 30))
+USDA_CLAIM_POLL_INTERVAL = 0.2
+
+
 def search_food_in_usda(food_name: str):
+    return fetch_usda_food(food_name)[0]
+
+
+def fetch_usda_food(food_name: str):
+    """Query FoodData Central. Returns (food, status) with status 'found', 'not_found' or 'error'."""
+    start = time.perf_counter()
+    food, status = _search_usda(food_name)
+    metrics.observe_usda(status, time.perf_counter() - start)
+    return food, status
+
+
+def _search_usda(food_name: str):
     try:
         api_key = os.getenv('USDA_API_KEY')
         if not api_key:
             print("USDA API key not configured")
-            return None
+            return None, 'error'
         search_url = "https://api.nal.usda.gov/fdc/v1/foods/search"
         query_params = {
             "api_key": api_key
@@ -251,91 +295,406 @@ def search_food_in_usda(food_name: str):
 
         if search_response.status_code != 200:
             print(f"USDA API error: {search_response.status_code}")
-            return None
+            return None, 'error'
 
         search_data = search_response.json()
 
         if not search_data.get('foods') or len(search_data['foods']) == 0:
-            return None
+            return None, 'not_found'
 
         # Try each food result until we find one with complete nutrition data
         for food_item in search_data['foods']:
-            nutrients = {}
-            for nutrient in food_item.get('foodNutrients', []):
-                nutrient_name = nutrient.get('nutrientName', '').lower()
-                nutrient_value = nutrient.get('value')
-                if nutrient_value is None:
-                    continue
-                try:
-                    nutrient_value = float(nutrient_value)
-                except (ValueError, TypeError):
-                    continue
-                nutrient_unit = nutrient.get('unitName', '').lower()
-                nutrient_id = nutrient.get('nutrientId')
-
-                # Use nutrient IDs for more reliable matching (standard USDA IDs)
-                # Energy: 1008 (kcal) or 1062 (kJ)
-                # Protein: 1003
-                # Carbohydrate: 1005
-                # Fat: 1004
-                if nutrient_id == 1008:  # Energy (kcal)
-                    nutrients['calories'] = nutrient_value
-                elif nutrient_id == 1062:  # Energy (kJ)
-                    nutrients['calories'] = nutrient_value / 4.184
-                elif nutrient_id == 1003:  # Protein
-                    if nutrient_unit == 'g':
-                        nutrients['protein'] = nutrient_value
-                elif nutrient_id == 1005:  # Carbohydrate, by difference
-                    if nutrient_unit == 'g':
-                        nutrients['carbs'] = nutrient_value
-                elif nutrient_id == 1004:  # Total lipid (fat)
-                    if nutrient_unit == 'g':
-                        nutrients['fat'] = nutrient_value
-                else:
-                    # Fallback to name-based matching if ID doesn't match
-                    if not nutrients.get('calories'):
-                        if 'energy' in nutrient_name:
-                            if 'kcal' in nutrient_unit:
-                                nutrients['calories'] = nutrient_value
-                            elif 'kj' in nutrient_unit:
-                                nutrients['calories'] = nutrient_value / 4.184
-                    if not nutrients.get('protein'):
-                        if ('protein' in nutrient_name or 'prot' in nutrient_name) and nutrient_unit == 'g':
-                            nutrients['protein'] = nutrient_value
-                    if not nutrients.get('carbs'):
-                        if ('carbohydrate' in nutrient_name or 'carb' in nutrient_name or 'cho' in nutrient_name) and nutrient_unit == 'g':
-                            nutrients['carbs'] = nutrient_value
-                    if not nutrients.get('fat'):
-                        if ('total lipid' in nutrient_name or 'fat, total' in nutrient_name or 'fat' == nutrient_name) and nutrient_unit == 'g':
-                            nutrients['fat'] = nutrient_value
-
-            # Use defaults of 0 for missing nutrients instead of failing
-            calories = nutrients.get('calories', 0)
-            protein = nutrients.get('protein', 0)
-            carbs = nutrients.get('carbs', 0)
-            fat = nutrients.get('fat', 0)
-
-            # Accept if we have at least calories and one macro (more lenient requirement)
-            if calories > 0 and (protein > 0 or carbs > 0 or fat > 0):
+            macros = extract_usda_macros(food_item.get('foodNutrients', []))
+            if macros:
                 return {
                     'name': food_item.get('description', food_name),
-                    'calories': round(calories, 2),
-                    'protein': round(protein, 2),
-                    'carbs': round(carbs, 2),
-                    'fat': round(fat, 2),
+                    **macros,
                     'serving_unit': 'g'
-                }
-        return None
+                }, 'found'
+        return None, 'not_found'
 
     except requests.exceptions.RequestException as e:
         print(f"USDA API request error: {e}")
-        return None
+        return None, 'error'
     except Exception as e:
         print(f"Error searching USDA: {e}")
+        return None, 'error'
+
+
+def extract_usda_macros(food_nutrients):
+    """Map FoodData Central nutrient entries (search API shape: nutrientId, nutrientName,
+    value, unitName) to per-100g macros. Returns None when the data is too incomplete to use.
+    """
+    nutrients = {}
+    for nutrient in food_nutrients:
+        nutrient_name = nutrient.get('nutrientName', '').lower()
+        nutrient_value = nutrient.get('value')
+        if nutrient_value is None:
+            continue
+        try:
+            nutrient_value = float(nutrient_value)
+        except (ValueError, TypeError):
+            continue
+        nutrient_unit = nutrient.get('unitName', '').lower()
+        nutrient_id = nutrient.get('nutrientId')
+
+        # Use nutrient IDs for more reliable matching (standard USDA IDs)
+        # Energy: 1008 (kcal) or 1062 (kJ)
+        # Protein: 1003
+        # Carbohydrate: 1005
+        # Fat: 1004
+        if nutrient_id == 1008:  # Energy (kcal)
+            nutrients['calories'] = nutrient_value
+        elif nutrient_id == 1062:  # Energy (kJ)
+            nutrients['calories'] = nutrient_value / 4.184
+        elif nutrient_id == 1003:  # Protein
+            if nutrient_unit == 'g':
+                nutrients['protein'] = nutrient_value
+        elif nutrient_id == 1005:  # Carbohydrate, by difference
+            if nutrient_unit == 'g':
+                nutrients['carbs'] = nutrient_value
+        elif nutrient_id == 1004:  # Total lipid (fat)
+            if nutrient_unit == 'g':
+                nutrients['fat'] = nutrient_value
+        else:
+            # Fallback to name-based matching if ID doesn't match
+            if not nutrients.get('calories'):
+                if 'energy' in nutrient_name:
+                    if 'kcal' in nutrient_unit:
+                        nutrients['calories'] = nutrient_value
+                    elif 'kj' in nutrient_unit:
+                        nutrients['calories'] = nutrient_value / 4.184
+            if not nutrients.get('protein'):
+                if ('protein' in nutrient_name or 'prot' in nutrient_name) and nutrient_unit == 'g':
+                    nutrients['protein'] = nutrient_value
+            if not nutrients.get('carbs'):
+                if ('carbohydrate' in nutrient_name or 'carb' in nutrient_name or 'cho' in nutrient_name) and nutrient_unit == 'g':
+                    nutrients['carbs'] = nutrient_value
+            if not nutrients.get('fat'):
+                if ('total lipid' in nutrient_name or 'fat, total' in nutrient_name or 'fat' == nutrient_name) and nutrient_unit == 'g':
+                    nutrients['fat'] = nutrient_value
+
+    # Use defaults of 0 for missing nutrients instead of failing
+    calories = nutrients.get('calories', 0)
+    protein = nutrients.get('protein', 0)
+    carbs = nutrients.get('carbs', 0)
+    fat = nutrients.get('fat', 0)
+
+    # Accept if we have at least calories and one macro (more lenient requirement)
+    if calories > 0 and (protein > 0 or carbs > 0 or fat > 0):
+        return {
+            'calories': round(calories, 2),
+            'protein': round(protein, 2),
+            'carbs': round(carbs, 2),
+            'fat': round(fat, 2)
+        }
+    return None
+
+
+def normalize_food_query(food_name: str) -> str:
+    return ' '.join(food_name.lower().split())
+
+
+def get_cached_usda_lookup(query_key: str, include_pending: bool = False):
+    """Return the unexpired lookup-cache entry for a normalized query, or None.
+
+    Lookups still in flight (status 'pending') are only returned with include_pending.
+    """
+    result = query("""
+        SELECT c.status, f.id, f.name, f.calories, f.protein, f.carbs, f.fat, f.serving_unit
+        FROM usda_lookup_cache c
+        LEFT JOIN food f ON f.id = c.food_id
+        WHERE c.query_key = :query_key
+          AND c.expires_at > NOW()
+          AND (c.status <> 'pending' OR :include_pending)
+    """, {"query_key": query_key, "include_pending": include_pending})
+    if not result:
+        return None
+    entry = result[0]
+    food = {k: entry[k] for k in ("id", "name", "calories", "protein", "carbs", "fat", "serving_unit")}
+    return {"status": entry["status"], "food": food if entry["id"] is not None else None}
+
+
+def lookup_food_locally(food_name: str):
+    """Resolve a food without calling USDA.
+
+    Returns (food, known): known is False when only a USDA lookup can answer, and
+    (None, True) when the lookup cache remembers that USDA has no such food.
+    """
+    food = find_food_by_name(food_name)
+    if food:
+        return food, True
+
+    cached = get_cached_usda_lookup(normalize_food_query(food_name))
+    if cached:
+        return cached["food"], True
+    return None, False
+
+
+def claim_usda_lookup(query_key: str) -> bool:
+    """Take the in-flight claim for a query. False while another request holds an unexpired
+    claim or the result is already cached."""
+    result = execute("""
+        INSERT INTO usda_lookup_cache (query_key, food_id, status, expires_at)
+        VALUES (:query_key, NULL, 'pending', NOW() + :ttl * INTERVAL '1 second')
+        ON CONFLICT (query_key) DO UPDATE SET
+            food_id = NULL,
+            status = 'pending',
+            expires_at = EXCLUDED.expires_at,
+            updated_at = NOW()
+        WHERE usda_lookup_cache.expires_at <= NOW()
+        RETURNING query_key
+    """, {"query_key": query_key, "ttl": USDA_CLAIM_TTL})
+    return result.fetchone() is not None
+
+
+def release_usda_claim(query_key: str):
+    """Drop a claim without caching anything, so the next request retries USDA."""
+    execute(
+        "DELETE FROM usda_lookup_cache WHERE query_key = :query_key AND status = 'pending'",
+        {"query_key": query_key}
+    )
+
+
+def wait_for_usda_lookup(query_key: str):
+    """Poll for the result of another request's claim. None if it fails or expires: the
+    waiters don't pile onto USDA themselves."""
+    while True:
+        cached = get_cached_usda_lookup(query_key, include_pending=True)
+        # End the read so no connection is pinned while waiting
+        db.session.commit()
+        if cached is None:
+            return None
+        if cached["status"] != 'pending':
+            return cached["food"]
+        time.sleep(USDA_CLAIM_POLL_INTERVAL)
+
+
+def resolve_food(food_name: str):
+    """Resolve a food name to a catalog row: catalog, then the USDA lookup cache, then USDA.
+
+    Concurrent misses for the same normalized query are coalesced with a committed 'pending'
+    claim row, so only one request calls USDA and inserts the food; the others poll for the
+    entry it writes. No transaction (or pooled connection) is held across the USDA call.
+    Only 'found' and 'not_found' are remembered: a failed lookup (timeout, missing API key)
+    releases the claim so the next request tries again. Returns None when the food cannot
+    be found.
+    """
+    food, known = lookup_food_locally(food_name)
+    if known:
+        return food
+
+    query_key = normalize_food_query(food_name)
+    if not claim_usda_lookup(query_key):
+        return wait_for_usda_lookup(query_key)
+
+    try:
+        usda_food, status = fetch_usda_food(food_name)
+        food = None
+        if usda_food:
+            food = find_food_by_name(usda_food['name'])
+            if not food:
+                insert_food_sql = """
+                    INSERT INTO food (name, calories, protein, carbs, fat, serving_unit)
+                    VALUES (:name, :calories, :protein, :carbs, :fat, :serving_unit)
+                    RETURNING id, name, calories, protein, carbs, fat, serving_unit
+                """
+                food_row = execute(insert_food_sql, usda_food, commit=False).fetchone()
+                food = dict(food_row) if food_row else None
+            if not food:
+                status = 'error'
+
+        if status == 'error':
+            db.session.rollback()
+            release_usda_claim(query_key)
+            return None
+
+        ttl = USDA_FOUND_TTL if status == 'found' else USDA_NOT_FOUND_TTL
+        execute("""
+            INSERT INTO usda_lookup_cache (query_key, food_id, status, expires_at)
+            VALUES (:query_key, :food_id, :status, NOW() + :ttl * INTERVAL '1 second')
+            ON CONFLICT (query_key) DO UPDATE SET
+                food_id = EXCLUDED.food_id,
+                status = EXCLUDED.status,
+                expires_at = EXCLUDED.expires_at,
+                updated_at = NOW()
+        """, {
+            "query_key": query_key,
+            "food_id": food["id"] if food else None,
+            "status": status,
+            "ttl": ttl
+        })
+        return food
+    except Exception:
+        db.session.rollback()
+        try:
+            release_usda_claim(query_key)
+        except Exception as e:
+            # The claim still expires after USDA_CLAIM_TTL
+            print(f"Failed to release USDA claim for '{query_key}': {e}")
+        raise
+
+def apply_daily_totals_delta(user_id: int, changes, commit: bool = True):
+    """Fold intake changes into the daily_totals rollup with a single upsert.
+
+    `changes` is an iterable of (food_id, quantity, intake_date, sign) tuples where
+    sign is +1 for an added entry and -1 for a removed one. Pass commit=False to keep
+    the upsert in the caller's transaction.
+    """
+    changes = [c for c in changes if c[0] is not None and c[2] is not None]
+    if not changes:
+        if commit:
+            db.session.commit()
         return None
 
+    sql = """
+        INSERT INTO daily_totals (user_id, day, calories, protein, carbs, fat, entry_count)
+        SELECT
+            :user_id,
+            d.day,
+            SUM(d.sign * d.quantity * f.calories / 100),
+            SUM(d.sign * d.quantity * f.protein / 100),
+            SUM(d.sign * d.quantity * f.carbs / 100),
+            SUM(d.sign * d.quantity * f.fat / 100),
+            SUM(d.sign)
+        FROM unnest(
+            CAST(:food_ids AS integer[]),
+            CAST(:quantities AS numeric[]),
+            CAST(:days AS date[]),
+            CAST(:signs AS integer[])
+        ) AS d(food_id, quantity, day, sign)
+        JOIN food f ON f.id = d.food_id
+        GROUP BY d.day
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            calories = daily_totals.calories + EXCLUDED.calories,
+            protein = daily_totals.protein + EXCLUDED.protein,
+            carbs = daily_totals.carbs + EXCLUDED.carbs,
+            fat = daily_totals.fat + EXCLUDED.fat,
+            entry_count = daily_totals.entry_count + EXCLUDED.entry_count,
+            updated_at = NOW()
+    """
+    return execute(sql, {
+        "user_id": user_id,
+        "food_ids": [c[0] for c in changes],
+        "quantities": [c[1] for c in changes],
+        "days": [c[2] for c in changes],
+        "signs": [c[3] for c in changes]
+    }, commit=commit)
+
+
+FOOD_SEARCH_DEFAULT_LIMIT = 10
+FOOD_SEARCH_MAX_LIMIT = 25
+FOOD_SEARCH_MIN_QUERY_LENGTH = 2
+
+
+def find_food_by_name(food_name: str):
+    """Case-insensitive exact catalog lookup, served by idx_food_name_lower.
+
+    Names are not unique (FoodData Central releases repeat descriptions across data
+    types), so duplicates resolve to the oldest row, the same one find_foods_by_name picks.
+    """
+    result = query("""
+        SELECT id, name, calories, protein, carbs, fat, serving_unit
+        FROM food
+        WHERE LOWER(name) = LOWER(:food_name)
+        ORDER BY id
+        LIMIT 1
+    """, {"food_name": food_name})
+    return result[0] if result else None
+
+
+def find_foods_by_name(food_names):
+    """Case-insensitive exact catalog lookup for many names in one query, keyed by lowercased name."""
+    keys = sorted({name.lower() for name in food_names})
+    if not keys:
+        return {}
+    result = query("""
+        SELECT DISTINCT ON (LOWER(name)) id, name, calories, protein, carbs, fat, serving_unit
+        FROM food
+        WHERE LOWER(name) = ANY(CAST(:names AS text[]))
+        ORDER BY LOWER(name), id
+    """, {"names": keys})
+    return {food["name"].lower(): food for food in result}
+
+
+def resolve_foods(food_names):
+    """Resolve many food names at once: one catalog query, then resolve_food for the misses.
+
+    Returns a dict keyed by lowercased name; unresolvable names map to None.
+    """
+    foods = find_foods_by_name(food_names)
+    for name in food_names:
+        key = name.lower()
+        if key not in foods:
+            foods[key] = resolve_food(name)
+    return foods
+
+
+def escape_like(term: str) -> str:
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def search_foods(term: str, limit: int = FOOD_SEARCH_DEFAULT_LIMIT):
+    """Rank prefix matches first (shortest names first), then trigram matches by similarity.
+
+    Prefix candidates are the first `limit` names in idx_food_name_lower order (~<~ is its
+    operator class's ordering), so a short prefix reads `limit` index entries instead of
+    sorting every match; the outer query then puts the shortest of them first.
+    """
+    term = term.strip().lower()
+    sql = """
+        WITH prefix AS (
+            SELECT id, name, calories, protein, carbs, fat, serving_unit,
+                   0 AS match_rank, 1.0 AS score
+            FROM food
+            WHERE LOWER(name) LIKE :prefix ESCAPE '\\'
+            ORDER BY LOWER(name) USING ~<~
+            LIMIT :limit
+        ),
+        fuzzy AS (
+            SELECT id, name, calories, protein, carbs, fat, serving_unit,
+                   1 AS match_rank, similarity(LOWER(name), :term) AS score
+            FROM food
+            WHERE LOWER(name) % :term
+            ORDER BY LOWER(name) <-> :term
+            LIMIT :limit
+        )
+        SELECT id, name, calories, protein, carbs, fat, serving_unit
+        FROM (
+            SELECT * FROM prefix
+            UNION ALL
+            SELECT * FROM fuzzy WHERE id NOT IN (SELECT id FROM prefix)
+        ) matches
+        ORDER BY match_rank, score DESC, LENGTH(name)
+        LIMIT :limit
+    """
+    return query(sql, {
+        "prefix": escape_like(term) + "%",
+        "term": term,
+        "limit": limit
+    })
+
+
+def search_food_catalog(term: str, limit: int = None):
+    term = (term or "").strip()
+    if len(term) < FOOD_SEARCH_MIN_QUERY_LENGTH:
+        return response(400, f"Search query must be at least {FOOD_SEARCH_MIN_QUERY_LENGTH} characters")
+
+    if limit is None:
+        limit = FOOD_SEARCH_DEFAULT_LIMIT
+    limit = max(1, min(limit, FOOD_SEARCH_MAX_LIMIT))
+
+    try:
+        foods = search_foods(term, limit)
+        return response(200, "Foods retrieved successfully", foods)
+    except Exception as e:
+        db.session.rollback()
+        print("Search foods error:", e)
+        return response(500, "Failed to search foods")
+
+
 def insert_log(request: Request):
-    username = get_jwt_identity()
+    identity = get_current_identity()
     data = request.get_json()
 
     if not data:
@@ -357,11 +716,9 @@ def insert_log(request: Request):
         return response(400, "Cannot log future intake dates")
 
     try:
-        sql_user = "SELECT id FROM users WHERE username = :username"
-        res = query(sql_user, {"username": username})
-        if not res:
+        if not identity:
             return response(400, "User not found")
-        user_id = res[0]["id"]
+        username, user_id = identity.username, identity.user_id
 
         try:
             quantity = float(data["quantity"])
@@ -370,41 +727,20 @@ def insert_log(request: Request):
         except (ValueError, TypeError):
             return response(400, "Quantity must be a number")
 
-        food_check = query(
-            "SELECT id, name, calories, protein, carbs, fat, serving_unit FROM food WHERE LOWER(name) = LOWER(:food_name)",
-            {"food_name": food_name}
-        )
-
-        if food_check:
-            food_id = food_check[0]["id"]
-            food_serving_unit = food_check[0].get("serving_unit", "g")
+        if data.get("async"):
+            food, known = lookup_food_locally(food_name)
+            if not known:
+                return insert_pending_log(username, user_id, food_name, quantity, intake_date, data.get("meal_type"))
         else:
-            usda_food = search_food_in_usda(food_name)
-            if not usda_food:
-                return response(400, f"Food '{food_name}' not found in local database or USDA API")
-
             try:
-                insert_food_sql = """
-                    INSERT INTO food (name, calories, protein, carbs, fat, serving_unit)
-                    VALUES (:name, :calories, :protein, :carbs, :fat, :serving_unit)
-                    RETURNING id
-                """
-                food_result = execute(insert_food_sql, {
-                    "name": usda_food['name'],
-                    "calories": usda_food['calories'],
-                    "protein": usda_food['protein'],
-                    "carbs": usda_food['carbs'],
-                    "fat": usda_food['fat'],
-                    "serving_unit": usda_food['serving_unit']
-                })
-                food_row = food_result.fetchone()
-                if not food_row:
-                    return response(500, "Failed to insert food from USDA")
-                food_id = food_row['id']
-                food_serving_unit = usda_food['serving_unit']
+                food = resolve_food(food_name)
             except Exception as e:
-                db.session.rollback()
+                print("Resolve food error:", e)
                 return response(500, "Failed to insert food from USDA API")
+        if not food:
+            return response(400, f"Food '{food_name}' not found in local database or USDA API")
+        food_id = food["id"]
+
         sql = """
             INSERT INTO user_intake 
                 (user_id, food_id, quantity, intake_date, meal_type)
@@ -421,15 +757,16 @@ def insert_log(request: Request):
             "meal_type": data.get("meal_type")
         }
 
-        result = execute(sql, params)
+        result = execute(sql, params, commit=False)
         inserted_row = result.fetchone()
 
         if not inserted_row:
+            db.session.rollback()
             return response(500, "Failed to insert intake entry")
 
         row_dict = dict(inserted_row)
+        apply_daily_totals_delta(user_id, [(food_id, quantity, intake_date, 1)])
 
-        affected_date = row_dict.get("intake_date")
         if row_dict.get("intake_date"):
             row_dict["intake_date"] = row_dict["intake_date"].isoformat()
         if row_dict.get("created_at"):
@@ -440,11 +777,9 @@ def insert_log(request: Request):
             if food_query:
                 row_dict["food_name"] = food_query[0]["name"]
 
-        # Invalidate cache for the affected date
         try:
             from redis_client import invalidate_nutrition_cache
-            if affected_date:
-                invalidate_nutrition_cache(username, str(affected_date))
+            invalidate_nutrition_cache(username)
         except Exception as e:
             print(f"Cache invalidation error in insert_log: {e}")
 
@@ -456,61 +791,175 @@ def insert_log(request: Request):
         return response(500, "Failed to create intake entry")
 
 
+def insert_pending_log(username: str, user_id: int, food_name: str, quantity: float, intake_date: date, meal_type: str = None):
+    """Accept an intake entry whose food still needs a USDA lookup and resolve it in the background."""
+    sql = """
+        INSERT INTO user_intake
+            (user_id, food_id, pending_food_name, status, quantity, intake_date, meal_type)
+        VALUES
+            (:user_id, NULL, :food_name, 'pending', :quantity, :intake_date, :meal_type)
+        RETURNING id, user_id, food_id, quantity, intake_date, meal_type, created_at, status
+    """
+    result = execute(sql, {
+        "user_id": user_id,
+        "food_name": food_name,
+        "quantity": quantity,
+        "intake_date": intake_date,
+        "meal_type": meal_type
+    })
+    inserted_row = result.fetchone()
+    if not inserted_row:
+        return response(500, "Failed to insert intake entry")
+
+    row_dict = dict(inserted_row)
+    row_dict["food_name"] = food_name
+    if row_dict.get("intake_date"):
+        row_dict["intake_date"] = row_dict["intake_date"].isoformat()
+    if row_dict.get("created_at"):
+        row_dict["created_at"] = row_dict["created_at"].isoformat()
+
+    try:
+        from celery_app import resolve_pending_intake
+        resolve_pending_intake.delay(row_dict["id"])
+    except Exception as e:
+        # No broker available: resolve inline so the entry does not stay pending
+        print(f"Failed to enqueue food resolution, resolving inline: {e}")
+        try:
+            row_dict["status"] = finalize_pending_log(row_dict["id"], final_attempt=True)["status"]
+        except Exception as resolve_error:
+            db.session.rollback()
+            print("Inline food resolution error:", resolve_error)
+
+    try:
+        from redis_client import invalidate_nutrition_cache
+        invalidate_nutrition_cache(username)
+    except Exception as e:
+        print(f"Cache invalidation error in insert_pending_log: {e}")
+
+    return response(202, "Intake entry accepted, food is being resolved", row_dict)
+
+
+class FoodLookupUnavailable(Exception):
+    """USDA or the database failed mid-lookup; the pending entry should be retried later."""
+
+
+def finalize_pending_log(intake_id: int, final_attempt: bool = False):
+    """Resolve the food of a pending intake entry and fold it into the rollup.
+
+    Raises FoodLookupUnavailable on transient USDA or database failures during the lookup
+    unless this is the final attempt, in which case the entry is marked failed.
+    """
+    pending = query("""
+        SELECT ui.id, ui.pending_food_name, u.username
+        FROM user_intake ui
+        JOIN users u ON u.id = ui.user_id
+        WHERE ui.id = :intake_id AND ui.status = 'pending'
+    """, {"intake_id": intake_id})
+    if not pending:
+        return {"intake_id": intake_id, "status": "skipped"}
+
+    food_name = pending[0]["pending_food_name"]
+    username = pending[0]["username"]
+    try:
+        food = resolve_food(food_name)
+    except exc.SQLAlchemyError as e:
+        db.session.rollback()
+        if not final_attempt:
+            raise FoodLookupUnavailable(f"Food lookup for '{food_name}' failed: {e}") from e
+        print(f"Food lookup for intake {intake_id} failed on the final attempt: {e}")
+        food = None
+
+    if food:
+        result = execute("""
+            UPDATE user_intake
+            SET food_id = :food_id, status = 'ready', pending_food_name = NULL, updated_at = NOW()
+            WHERE id = :intake_id AND status = 'pending'
+            RETURNING user_id, food_id, quantity, intake_date
+        """, {"food_id": food["id"], "intake_id": intake_id}, commit=False)
+        row = result.fetchone()
+        if not row:
+            db.session.rollback()
+            return {"intake_id": intake_id, "status": "skipped"}
+        apply_daily_totals_delta(row["user_id"], [(row["food_id"], row["quantity"], row["intake_date"], 1)])
+        status = "ready"
+    else:
+        # Only a remembered USDA miss is final; anything else was a failed lookup
+        cached = get_cached_usda_lookup(normalize_food_query(food_name))
+        if not (cached and cached["status"] == "not_found") and not final_attempt:
+            raise FoodLookupUnavailable(f"USDA lookup for '{food_name}' failed")
+        result = execute("""
+            UPDATE user_intake
+            SET status = 'failed', updated_at = NOW()
+            WHERE id = :intake_id AND status = 'pending'
+            RETURNING intake_date
+        """, {"intake_id": intake_id})
+        row = result.fetchone()
+        status = "failed"
+
+    try:
+        from redis_client import invalidate_nutrition_cache
+        if row:
+            invalidate_nutrition_cache(username)
+    except Exception as e:
+        print(f"Cache invalidation error in finalize_pending_log: {e}")
+
+    return {"intake_id": intake_id, "status": status}
+
+
+def get_log_status(intake_id):
+    identity = get_current_identity()
+    if not identity:
+        return response(400, "User not found")
+
+    try:
+        result = query("""
+            SELECT ui.id, ui.status, ui.food_id, COALESCE(f.name, ui.pending_food_name) AS food_name
+            FROM user_intake ui
+            LEFT JOIN food f ON ui.food_id = f.id
+            WHERE ui.id = :intake_id AND ui.user_id = :user_id
+        """, {"intake_id": intake_id, "user_id": identity.user_id})
+        if not result:
+            return response(400, "Entry not found or unauthorized")
+        return response(200, "Intake entry status retrieved", result[0])
+    except Exception as e:
+        db.session.rollback()
+        print("Get log status error:", e)
+        return response(500, "Failed to retrieve intake entry status")
+
+
 def update_log(request: Request):
-    username = get_jwt_identity()
+    identity = get_current_identity()
     data = request.get_json()
 
     if not data or "id" not in data:
         return response(400, "Missing intake entry ID")
 
     try:
-        # Resolve user ID
-        sql = "SELECT id FROM users WHERE username = :username"
-        res = query(sql, {"username": username})
-        if not res:
+        if not identity:
             return response(400, "User not found")
 
-        user_id = res[0]["id"]
+        username, user_id = identity.username, identity.user_id
         intake_id = data["id"]
         food_id = None
 
         if "food_name" in data:
             food_name = data.get("food_name")
-            food_check = query("SELECT id FROM food WHERE LOWER(name) = LOWER(:food_name)", {"food_name": food_name})
-            
-            if food_check:
-                food_id = food_check[0]["id"]
-            else:
-                usda_food = search_food_in_usda(food_name)
-                if not usda_food:
-                    return response(400, f"Food '{food_name}' not found in local database or USDA API")
-                
-                try:
-                    insert_food_sql = """
-                        INSERT INTO food (name, calories, protein, carbs, fat, serving_unit)
-                        VALUES (:name, :calories, :protein, :carbs, :fat, :serving_unit)
-                        RETURNING id
-                    """
-                    food_result = execute(insert_food_sql, {
-                        "name": usda_food['name'],
-                        "calories": usda_food['calories'],
-                        "protein": usda_food['protein'],
-                        "carbs": usda_food['carbs'],
-                        "fat": usda_food['fat'],
-                        "serving_unit": usda_food['serving_unit']
-                    })
-                    food_row = food_result.fetchone()
-                    if not food_row:
-                        return response(500, "Failed to insert food from USDA")
-                    food_id = food_row['id']
-                except Exception as e:
-                    db.session.rollback()
-                    return response(500, "Failed to insert food from USDA API")
+            try:
+                food = resolve_food(food_name)
+            except Exception as e:
+                print("Resolve food error:", e)
+                return response(500, "Failed to insert food from USDA API")
+            if not food:
+                return response(400, f"Food '{food_name}' not found in local database or USDA API")
+            food_id = food["id"]
 
         allowed_fields = {"food_id", "quantity", "intake_date", "meal_type"}
         updates = {k: v for k, v in data.items() if k in allowed_fields}
         if food_id is not None:
             updates["food_id"] = food_id
+            # Choosing a food explicitly settles an entry that was still waiting on USDA
+            updates["status"] = "ready"
+            updates["pending_food_name"] = None
 
         if not updates:
             return response(400, "No valid fields to update")
@@ -535,12 +984,19 @@ def update_log(request: Request):
 
         set_clause = ", ".join(f"{k} = :{k}" for k in updates)
 
+        # The locked subquery exposes the pre-update values so the rollup can be adjusted
         sql = f"""
             UPDATE user_intake ui
             SET {set_clause},
                 updated_at = NOW()
-            WHERE ui.id = :intake_id
-              AND ui.user_id = :user_id
+            FROM (
+                SELECT id, food_id, quantity, intake_date
+                FROM user_intake
+                WHERE id = :intake_id
+                  AND user_id = :user_id
+                FOR UPDATE
+            ) prev
+            WHERE ui.id = prev.id
             RETURNING 
                 ui.id,
                 ui.user_id,
@@ -549,20 +1005,30 @@ def update_log(request: Request):
                 ui.intake_date,
                 ui.meal_type,
                 ui.created_at,
-                ui.updated_at
+                ui.updated_at,
+                prev.food_id AS prev_food_id,
+                prev.quantity AS prev_quantity,
+                prev.intake_date AS prev_intake_date
         """
 
         updates["intake_id"] = intake_id
         updates["user_id"] = user_id
-        result = execute(sql, updates)
+        result = execute(sql, updates, commit=False)
         updated_row = result.fetchone()
 
         if not updated_row:
+            db.session.rollback()
             return response(400, "Entry not found or unauthorized")
 
         result_dict = dict(updated_row)
-        # Get date before converting to string for cache invalidation
-        affected_date = result_dict.get("intake_date")
+        prev_food_id = result_dict.pop("prev_food_id", None)
+        prev_quantity = result_dict.pop("prev_quantity", None)
+        prev_date = result_dict.pop("prev_intake_date", None)
+        apply_daily_totals_delta(user_id, [
+            (prev_food_id, prev_quantity, prev_date, -1),
+            (result_dict.get("food_id"), result_dict.get("quantity"), result_dict.get("intake_date"), 1)
+        ])
+
         if result_dict.get("intake_date"):
             result_dict["intake_date"] = result_dict["intake_date"].isoformat()
         if result_dict.get("created_at"):
@@ -575,11 +1041,9 @@ def update_log(request: Request):
             if food_query:
                 result_dict["food_name"] = food_query[0]["name"]
 
-        # Invalidate cache for the affected date (this also invalidates 7-day history cache)
         try:
             from redis_client import invalidate_nutrition_cache
-            if affected_date:
-                invalidate_nutrition_cache(username, str(affected_date))
+            invalidate_nutrition_cache(username)
         except Exception as e:
             print(f"Cache invalidation error in update_log: {e}")
 
@@ -591,26 +1055,65 @@ def update_log(request: Request):
         return response(500, "Failed to update intake entry")
 
 
-def retrieve_log(time_constraint: date = None):
-    username = get_jwt_identity()
+LOG_PAGE_DEFAULT_LIMIT = 50
+LOG_PAGE_MAX_LIMIT = 200
+LOG_PAGE_CACHE_TTL = 86400
+
+
+def encode_log_cursor(row: dict) -> str:
+    """Opaque keyset cursor for the entry after which the next page starts."""
+    created_at = row["created_at"]
+    position = [
+        str(row["intake_date"]),
+        created_at.isoformat() if hasattr(created_at, "isoformat") else created_at,
+        row["id"]
+    ]
+    return base64.urlsafe_b64encode(json.dumps(position).encode()).decode().rstrip("=")
+
+
+def decode_log_cursor(cursor: str):
+    """Inverse of encode_log_cursor. Raises ValueError for malformed cursors."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        intake_date, created_at, intake_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return date.fromisoformat(intake_date), datetime.fromisoformat(created_at), int(intake_id)
+    except (ValueError, TypeError, binascii.Error) as e:
+        raise ValueError("Invalid cursor") from e
+
+
+def retrieve_log(start_date: date = None, end_date: date = None, cursor: str = None,
+                 limit: int = None):
+    """One page of intake entries, newest first, optionally bounded to [start_date, end_date].
+
+    Pages are keyset-paginated on (intake_date, created_at, id); pass the returned
+    next_cursor to get the following page. next_cursor is None on the last page.
+    """
+    identity = get_current_identity()
+    limit = max(1, min(limit or LOG_PAGE_DEFAULT_LIMIT, LOG_PAGE_MAX_LIMIT))
 
     try:
+        if not identity:
+            return response(400, "User not found")
+        username, user_id = identity.username, identity.user_id
+
+        params = {"user_id": user_id, "limit": limit + 1}
+        if cursor:
+            try:
+                params["cursor_date"], params["cursor_created_at"], params["cursor_id"] = decode_log_cursor(cursor)
+            except ValueError:
+                return response(400, "Invalid cursor")
+
         # Try to get from cache first
+        page_key = f"{start_date or ''}:{end_date or ''}:{limit}:{cursor or ''}"
+        cache_key = None
         try:
-            from redis_client import cache_get, cache_set, get_cache_key_for_logs
-            date_filter = str(time_constraint) if time_constraint else "all"
-            cache_key = get_cache_key_for_logs(username, date_filter)
-            cached_data = cache_get(cache_key)
-            if cached_data is not None:
-                return response(200, "Logs retrieved successfully (cached)", cached_data)
+            from redis_client import cache_get_raw_versioned, cache_set_raw, get_cache_key_for_logs, get_cache_key_for_response
+            cache_key, cached_body = cache_get_raw_versioned(
+                username, lambda version: get_cache_key_for_response(get_cache_key_for_logs(username, page_key, version)))
+            if cached_body is not None:
+                return raw_response(cached_body)
         except ImportError:
             pass  # Redis not available, continue without cache
-        
-        sql = "SELECT id FROM users WHERE username = :username"
-        res = query(sql, {"username": username})
-        if not res:
-            return response(400, "User not found")
-        user_id = res[0]["id"]
 
         sql = """
             SELECT 
@@ -622,31 +1125,37 @@ def retrieve_log(time_constraint: date = None):
                 ui.meal_type,
                 ui.created_at,
                 ui.updated_at,
-                f.name AS food_name
+                ui.status,
+                COALESCE(f.name, ui.pending_food_name) AS food_name
             FROM user_intake ui
             LEFT JOIN food f ON ui.food_id = f.id
             WHERE ui.user_id = :user_id
         """
-        params = {"user_id": user_id}
 
-        if time_constraint:
-            sql += " AND ui.intake_date <= :time_constraint"
-            params["time_constraint"] = time_constraint
+        if start_date:
+            sql += " AND ui.intake_date >= :start_date"
+            params["start_date"] = start_date
+        if end_date:
+            sql += " AND ui.intake_date <= :end_date"
+            params["end_date"] = end_date
+        if cursor:
+            sql += " AND (ui.intake_date, ui.created_at, ui.id) < (:cursor_date, :cursor_created_at, :cursor_id)"
 
-        sql += " ORDER BY ui.intake_date DESC, ui.created_at DESC"
+        # Served by idx_user_intake_keyset
+        sql += " ORDER BY ui.intake_date DESC, ui.created_at DESC, ui.id DESC LIMIT :limit"
 
         logs = query(sql, params)
+        next_cursor = None
+        if len(logs) > limit:
+            logs = logs[:limit]
+            next_cursor = encode_log_cursor(logs[-1])
+        page = {"logs": logs, "next_cursor": next_cursor}
+
+        body, cached_body = encode_cacheable_response("Logs retrieved successfully", page)
+        if cache_key:
+            cache_set_raw(cache_key, cached_body, ttl=LOG_PAGE_CACHE_TTL)
         
-        # Cache the result (24 hour TTL)
-        try:
-            from redis_client import cache_set, get_cache_key_for_logs
-            date_filter = str(time_constraint) if time_constraint else "all"
-            cache_key = get_cache_key_for_logs(username, date_filter)
-            cache_set(cache_key, logs, ttl=86400)  # Cache for 24 hours
-        except ImportError:
-            pass
-        
-        return response(200, "Logs retrieved successfully", logs)
+        return raw_response(body)
 
     except Exception as e:
         db.session.rollback()
@@ -655,7 +1164,7 @@ def retrieve_log(time_constraint: date = None):
 
 
 def delete_log(request: Request):
-    username = get_jwt_identity()
+    identity = get_current_identity()
     data = request.get_json()
 
     if not data or "id" not in data:
@@ -664,13 +1173,10 @@ def delete_log(request: Request):
     try:
         target_intake_id = data["id"]
 
-        sql = "SELECT id FROM users WHERE username = :username"
-        res = query(sql, {"username": username})
-
-        if not res:
+        if not identity:
             return response(400, "User not found")
 
-        user_id = res[0]["id"]
+        username, user_id = identity.username, identity.user_id
         sql = """
             DELETE FROM user_intake ui
             WHERE ui.id = :intake_id
@@ -686,15 +1192,17 @@ def delete_log(request: Request):
                 ui.updated_at
         """
 
-        result = execute(sql, {"intake_id": target_intake_id, "user_id": user_id})
+        result = execute(sql, {"intake_id": target_intake_id, "user_id": user_id}, commit=False)
         deleted_row = result.fetchone()
         
         if not deleted_row:
+            db.session.rollback()
             return response(400, "Entry not found or unauthorized")
 
         result_dict = dict(deleted_row)
-        # Get date before converting to string for cache invalidation
-        affected_date = result_dict.get("intake_date")
+        apply_daily_totals_delta(user_id, [
+            (result_dict.get("food_id"), result_dict.get("quantity"), result_dict.get("intake_date"), -1)
+        ])
         if result_dict.get("intake_date"):
             result_dict["intake_date"] = result_dict["intake_date"].isoformat()
         if result_dict.get("created_at"):
@@ -709,8 +1217,7 @@ def delete_log(request: Request):
 
         try:
             from redis_client import invalidate_nutrition_cache
-            if affected_date:
-                invalidate_nutrition_cache(username, str(affected_date))
+            invalidate_nutrition_cache(username)
         except Exception as e:
             print(f"Cache invalidation error in delete_log: {e}")
 
@@ -721,84 +1228,278 @@ def delete_log(request: Request):
         print("Delete log error:", e)
         return response(500, "Failed to delete intake entry")
 
-def fetch_intake_rows(user_id: int, target_date: date):
-    sql = """
-        SELECT
-            ui.food_id,
-            ui.quantity,
-            f.calories,
-            f.protein,
-            f.carbs,
-            f.fat
-        FROM user_intake ui
-        JOIN food f ON ui.food_id = f.id
-        WHERE ui.user_id = :user_id
-          AND ui.intake_date = :target_date
+
+LOG_BATCH_MAX_OPERATIONS = int(os.getenv('LOG_BATCH_MAX_OPERATIONS', 500))
+
+
+def parse_log_fields(item: dict):
+    """Validate the intake fields present in a log payload. Returns (fields, error_message)."""
+    fields = {}
+    if "food_name" in item:
+        if not isinstance(item["food_name"], str) or not item["food_name"].strip():
+            return None, "food_name must be a non-empty string"
+        fields["food_name"] = item["food_name"].strip()
+    if "food_id" in item:
+        if not isinstance(item["food_id"], int) or isinstance(item["food_id"], bool):
+            return None, "food_id must be an integer"
+        fields["food_id"] = item["food_id"]
+    if "quantity" in item:
+        try:
+            quantity = float(item["quantity"])
+        except (ValueError, TypeError):
+            return None, "Quantity must be a number"
+        if quantity <= 0:
+            return None, "Quantity must be positive"
+        fields["quantity"] = quantity
+    if "intake_date" in item:
+        try:
+            intake_date = date.fromisoformat(str(item["intake_date"]))
+        except (ValueError, TypeError):
+            return None, "intake_date must be a valid ISO date (YYYY-MM-DD)"
+        if intake_date > date.today():
+            return None, "Cannot log future intake dates"
+        fields["intake_date"] = intake_date
+    if "meal_type" in item:
+        fields["meal_type"] = item["meal_type"]
+    return fields, None
+
+
+def batch_logs(request: Request):
+    """Apply a list of inserts, updates and deletes in one transaction.
+
+    Payload: {"inserts": [{food_name, quantity, intake_date, meal_type}],
+              "updates": [{id, food_name | food_id, quantity, intake_date, meal_type}],
+              "deletes": [id, ...]}
+    Either every operation is applied or none is.
     """
-    return query(sql, {
-        "user_id": user_id,
-        "target_date": target_date
-    })
+    identity = get_current_identity()
+    data = request.get_json()
+
+    if not isinstance(data, dict):
+        return response(400, "Missing JSON payload")
+
+    inserts = data.get("inserts") or []
+    updates = data.get("updates") or []
+    deletes = data.get("deletes") or []
+    if not all(isinstance(ops, list) for ops in (inserts, updates, deletes)):
+        return response(400, "inserts, updates and deletes must be lists")
+    if not (inserts or updates or deletes):
+        return response(400, "No operations to apply")
+    if len(inserts) + len(updates) + len(deletes) > LOG_BATCH_MAX_OPERATIONS:
+        return response(400, f"A batch may contain at most {LOG_BATCH_MAX_OPERATIONS} operations")
+
+    new_entries = []
+    for i, item in enumerate(inserts):
+        if not isinstance(item, dict) or not {"food_name", "quantity", "intake_date"}.issubset(item):
+            return response(400, f"inserts[{i}]: Missing required fields: food_name, quantity, intake_date")
+        fields, error = parse_log_fields({k: v for k, v in item.items() if k != "food_id"})
+        if error:
+            return response(400, f"inserts[{i}]: {error}")
+        fields.setdefault("meal_type", None)
+        new_entries.append(fields)
+
+    changed_entries = []
+    for i, item in enumerate(updates):
+        if not isinstance(item, dict) or not isinstance(item.get("id"), int):
+            return response(400, f"updates[{i}]: Missing intake entry ID")
+        fields, error = parse_log_fields(item)
+        if error:
+            return response(400, f"updates[{i}]: {error}")
+        if not fields:
+            return response(400, f"updates[{i}]: No valid fields to update")
+        fields["id"] = item["id"]
+        changed_entries.append(fields)
+
+    delete_ids = []
+    for i, item in enumerate(deletes):
+        intake_id = item.get("id") if isinstance(item, dict) else item
+        if not isinstance(intake_id, int) or isinstance(intake_id, bool):
+            return response(400, f"deletes[{i}]: Missing intake entry ID")
+        delete_ids.append(intake_id)
+
+    update_ids = [entry["id"] for entry in changed_entries]
+    if len(set(update_ids)) != len(update_ids) or len(set(delete_ids)) != len(delete_ids) \
+            or set(update_ids) & set(delete_ids):
+        return response(400, "Each intake entry may appear in only one operation")
+
+    if not identity:
+        return response(400, "User not found")
+    username, user_id = identity.username, identity.user_id
+
+    # Resolve every food name up front (USDA misses commit their own catalog rows)
+    food_names = {entry["food_name"] for entry in new_entries + changed_entries if "food_name" in entry}
+    try:
+        foods = resolve_foods(food_names)
+    except Exception as e:
+        db.session.rollback()
+        print("Resolve food error:", e)
+        return response(500, "Failed to insert food from USDA API")
+    missing = sorted(name for name in food_names if not foods.get(name.lower()))
+    if missing:
+        return response(400, f"Food(s) not found in local database or USDA API: {', '.join(missing)}")
+
+    # food_ids given directly are checked here rather than surfacing as an FK violation
+    direct_ids = {entry["food_id"] for entry in changed_entries if "food_id" in entry and "food_name" not in entry}
+    if direct_ids:
+        known_ids = {row["id"] for row in query(
+            "SELECT id FROM food WHERE id = ANY(CAST(:ids AS integer[]))", {"ids": sorted(direct_ids)}
+        )}
+        for i, entry in enumerate(changed_entries):
+            if "food_id" in entry and "food_name" not in entry and entry["food_id"] not in known_ids:
+                return response(400, f"updates[{i}]: Food not found: {entry['food_id']}")
+    for entry in new_entries + changed_entries:
+        if "food_name" in entry:
+            entry["food_id"] = foods[entry.pop("food_name").lower()]["id"]
+
+    try:
+        changes = []
+        deleted, updated, inserted = [], [], []
+
+        if delete_ids:
+            result = execute("""
+                DELETE FROM user_intake
+                WHERE user_id = :user_id AND id = ANY(CAST(:ids AS integer[]))
+                RETURNING id, food_id, quantity, intake_date
+            """, {"user_id": user_id, "ids": delete_ids}, commit=False)
+            deleted = [dict(row) for row in result.fetchall()]
+            if len(deleted) != len(delete_ids):
+                db.session.rollback()
+                return response(400, "Entry not found or unauthorized")
+            changes += [(row["food_id"], row["quantity"], row["intake_date"], -1) for row in deleted]
+
+        if changed_entries:
+            # Lock the entries and read what the rollup has to take back out
+            result = execute("""
+                SELECT id, food_id, quantity, intake_date
+                FROM user_intake
+                WHERE user_id = :user_id AND id = ANY(CAST(:ids AS integer[]))
+                FOR UPDATE
+            """, {"user_id": user_id, "ids": update_ids}, commit=False)
+            previous = result.fetchall()
+            if len(previous) != len(changed_entries):
+                db.session.rollback()
+                return response(400, "Entry not found or unauthorized")
+            changes += [(row["food_id"], row["quantity"], row["intake_date"], -1) for row in previous]
+
+            # NULL means "keep the current value"; meal_type can be cleared, so it carries its own flag
+            result = execute("""
+                WITH changed AS (
+                    UPDATE user_intake ui
+                    SET food_id = COALESCE(c.food_id, ui.food_id),
+                        quantity = COALESCE(c.quantity, ui.quantity),
+                        intake_date = COALESCE(c.intake_date, ui.intake_date),
+                        meal_type = CASE WHEN c.set_meal_type THEN c.meal_type ELSE ui.meal_type END,
+                        status = CASE WHEN c.food_id IS NOT NULL THEN 'ready' ELSE ui.status END,
+                        pending_food_name = CASE WHEN c.food_id IS NOT NULL THEN NULL ELSE ui.pending_food_name END,
+                        updated_at = NOW()
+                    FROM unnest(
+                        CAST(:ids AS integer[]),
+                        CAST(:food_ids AS integer[]),
+                        CAST(:quantities AS numeric[]),
+                        CAST(:days AS date[]),
+                        CAST(:meal_types AS varchar[]),
+                        CAST(:set_meal_types AS boolean[])
+                    ) AS c(id, food_id, quantity, intake_date, meal_type, set_meal_type)
+                    WHERE ui.id = c.id AND ui.user_id = :user_id
+                    RETURNING ui.id, ui.user_id, ui.food_id, ui.quantity, ui.intake_date, ui.meal_type,
+                              ui.status, ui.created_at, ui.updated_at
+                )
+                SELECT changed.*, f.name AS food_name
+                FROM changed
+                LEFT JOIN food f ON f.id = changed.food_id
+                ORDER BY changed.id
+            """, {
+                "user_id": user_id,
+                "ids": update_ids,
+                "food_ids": [entry.get("food_id") for entry in changed_entries],
+                "quantities": [entry.get("quantity") for entry in changed_entries],
+                "days": [entry.get("intake_date") for entry in changed_entries],
+                "meal_types": [entry.get("meal_type") for entry in changed_entries],
+                "set_meal_types": ["meal_type" in entry for entry in changed_entries]
+            }, commit=False)
+            updated = [dict(row) for row in result.fetchall()]
+            changes += [(row["food_id"], row["quantity"], row["intake_date"], 1) for row in updated]
+
+        if new_entries:
+            # Rows are inserted in payload order, so sorting RETURNING by id restores that order
+            result = execute("""
+                WITH added AS (
+                    INSERT INTO user_intake (user_id, food_id, quantity, intake_date, meal_type)
+                    SELECT :user_id, n.food_id, n.quantity, n.intake_date, n.meal_type
+                    FROM unnest(
+                        CAST(:food_ids AS integer[]),
+                        CAST(:quantities AS numeric[]),
+                        CAST(:days AS date[]),
+                        CAST(:meal_types AS varchar[])
+                    ) WITH ORDINALITY AS n(food_id, quantity, intake_date, meal_type, position)
+                    ORDER BY n.position
+                    RETURNING id, user_id, food_id, quantity, intake_date, meal_type, status, created_at
+                )
+                SELECT added.*, f.name AS food_name
+                FROM added
+                JOIN food f ON f.id = added.food_id
+                ORDER BY added.id
+            """, {
+                "user_id": user_id,
+                "food_ids": [entry["food_id"] for entry in new_entries],
+                "quantities": [entry["quantity"] for entry in new_entries],
+                "days": [entry["intake_date"] for entry in new_entries],
+                "meal_types": [entry["meal_type"] for entry in new_entries]
+            }, commit=False)
+            inserted = [dict(row) for row in result.fetchall()]
+            changes += [(row["food_id"], row["quantity"], row["intake_date"], 1) for row in inserted]
+
+        apply_daily_totals_delta(user_id, changes)
 
+    except Exception as e:
+        db.session.rollback()
+        print("Batch logs error:", e)
+        return response(500, "Failed to apply batch")
+
+    try:
+        from redis_client import invalidate_nutrition_cache
+        invalidate_nutrition_cache(username)
+    except Exception as e:
+        print(f"Cache invalidation error in batch_logs: {e}")
+
+    return response(200, "Batch applied successfully", {
+        "inserted": inserted,
+        "updated": updated,
+        "deleted": [row["id"] for row in deleted]
+    })
 
 def get_daily_nutrition(target_date: date = None):
-    username = get_jwt_identity()
+    identity = get_current_identity()
     if not target_date:
         target_date = date.today()
 
     try:
-        # Try to get from cache first
+        if not identity:
+            return response(400, "User not found")
+        username, user_id = identity.username, identity.user_id
+
+        # Try to get from cache first. The key is computed once, before reading the
+        # database, so a write that lands meanwhile leaves this result under the old version.
+        cache_key = None
         try:
-            from redis_client import cache_get, cache_set, get_cache_key_for_daily_nutrition
-            cache_key = get_cache_key_for_daily_nutrition(username, str(target_date))
-            cached_data = cache_get(cache_key)
+            from redis_client import cache_get_versioned, cache_set, get_cache_key_for_daily_nutrition
+            cache_key, cached_data = cache_get_versioned(
+                username, lambda version: get_cache_key_for_daily_nutrition(username, str(target_date), version))
             if cached_data is not None:
                 return cached_data
         except ImportError:
             pass  # Redis not available, continue without cache
 
-        sql = "SELECT id FROM users WHERE username = :username"
-        res = query(sql, {"username": username})
+        total = fetch_nutrition_totals(user_id, target_date, target_date)
 
-        if not res:
-            return response(400, "User not found")
-
-        user_id = res[0]["id"]
-        intake_rows = fetch_intake_rows(user_id, target_date)
-
-        if not intake_rows:
+        if not total:
             result = None
-            try:
-                from redis_client import cache_set, get_cache_key_for_daily_nutrition
-                cache_key = get_cache_key_for_daily_nutrition(username, str(target_date))
+            if cache_key:
                 cache_set(cache_key, None, ttl=86400)
-            except ImportError:
-                pass
             return result
 
-        total = {"calories": 0.0, "protein": 0.0, "carbs": 0.0, "fat": 0.0}
-
-        for row in intake_rows:
-            quantity = float(row["quantity"]) if isinstance(row["quantity"], Decimal) else row["quantity"]
-            calories = float(row["calories"]) if isinstance(row["calories"], Decimal) else row["calories"]
-            protein = float(row["protein"]) if isinstance(row["protein"], Decimal) else row["protein"]
-            carbs = float(row["carbs"]) if isinstance(row["carbs"], Decimal) else row["carbs"]
-            fat = float(row["fat"]) if isinstance(row["fat"], Decimal) else row["fat"]
-
-            factor = quantity / 100.0
-            total["calories"] += calories * factor
-            total["protein"] += protein * factor
-            total["carbs"] += carbs * factor
-            total["fat"] += fat * factor
-
-        total = {k: round(v, 2) for k, v in total.items()}
-
-        try:
-            from redis_client import cache_set, get_cache_key_for_daily_nutrition
-            cache_key = get_cache_key_for_daily_nutrition(username, str(target_date))
+        if cache_key:
             cache_set(cache_key, total, ttl=86400)  # Cache for 24 hours
-        except ImportError:
-            pass
         
         return total
 
@@ -809,8 +1510,6 @@ def get_daily_nutrition(target_date: date = None):
 
 
 def dv_summation():
-    username = get_jwt_identity()
-
     try:
         nutrition = get_daily_nutrition(date.today())
         
@@ -833,70 +1532,22 @@ def dv_summation():
         print('Calculate dv nutrition error:', e)
         return response(500, 'Failed to calculate daily nutrition')
 def get_daily_needs():
-    username = get_jwt_identity()
+    identity = get_current_identity()
     
     try:
-        sql = """
-            SELECT username, age, sex, height_cm, weight_kg, activity_level, goal
-            FROM users WHERE username = :username
-        """
-        result = query(sql, {"username": username})
-        if not result:
+        if not identity:
+            return response(400, "User not found")
+
+        profile = fetch_profile(identity.user_id)
+        if not profile:
             return response(400, "User not found")
         
-        profile = result[0]
-        age_years = profile["age"]
-        sex = profile["sex"].lower()
-        weight_kg = float(profile["weight_kg"])
-        height_cm = float(profile["height_cm"])
-        activity_level = profile["activity_level"]
-        goal = profile.get("goal", "maintain")
-        
-        # Validate data
-        if not all([weight_kg, height_cm, age_years]):
-            return response(400, "missing required profile data: weight_kg, height_cm, age")
-        
-        if sex not in ("male", "female"):
-            return response(400, f"invalid sex value: {sex}")
-        
-        if activity_level not in ["sedentary", "light", "moderate", "active", "extra"]:
-            return response(400, f"invalid activity_level: {activity_level}")
-        
-        if goal not in ["cut", "maintain", "bulk"]:
-            return response(400, f"invalid goal value: {goal}. Must be 'cut', 'maintain', or 'bulk'")
-        
-        if sex == "male":
-            bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age_years + 5
-        else:
-            bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age_years - 161
-        
-        factors = {"sedentary": 1.2, "light": 1.375, "moderate": 1.55, "active": 1.725, "extra": 1.9}
-        tdee = bmr * factors[activity_level]
-        
-        # Adjust TDEE based on goal
-        goal_adjustments = {
-            "cut": -0.20,      # 20% deficit for weight loss
-            "maintain": 0.0,   # No adjustment for maintenance
-            "bulk": 0.20       # 20% surplus for weight gain
-        }
-        goal_multiplier = 1.0 + goal_adjustments.get(goal, 0.0)
-        adjusted_tdee = tdee * goal_multiplier
-        
-        protein = round(1.6 * weight_kg)
-        fat = round((adjusted_tdee * 0.25) / 9)
-        carbs = round((adjusted_tdee - (protein * 4 + fat * 9)) / 4)
+        try:
+            needs = needs_for_profile(profile)
+        except InvalidProfile as e:
+            return response(400, str(e))
         
-        return response(200, "Daily needs calculated successfully", {
-            "calories": round(adjusted_tdee),
-            "protein_g": protein,
-            "fat_g": fat,
-            "carbs_g": carbs,
-            "bmr": round(bmr),
-            "tdee": round(tdee),
-            "activity_multiplier": factors[activity_level],
-            "goal": goal,
-            "goal_adjustment": f"{goal_adjustments[goal]*100:.0f}%"
-        })
+        return response(200, "Daily needs calculated successfully", needs.as_dict())
         
     except Exception as e:
         db.session.rollback()
@@ -904,103 +1555,296 @@ def get_daily_needs():
         return response(500, 'Failed to calculate daily needs')
 
 
+def fetch_daily_totals(user_id: int, start_date: date, end_date: date):
+    sql = """
+        SELECT day, calories, protein, carbs, fat, entry_count
+        FROM daily_totals
+        WHERE user_id = :user_id
+          AND day BETWEEN :start_date AND :end_date
+          AND entry_count > 0
+    """
+    return query(sql, {
+        "user_id": user_id,
+        "start_date": start_date,
+        "end_date": end_date
+    })
+
+
+NUTRITION_TOTALS_SQL = """
+    SELECT
+        CAST(ROUND(SUM(calories), :digits) AS double precision) AS calories,
+        CAST(ROUND(SUM(protein), :digits) AS double precision) AS protein,
+        CAST(ROUND(SUM(carbs), :digits) AS double precision) AS carbs,
+        CAST(ROUND(SUM(fat), :digits) AS double precision) AS fat
+    FROM daily_totals
+    WHERE user_id = :user_id
+      AND day BETWEEN :start_date AND :end_date
+    HAVING SUM(entry_count) > 0
+"""
+
+
+def fetch_nutrition_totals(user_id: int, start_date: date, end_date: date, digits: int = 2):
+    """Summed totals for [start_date, end_date] as one row of floats, rounded by the
+    database, or None if nothing was logged in the range."""
+    result = query(NUTRITION_TOTALS_SQL, {
+        "user_id": user_id,
+        "start_date": start_date,
+        "end_date": end_date,
+        "digits": digits
+    })
+    return result[0] if result else None
+
+
+INTAKE_TOTALS_SQL = """
+    SELECT
+        ui.user_id,
+        ui.intake_date AS day,
+        SUM(ui.quantity * f.calories / 100) AS calories,
+        SUM(ui.quantity * f.protein / 100) AS protein,
+        SUM(ui.quantity * f.carbs / 100) AS carbs,
+        SUM(ui.quantity * f.fat / 100) AS fat,
+        COUNT(*) AS entry_count
+    FROM user_intake ui
+    JOIN food f ON ui.food_id = f.id
+    WHERE (CAST(:user_id AS integer) IS NULL OR ui.user_id = :user_id)
+    GROUP BY ui.user_id, ui.intake_date
+"""
+
+
+def backfill_daily_totals(user_id: int = None):
+    """Rebuild daily_totals from user_intake (all users, or one user). Safe to re-run."""
+    params = {"user_id": user_id}
+    upserted = execute(f"""
+        INSERT INTO daily_totals (user_id, day, calories, protein, carbs, fat, entry_count)
+        SELECT user_id, day, calories, protein, carbs, fat, entry_count
+        FROM ({INTAKE_TOTALS_SQL}) actual
+        ON CONFLICT (user_id, day) DO UPDATE SET
+            calories = EXCLUDED.calories,
+            protein = EXCLUDED.protein,
+            carbs = EXCLUDED.carbs,
+            fat = EXCLUDED.fat,
+            entry_count = EXCLUDED.entry_count,
+            updated_at = NOW()
+    """, params, commit=False).rowcount
+    removed = execute("""
+        DELETE FROM daily_totals dt
+        WHERE (CAST(:user_id AS integer) IS NULL OR dt.user_id = :user_id)
+          AND NOT EXISTS (
+              SELECT 1 FROM user_intake ui
+              JOIN food f ON ui.food_id = f.id
+              WHERE ui.user_id = dt.user_id AND ui.intake_date = dt.day
+          )
+    """, params).rowcount
+    return {"upserted": upserted, "removed": removed}
+
+
+def reconcile_daily_totals(user_id: int = None, tolerance: float = 0.01):
+    """Return the (user_id, day) rows where daily_totals disagrees with user_intake."""
+    return query(f"""
+        SELECT
+            COALESCE(actual.user_id, dt.user_id) AS user_id,
+            COALESCE(actual.day, dt.day) AS day,
+            COALESCE(actual.calories, 0) AS expected_calories,
+            COALESCE(dt.calories, 0) AS stored_calories,
+            COALESCE(actual.entry_count, 0) AS expected_entries,
+            COALESCE(dt.entry_count, 0) AS stored_entries
+        FROM ({INTAKE_TOTALS_SQL}) actual
+        FULL OUTER JOIN (
+            SELECT * FROM daily_totals
+            WHERE CAST(:user_id AS integer) IS NULL OR user_id = :user_id
+        ) dt ON dt.user_id = actual.user_id AND dt.day = actual.day
+        WHERE COALESCE(actual.entry_count, 0) <> COALESCE(dt.entry_count, 0)
+           OR ABS(COALESCE(actual.calories, 0) - COALESCE(dt.calories, 0)) > :tolerance
+           OR ABS(COALESCE(actual.protein, 0) - COALESCE(dt.protein, 0)) > :tolerance
+           OR ABS(COALESCE(actual.carbs, 0) - COALESCE(dt.carbs, 0)) > :tolerance
+           OR ABS(COALESCE(actual.fat, 0) - COALESCE(dt.fat, 0)) > :tolerance
+        ORDER BY 1, 2
+    """, {"user_id": user_id, "tolerance": tolerance})
+
+
+def build_daily_series(rows, start_date: date, end_date: date, daily_needs: dict):
+    """Expand per-day aggregate rows into one entry per day (newest first), filling gaps with None."""
+    totals_by_day = {row["day"]: row for row in rows}
+    optimal = {
+        "calories": daily_needs.get("calories", 0),
+        "protein_g": daily_needs.get("protein_g", 0),
+        "carbs_g": daily_needs.get("carbs_g", 0),
+        "fat_g": daily_needs.get("fat_g", 0)
+    }
+
+    series = []
+    for i in range((end_date - start_date).days + 1):
+        target_date = end_date - timedelta(days=i)
+        totals = totals_by_day.get(target_date)
+        entry = {"date": str(target_date)}
+        for key in ("calories", "protein", "carbs", "fat"):
+            entry[key] = round(float(totals[key]), 2) if totals else None
+        entry["optimal"] = dict(optimal)
+        series.append(entry)
+    return series
+
+
+PROFILE_CACHE_TTL = int(os.getenv('PROFILE_CACHE_TTL', 86400))
+
+
+def fetch_profile(user_id: int):
+    """The users row that daily needs are computed from; cached until profile_edit."""
+    cache_key = None
+    try:
+        from redis_client import cache_get, cache_set, get_cache_key_for_profile
+        cache_key = get_cache_key_for_profile(user_id)
+        cached_profile = cache_get(cache_key)
+        if cached_profile is not None:
+            return cached_profile
+    except ImportError:
+        pass  # Redis not available, continue without cache
+
+    sql = """
+        SELECT id, username, age, sex, height_cm, weight_kg, activity_level, goal
+        FROM users WHERE id = :user_id
+    """
+    result = query(sql, {"user_id": user_id})
+    if not result:
+        return None
+    if cache_key:
+        cache_set(cache_key, result[0], ttl=PROFILE_CACHE_TTL)
+    return result[0]
+
+
+MAX_HISTORY_DAYS = 366
+
+
 def get_7_day_history():
-    username = get_jwt_identity()
+    identity = get_current_identity()
     
     try:
+        if not identity:
+            return response(400, "User not found")
+        username = identity.username
+
         # Try to get from cache first
+        cache_key = None
         try:
-            from redis_client import cache_get, cache_set, get_cache_key_for_7day_history
-            cache_key = get_cache_key_for_7day_history(username)
-            cached_data = cache_get(cache_key)
-            if cached_data is not None:
-                return response(200, "7-day history retrieved successfully (cached)", cached_data)
+            from redis_client import cache_get_raw_versioned, cache_set_raw, get_cache_key_for_7day_history, get_cache_key_for_response
+            cache_key, cached_body = cache_get_raw_versioned(
+                username, lambda version: get_cache_key_for_response(get_cache_key_for_7day_history(username, version)))
+            if cached_body is not None:
+                return raw_response(cached_body)
         except ImportError:
             pass  # Redis not available, continue without cache
         
-        sql = "SELECT id FROM users WHERE username = :username"
-        res = query(sql, {"username": username})
-        
-        if not res:
+        profile = fetch_profile(identity.user_id)
+        if not profile:
             return response(400, "User not found")
         
-        user_id = res[0]["id"]
         today = date.today()
-        history = []
-        
-        sql_profile = """
-            SELECT username, age, sex, height_cm, weight_kg, activity_level, goal
-            FROM users WHERE username = :username
-        """
-        profile_result = query(sql_profile, {"username": username})
-        if not profile_result:
-            return response(400, "User not found")
-        
-        profile = profile_result[0]
-        age_years = profile["age"]
-        sex = profile["sex"].lower()
-        weight_kg = float(profile["weight_kg"])
-        height_cm = float(profile["height_cm"])
-        activity_level = profile["activity_level"]
-        goal = profile.get("goal", "maintain")
-        
-        if sex == "male":
-            bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age_years + 5
-        else:
-            bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age_years - 161
-        
-        factors = {"sedentary": 1.2, "light": 1.375, "moderate": 1.55, "active": 1.725, "extra": 1.9}
-        tdee = bmr * factors[activity_level]
-        
-        # Adjust TDEE based on goal
-        goal_adjustments = {
-            "cut": -0.20,      # 20% deficit for weight loss
-            "maintain": 0.0,   # No adjustment for maintenance
-            "bulk": 0.20       # 20% surplus for weight gain
-        }
-        goal_multiplier = 1.0 + goal_adjustments.get(goal, 0.0)
-        adjusted_tdee = tdee * goal_multiplier
-        
-        protein = round(1.6 * weight_kg)
-        fat = round((adjusted_tdee * 0.25) / 9)
-        carbs = round((adjusted_tdee - (protein * 4 + fat * 9)) / 4)
-        
-        daily_needs = {"calories": round(adjusted_tdee), "protein_g": protein, "fat_g": fat, "carbs_g": carbs}
-        
-        for i in range(7):
-            target_date = today - timedelta(days=i)
-            nutrition = get_daily_nutrition(target_date)
-            
-            history.append({
-                "date": str(target_date),
-                "calories": nutrition.get("calories") if nutrition else None,
-                "protein": nutrition.get("protein") if nutrition else None,
-                "carbs": nutrition.get("carbs") if nutrition else None,
-                "fat": nutrition.get("fat") if nutrition else None,
-                "optimal": {
-                    "calories": daily_needs.get("calories", 0),
-                    "protein_g": daily_needs.get("protein_g", 0),
-                    "carbs_g": daily_needs.get("carbs_g", 0),
-                    "fat_g": daily_needs.get("fat_g", 0)
-                }
-            })
+        start_date = today - timedelta(days=6)
+        daily_needs = needs_for_profile(profile).targets()
+        rows = fetch_daily_totals(profile["id"], start_date, today)
         
         result_data = {
-            "history": history,
+            "history": build_daily_series(rows, start_date, today, daily_needs),
             "daily_needs": daily_needs
         }
         
-        # Cache the result (24 hour TTL)
-        try:
-            from redis_client import cache_set, get_cache_key_for_7day_history
-            cache_key = get_cache_key_for_7day_history(username)
-            cache_set(cache_key, result_data, ttl=86400)  # Cache for 24 hours
-        except ImportError:
-            pass
+        # Cache the body (24 hour TTL) under the version read before the queries
+        body, cached_body = encode_cacheable_response("7-day history retrieved successfully", result_data)
+        if cache_key:
+            cache_set_raw(cache_key, cached_body, ttl=86400)  # Cache for 24 hours
         
-        return response(200, "7-day history retrieved successfully", result_data)
+        return raw_response(body)
         
     except Exception as e:
         db.session.rollback()
         print('Get 7-day history error:', e)
-        return response(500, 'Failed to retrieve 7-day history')
\ No newline at end of file
+        return response(500, 'Failed to retrieve 7-day history')
+
+
+def get_nutrition_history(start_date: date, end_date: date):
+    identity = get_current_identity()
+
+    if start_date > end_date:
+        return response(400, "'from' must be on or before 'to'")
+    if (end_date - start_date).days + 1 > MAX_HISTORY_DAYS:
+        return response(400, f"Date range cannot exceed {MAX_HISTORY_DAYS} days")
+
+    try:
+        if not identity:
+            return response(400, "User not found")
+
+        profile = fetch_profile(identity.user_id)
+        if not profile:
+            return response(400, "User not found")
+
+        daily_needs = needs_for_profile(profile).targets()
+        rows = fetch_daily_totals(profile["id"], start_date, end_date)
+
+        return response(200, "History retrieved successfully", {
+            "from": str(start_date),
+            "to": str(end_date),
+            "history": build_daily_series(rows, start_date, end_date, daily_needs),
+            "daily_needs": daily_needs
+        })
+
+    except Exception as e:
+        db.session.rollback()
+        print('Get nutrition history error:', e)
+        return response(500, 'Failed to retrieve history')
+
+
+TREND_MAX_WINDOW = 90
+TREND_MAX_POINTS = 366
+
+
+def get_nutrition_trends(end_date: date, days: int = 30, window: int = 7, points: int = 60):
+    """Rolling averages, weekly buckets and target adherence for the `days` days ending
+    on end_date, from one daily_totals query (see analytics.compute_trends)."""
+    identity = get_current_identity()
+
+    if not 1 <= days <= MAX_HISTORY_DAYS:
+        return response(400, f"'days' must be between 1 and {MAX_HISTORY_DAYS}")
+    if not 1 <= window <= TREND_MAX_WINDOW:
+        return response(400, f"'window' must be between 1 and {TREND_MAX_WINDOW}")
+    if not 1 <= points <= TREND_MAX_POINTS:
+        return response(400, f"'points' must be between 1 and {TREND_MAX_POINTS}")
+
+    try:
+        if not identity:
+            return response(400, "User not found")
+
+        cache_key = None
+        try:
+            from redis_client import cache_get_raw_versioned, cache_set_raw, get_cache_key_for_trends, get_cache_key_for_response
+            params_key = f"{end_date}:{days}:{window}:{points}"
+            cache_key, cached_body = cache_get_raw_versioned(
+                identity.username,
+                lambda version: get_cache_key_for_response(get_cache_key_for_trends(identity.username, params_key, version)))
+            if cached_body is not None:
+                return raw_response(cached_body)
+        except ImportError:
+            pass  # Redis not available, continue without cache
+
+        profile = fetch_profile(identity.user_id)
+        if not profile:
+            return response(400, "User not found")
+
+        start_date = end_date - timedelta(days=days - 1)
+        rows = fetch_daily_totals(profile["id"], start_date, end_date)
+        trends = compute_trends(rows, start_date, days, needs_for_profile(profile).targets(),
+                                window=window, max_points=points)
+
+        body, cached_body = encode_cacheable_response("Trends retrieved successfully", {
+            "from": str(start_date),
+            "to": str(end_date),
+            "days": days,
+            **trends
+        })
+        if cache_key:
+            cache_set_raw(cache_key, cached_body, ttl=86400)
+
+        return raw_response(body)
+
+    except Exception as e:
+        db.session.rollback()
+        print('Get nutrition trends error:', e)
+        return response(500, 'Failed to retrieve trends')
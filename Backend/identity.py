@@ -0,0 +1,99 @@
+"""
+Request-scoped identity for authenticated handlers and MCP tools.
+
+Access tokens carry the numeric user id in the `uid` claim, so resolving the
+current user needs no database round trip. Tokens issued before the claim existed
+only carry the username; those are resolved once through the users table and kept
+in a bounded in-process LRU.
+"""
+import os
+import threading
+from collections import OrderedDict
+from flask import g, has_request_context
+from flask_jwt_extended import get_jwt, get_jwt_identity
+from sqlalchemy import text
+from database import db
+
+USER_ID_CLAIM = 'uid'
+USER_ID_CACHE_SIZE = int(os.getenv('USER_ID_CACHE_SIZE', 10000))
+
+_user_ids = OrderedDict()
+_user_ids_lock = threading.Lock()
+
+
+class Identity:
+    """The authenticated user for the current request."""
+
+    __slots__ = ('username', 'user_id')
+
+    def __init__(self, username: str, user_id: int):
+        self.username = username
+        self.user_id = user_id
+
+    def __repr__(self):
+        return f"Identity(username={self.username!r}, user_id={self.user_id!r})"
+
+
+def token_claims(user_id: int) -> dict:
+    """Additional access-token claims for a user."""
+    return {USER_ID_CLAIM: user_id}
+
+
+def remember_user_id(username: str, user_id: int):
+    with _user_ids_lock:
+        _user_ids[username] = user_id
+        _user_ids.move_to_end(username)
+        while len(_user_ids) > USER_ID_CACHE_SIZE:
+            _user_ids.popitem(last=False)
+
+
+def resolve_user_id(username: str):
+    """Map a username to its id via the LRU, falling back to one users lookup."""
+    with _user_ids_lock:
+        user_id = _user_ids.get(username)
+        if user_id is not None:
+            _user_ids.move_to_end(username)
+            return user_id
+
+    row = db.session.execute(
+        text("SELECT id FROM users WHERE username = :username"),
+        {"username": username}
+    ).fetchone()
+    if not row:
+        return None
+    remember_user_id(username, row[0])
+    return row[0]
+
+
+def get_current_identity():
+    """Return the Identity behind the request's access token, or None if it cannot be resolved."""
+    if has_request_context() and 'identity' in g:
+        return g.identity
+
+    username = get_jwt_identity()
+    if not username:
+        return None
+
+    user_id = get_jwt().get(USER_ID_CLAIM)
+    if user_id is None:
+        user_id = resolve_user_id(username)
+    identity = Identity(username, user_id) if user_id is not None else None
+
+    if has_request_context():
+        g.identity = identity
+    return identity
+
+
+def resolve_identity(username: str = None):
+    """Identity for `username`, reusing the request identity when it is the same user."""
+    if has_request_context():
+        try:
+            current = get_current_identity()
+        except Exception:
+            current = None
+        if current and (username is None or username == current.username):
+            return current
+    if not username:
+        return None
+    user_id = resolve_user_id(username)
+    return Identity(username, user_id) if user_id is not None else None
@@ -0,0 +1,88 @@
+"""
+Maintenance commands for the nutrition backend.
+
+Usage:
+    python manage.py backfill-daily-totals [--user-id ID]
+    python manage.py reconcile-daily-totals [--user-id ID] [--tolerance 0.01] [--fix]
+    python manage.py load-fdc PATH [--data-types foundation,sr_legacy,survey_fndds] [--batch-size 5000] [--restart]
+"""
+import argparse
+import sys
+
+
+def backfill_daily_totals_command(args):
+    from functions import backfill_daily_totals
+    result = backfill_daily_totals(args.user_id)
+    print(f"daily_totals backfill complete: {result['upserted']} day(s) upserted, {result['removed']} stale day(s) removed")
+    return 0
+
+
+def reconcile_daily_totals_command(args):
+    from functions import backfill_daily_totals, reconcile_daily_totals
+    drift = reconcile_daily_totals(args.user_id, args.tolerance)
+    for row in drift:
+        print(
+            f"drift user_id={row['user_id']} day={row['day']} "
+            f"calories expected={float(row['expected_calories']):.2f} stored={float(row['stored_calories']):.2f} "
+            f"entries expected={row['expected_entries']} stored={row['stored_entries']}"
+        )
+    print(f"{len(drift)} drifting day(s) found")
+
+    if drift and args.fix:
+        for user_id in sorted({row['user_id'] for row in drift}):
+            backfill_daily_totals(user_id)
+        print(f"Rebuilt daily_totals for {len({row['user_id'] for row in drift})} user(s)")
+        return 0
+    return 1 if drift else 0
+
+
+def load_fdc_command(args):
+    from fdc_loader import load_fdc_release
+    data_types = [data_type.strip() for data_type in args.data_types.split(',') if data_type.strip()]
+    try:
+        result = load_fdc_release(args.path, data_types, args.batch_size, args.restart, args.total)
+    except (ValueError, OSError) as e:
+        print(f"load-fdc failed: {e}")
+        return 1
+    print(
+        f"FoodData Central load complete: {result['read']} food(s) read, {result['inserted']} inserted, "
+        f"{result['skipped']} skipped without nutrition data in {result['seconds']}s"
+    )
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Nutrition backend maintenance commands")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    backfill = subparsers.add_parser("backfill-daily-totals", help="Rebuild the daily_totals rollup from user_intake")
+    backfill.add_argument("--user-id", type=int, default=None, help="Only rebuild this user's rollup")
+    backfill.set_defaults(func=backfill_daily_totals_command)
+
+    reconcile = subparsers.add_parser("reconcile-daily-totals", help="Report drift between daily_totals and user_intake")
+    reconcile.add_argument("--user-id", type=int, default=None, help="Only check this user")
+    reconcile.add_argument("--tolerance", type=float, default=0.01, help="Allowed absolute difference per nutrient")
+    reconcile.add_argument("--fix", action="store_true", help="Rebuild the rollup for users with drift")
+    reconcile.set_defaults(func=reconcile_daily_totals_command)
+
+    load_fdc = subparsers.add_parser("load-fdc", help="Bulk load a FoodData Central release into the food table")
+    load_fdc.add_argument("path", help="CSV release directory or JSON release file")
+    load_fdc.add_argument("--data-types", default="foundation,sr_legacy,survey_fndds",
+                          help="Comma-separated data types: foundation, sr_legacy, survey_fndds, branded")
+    load_fdc.add_argument("--batch-size", type=int, default=5000, help="Foods per COPY batch and checkpoint")
+    load_fdc.add_argument("--restart", action="store_true", help="Ignore the saved checkpoint and start over")
+    load_fdc.add_argument("--total", type=int, default=None, help="Expected food count, for percent progress")
+    load_fdc.set_defaults(func=load_fdc_command)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    from server import app
+    with app.app_context():
+        return args.func(args)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
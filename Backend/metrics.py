@@ -0,0 +1,140 @@
+"""
+Prometheus metrics for requests and the dependencies behind them.
+
+    http_request_duration_seconds   per route and method, from server.py's request hooks
+    http_requests_total             per route, method and response code (the "code" in the
+                                    JSON body; the HTTP status is always 200)
+    db_query_duration_seconds       per statement type, from engine events (database.py)
+    db_pool_wait_seconds            time spent waiting for a pooled connection
+    cache_lookups_total             hit/miss/error per tier (local, redis)
+    redis_operation_duration_seconds
+    usda_request_duration_seconds   per outcome (found, not_found, error)
+    llm_request_duration_seconds    per provider, model and outcome
+    llm_tokens_total                input/output tokens per provider and model
+
+The dependency observations are also charged to the current request's Server-Timing
+breakdown (request_timing.py).
+
+Multi-process deployments (several server processes, Celery workers) set
+PROMETHEUS_MULTIPROC_DIR to a directory shared by all of them and emptied before they
+start; each process then writes its samples there and /metrics from any process
+aggregates them all.
+
+/metrics is served only when METRICS_TOKEN is set, to scrapers sending it as a bearer
+token (Prometheus' `authorization` scrape option).
+"""
+import hmac
+import os
+
+import request_timing
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+)
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv('PROMETHEUS_MULTIPROC_DIR')
+METRICS_TOKEN = os.getenv('METRICS_TOKEN')
+
+# Dependency calls are mostly sub-millisecond to tens of milliseconds; requests and the
+# LLM reach into seconds
+FAST_BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5)
+SLOW_BUCKETS = (.01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 20, 30, 60)
+
+REQUEST_LATENCY = Histogram(
+    'http_request_duration_seconds', 'Request latency', ['method', 'endpoint'], buckets=SLOW_BUCKETS)
+REQUESTS = Counter(
+    'http_requests_total', 'Requests by response code', ['method', 'endpoint', 'code'])
+DB_QUERY_LATENCY = Histogram(
+    'db_query_duration_seconds', 'SQL statement latency', ['operation'], buckets=FAST_BUCKETS)
+DB_POOL_WAIT = Histogram(
+    'db_pool_wait_seconds', 'Wait for a pooled database connection', buckets=FAST_BUCKETS)
+DB_POOL_TIMEOUTS = Counter(
+    'db_pool_timeouts_total', 'Checkouts that gave up waiting for a connection')
+DB_POOL_CHECKED_OUT = Gauge(
+    'db_pool_checked_out', 'Database connections currently checked out', multiprocess_mode='livesum')
+DB_POOL_OVERFLOW = Gauge(
+    'db_pool_overflow', 'Connections open beyond the pool size', multiprocess_mode='livesum')
+CACHE_LOOKUPS = Counter(
+    'cache_lookups_total', 'Cache lookups by tier and result', ['tier', 'result'])
+REDIS_LATENCY = Histogram(
+    'redis_operation_duration_seconds', 'Redis round-trip latency', ['operation'], buckets=FAST_BUCKETS)
+USDA_LATENCY = Histogram(
+    'usda_request_duration_seconds', 'FoodData Central search latency', ['outcome'], buckets=SLOW_BUCKETS)
+LLM_LATENCY = Histogram(
+    'llm_request_duration_seconds', 'LLM API call latency', ['provider', 'model', 'outcome'],
+    buckets=SLOW_BUCKETS)
+LLM_TOKENS = Counter(
+    'llm_tokens_total', 'LLM tokens used', ['provider', 'model', 'direction'])
+
+_SQL_OPERATIONS = {'select', 'insert', 'update', 'delete', 'with'}
+
+
+def sql_operation(statement: str) -> str:
+    """Low-cardinality label for a statement: its leading keyword."""
+    keyword = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ''
+    return keyword if keyword in _SQL_OPERATIONS else 'other'
+
+
+def observe_request(method: str, endpoint: str, code: int, seconds: float):
+    REQUEST_LATENCY.labels(method, endpoint).observe(seconds)
+    REQUESTS.labels(method, endpoint, str(code)).inc()
+
+
+def observe_db_query(statement: str, seconds: float):
+    DB_QUERY_LATENCY.labels(sql_operation(statement)).observe(seconds)
+    request_timing.add('db', seconds)
+
+
+def observe_pool_wait(seconds: float, timed_out: bool = False):
+    DB_POOL_WAIT.observe(seconds)
+    if timed_out:
+        DB_POOL_TIMEOUTS.inc()
+
+
+def set_pool_checked_out(count: int):
+    DB_POOL_CHECKED_OUT.set(count)
+
+
+def set_pool_overflow(count: int):
+    DB_POOL_OVERFLOW.set(max(count, 0))
+
+
+def observe_cache_lookup(tier: str, result: str):
+    CACHE_LOOKUPS.labels(tier, result).inc()
+
+
+def observe_redis(operation: str, seconds: float):
+    REDIS_LATENCY.labels(operation).observe(seconds)
+    request_timing.add('cache', seconds)
+
+
+def observe_usda(outcome: str, seconds: float):
+    USDA_LATENCY.labels(outcome).observe(seconds)
+    request_timing.add('usda', seconds)
+
+
+def observe_llm(provider: str, model: str, outcome: str, seconds: float,
+                input_tokens: int = 0, output_tokens: int = 0):
+    LLM_LATENCY.labels(provider, model, outcome).observe(seconds)
+    request_timing.add('llm', seconds)
+    if input_tokens:
+        LLM_TOKENS.labels(provider, model, 'input').inc(input_tokens)
+    if output_tokens:
+        LLM_TOKENS.labels(provider, model, 'output').inc(output_tokens)
+
+
+def scrape_authorized(authorization: str) -> bool:
+    """True if an Authorization header carries METRICS_TOKEN; always False while it is unset."""
+    if not METRICS_TOKEN:
+        return False
+    return hmac.compare_digest((authorization or '').encode(), f'Bearer {METRICS_TOKEN}'.encode())
+
+
+def render_metrics():
+    """(body, content type) in the Prometheus text format, across all processes when
+    PROMETHEUS_MULTIPROC_DIR is set."""
+    if PROMETHEUS_MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -0,0 +1,168 @@
+"""
+Daily calorie and macro targets (Mifflin-St Jeor BMR, activity multiplier, goal adjustment).
+
+Two entry points:
+    compute_needs        one profile; memoized on the normalized profile tuple, so
+                         repeated requests for an unchanged profile cost a dict lookup
+    compute_needs_batch  many profiles as NumPy arrays, element-for-element equal to
+                         compute_needs (same operation order, same half-to-even rounding)
+
+Both raise InvalidProfile for values the formula cannot use.
+"""
+import math
+import os
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+ACTIVITY_FACTORS = {"sedentary": 1.2, "light": 1.375, "moderate": 1.55, "active": 1.725, "extra": 1.9}
+
+GOAL_ADJUSTMENTS = {
+    "cut": -0.20,      # 20% deficit for weight loss
+    "maintain": 0.0,   # No adjustment for maintenance
+    "bulk": 0.20       # 20% surplus for weight gain
+}
+
+SEX_OFFSETS = {"male": 5, "female": -161}
+
+NEEDS_CACHE_SIZE = int(os.getenv('NEEDS_CACHE_SIZE', 4096))
+
+
+class InvalidProfile(ValueError):
+    """The profile is missing a value or has one the formula does not know."""
+
+
+class Needs(NamedTuple):
+    calories: int
+    protein_g: int
+    fat_g: int
+    carbs_g: int
+    bmr: int
+    tdee: int
+    activity_multiplier: float
+    goal: str
+    goal_adjustment: str
+
+    def targets(self) -> dict:
+        """The four daily targets, as embedded in history entries."""
+        return {"calories": self.calories, "protein_g": self.protein_g, "fat_g": self.fat_g, "carbs_g": self.carbs_g}
+
+    def as_dict(self) -> dict:
+        return self._asdict()
+
+
+def compute_needs(sex: str, weight_kg, height_cm, age, activity_level: str, goal: str = None) -> Needs:
+    """Needs for one profile. Inputs are normalized first so Decimal/float/str variants of
+    the same profile share a cache entry."""
+    if not all([weight_kg, height_cm, age]):
+        raise InvalidProfile("missing required profile data: weight_kg, height_cm, age")
+    try:
+        # Ages stay fractional, as the formula always took them
+        numbers = float(weight_kg), float(height_cm), float(age)
+    except (TypeError, ValueError):
+        raise InvalidProfile("weight_kg, height_cm and age must be numbers")
+    if not all(math.isfinite(n) and n > 0 for n in numbers):
+        raise InvalidProfile("weight_kg, height_cm and age must be positive numbers")
+    return _compute_needs((sex or "").lower(), *numbers, activity_level, goal or "maintain")
+
+
+def needs_for_profile(profile: dict) -> Needs:
+    """compute_needs for a users row (or any dict with the same keys)."""
+    return compute_needs(profile["sex"], profile["weight_kg"], profile["height_cm"], profile["age"],
+                         profile["activity_level"], profile.get("goal"))
+
+
+def _validate(sex: str, activity_level: str, goal: str):
+    if sex not in SEX_OFFSETS:
+        raise InvalidProfile(f"invalid sex value: {sex}")
+    if activity_level not in ACTIVITY_FACTORS:
+        raise InvalidProfile(f"invalid activity_level: {activity_level}")
+    if goal not in GOAL_ADJUSTMENTS:
+        raise InvalidProfile(f"invalid goal value: {goal}. Must be 'cut', 'maintain', or 'bulk'")
+
+
+@lru_cache(maxsize=NEEDS_CACHE_SIZE)
+def _compute_needs(sex: str, weight_kg: float, height_cm: float, age: float, activity_level: str, goal: str) -> Needs:
+    _validate(sex, activity_level, goal)
+
+    bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age + SEX_OFFSETS[sex]
+    tdee = bmr * ACTIVITY_FACTORS[activity_level]
+    adjusted_tdee = tdee * (1.0 + GOAL_ADJUSTMENTS[goal])
+
+    protein = round(1.6 * weight_kg)
+    fat = round((adjusted_tdee * 0.25) / 9)
+    carbs = round((adjusted_tdee - (protein * 4 + fat * 9)) / 4)
+
+    return Needs(
+        calories=round(adjusted_tdee),
+        protein_g=protein,
+        fat_g=fat,
+        carbs_g=carbs,
+        bmr=round(bmr),
+        tdee=round(tdee),
+        activity_multiplier=ACTIVITY_FACTORS[activity_level],
+        goal=goal,
+        goal_adjustment=f"{GOAL_ADJUSTMENTS[goal]*100:.0f}%"
+    )
+
+
+def _lookup(values: np.ndarray, table: dict) -> np.ndarray:
+    """Map a column of labels through table, touching Python once per distinct label.
+    Unknown labels map to NaN."""
+    labels, inverse = np.unique(values, return_inverse=True)
+    return np.array([table.get(label, np.nan) for label in labels], dtype=np.float64)[inverse.reshape(-1)]
+
+
+def compute_needs_batch(sex, weight_kg, height_cm, age, activity_level, goal=None) -> dict:
+    """Needs for N profiles given as equal-length sequences (or arrays).
+
+    Returns a dict of int64 arrays: calories, protein_g, fat_g, carbs_g, bmr, tdee.
+    Inputs are normalized as in compute_needs, and an unusable profile raises the
+    InvalidProfile that compute_needs raises for the first such profile.
+    """
+    n = len(weight_kg)
+    if goal is None:
+        goal = [None] * n
+    columns = (sex, weight_kg, height_cm, age, activity_level, goal)
+    if not all(len(column) == n for column in columns):
+        raise InvalidProfile("all profile columns must have the same length")
+
+    sex_labels = np.array([(s or "").lower() for s in sex], dtype=str)
+    activity_labels = np.array([str(a) for a in activity_level], dtype=str)
+    goal_labels = np.array([g or "maintain" for g in goal], dtype=str)
+    try:
+        numbers = np.array([weight_kg, height_cm, age], dtype=np.float64).reshape(3, n)
+        converted = True
+    except (TypeError, ValueError):
+        numbers = np.full((3, n), np.nan)
+        converted = False
+    offsets = _lookup(sex_labels, SEX_OFFSETS)
+    factors = _lookup(activity_labels, ACTIVITY_FACTORS)
+    adjustments = _lookup(goal_labels, GOAL_ADJUSTMENTS)
+
+    valid = (np.isfinite(numbers) & (numbers > 0)).all(axis=0)
+    valid &= ~(np.isnan(offsets) | np.isnan(factors) | np.isnan(adjustments))
+    if not valid.all():
+        # Rare path: let the scalar API raise the exact error for the first bad profile
+        for i in (np.flatnonzero(~valid) if converted else range(n)):
+            compute_needs(*(column[i] for column in columns))
+        raise InvalidProfile("invalid profile data")
+    weight_kg, height_cm, age = numbers
+
+    bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age + offsets
+    tdee = bmr * factors
+    adjusted_tdee = tdee * (1.0 + adjustments)
+
+    protein = np.round(1.6 * weight_kg)
+    fat = np.round((adjusted_tdee * 0.25) / 9)
+    carbs = np.round((adjusted_tdee - (protein * 4 + fat * 9)) / 4)
+
+    return {
+        "calories": np.round(adjusted_tdee).astype(np.int64),
+        "protein_g": protein.astype(np.int64),
+        "fat_g": fat.astype(np.int64),
+        "carbs_g": carbs.astype(np.int64),
+        "bmr": np.round(bmr).astype(np.int64),
+        "tdee": np.round(tdee).astype(np.int64),
+    }
@@ -1,12 +1,44 @@
 import os
 import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
 import redis
+from redis.backoff import NoBackoff
+from redis.retry import Retry
 from typing import Optional, Any
 from decimal import Decimal
 from datetime import date, datetime
+from local_cache import LocalCache
+from circuit_breaker import CircuitBreaker, CLOSED
+import metrics
 
 _redis_client = None
 
+# First tier: decoded values held in this process. Writes publish the keys they touch on
+# INVALIDATION_CHANNEL and every other process drops its local copy as the message
+# arrives; LOCAL_CACHE_TTL bounds staleness if a message is ever missed.
+LOCAL_CACHE_SIZE = int(os.getenv('LOCAL_CACHE_SIZE', 2048))
+LOCAL_CACHE_TTL = float(os.getenv('LOCAL_CACHE_TTL', 30))
+INVALIDATION_CHANNEL = os.getenv('CACHE_INVALIDATION_CHANNEL', 'cache:invalidate')
+INSTANCE_ID = uuid.uuid4().hex
+
+_local_cache = LocalCache(LOCAL_CACHE_SIZE, LOCAL_CACHE_TTL)
+_redis_stats = {"hits": 0, "misses": 0, "errors": 0}
+_redis_stats_lock = threading.Lock()
+_listener_thread = None
+_listener_lock = threading.Lock()
+_MISSING = object()
+_LOOKUP_RESULTS = {"hits": "hit", "misses": "miss", "errors": "error"}
+
+# While Redis is unreachable every cache call fails fast instead of waiting on connect timeouts
+_breaker = CircuitBreaker(
+    failure_threshold=int(os.getenv('REDIS_BREAKER_FAILURES', 3)),
+    base_backoff=float(os.getenv('REDIS_BREAKER_BASE_BACKOFF', 1)),
+    max_backoff=float(os.getenv('REDIS_BREAKER_MAX_BACKOFF', 60))
+)
+
 class CustomJSONEncoder(json.JSONEncoder):
     def default(self, obj):
         if isinstance(obj, Decimal):
@@ -16,10 +48,15 @@ class CustomJSONEncoder(json.JSONEncoder):
         return super().default(obj)
 
 def get_redis_client():
-    """Get or create Redis client. Works with GCloud Memorystore or local Redis."""
+    """Get or create Redis client. Works with GCloud Memorystore or local Redis.
+
+    Returns None without touching the network while the circuit breaker is open.
+    """
     global _redis_client
     
-    if _redis_client is not None:
+    if not _breaker.allow_request():
+        return None
+    if _redis_client is not None and _breaker.state == CLOSED:
         return _redis_client
     
     redis_host = os.getenv('REDIS_HOST', 'localhost')
@@ -27,108 +64,358 @@ def get_redis_client():
     redis_password = os.getenv('REDIS_PASSWORD', None)
     redis_db = int(os.getenv('REDIS_DB', 0))
     
+    # First connection, or the half-open probe after an outage
     try:
-        _redis_client = redis.Redis(
-            host=redis_host,
-            port=redis_port,
-            password=redis_password,
-            db=redis_db,
-            decode_responses=True,
-            socket_connect_timeout=5,
-            socket_timeout=5,
-            health_check_interval=30
-        )
+        if _redis_client is None:
+            _redis_client = redis.Redis(
+                host=redis_host,
+                port=redis_port,
+                password=redis_password,
+                db=redis_db,
+                decode_responses=True,
+                socket_connect_timeout=5,
+                socket_timeout=5,
+                health_check_interval=30,
+                # Retrying is the breaker's job; redis-py's own retries would stretch one
+                # failed connect far past the timeouts above
+                retry=Retry(NoBackoff(), 0)
+            )
         _redis_client.ping()
+        _breaker.record_success()
         print(f"Redis connected: {redis_host}:{redis_port}")
+        start_invalidation_listener(_redis_client)
         return _redis_client
     except Exception as e:
-        print(f"Redis connection failed: {e}. Continuing without cache.")
+        _breaker.trip(e)
+        _distrust_local_cache()
+        print(f"Redis connection failed: {e}. Continuing without cache for {_breaker.backoff:g}s.")
         return None
 
+def _record_error(e: Exception):
+    """Count connection-level failures towards opening the breaker."""
+    if isinstance(e, (redis.ConnectionError, redis.TimeoutError)):
+        _breaker.record_failure(e)
+        _distrust_local_cache()
+
+def _distrust_local_cache():
+    """Drop the local tier once the breaker opens: invalidations (ours and other
+    processes') can't get through Redis, so nothing held locally can be trusted."""
+    if _breaker.state != CLOSED:
+        _local_cache.clear()
+
+def get_circuit_state() -> dict:
+    """Redis circuit breaker state, for health checks and alerting."""
+    return _breaker.snapshot()
+
+def _count(stat: str):
+    with _redis_stats_lock:
+        _redis_stats[stat] += 1
+    metrics.observe_cache_lookup("redis", _LOOKUP_RESULTS[stat])
+
+@contextmanager
+def _timed(operation: str):
+    """Record the latency of one Redis round trip."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.observe_redis(operation, time.perf_counter() - start)
+
+def _invalidation_message(keys) -> str:
+    return json.dumps({"origin": INSTANCE_ID, "keys": list(keys)})
+
+def _listen_for_invalidations(client):
+    """Drop local entries named by other processes' invalidation messages."""
+    while True:
+        pubsub = None
+        try:
+            pubsub = client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(INVALIDATION_CHANNEL)
+            while True:
+                message = pubsub.get_message(timeout=1.0)
+                if not message or message.get("type") != "message":
+                    continue
+                payload = json.loads(message["data"])
+                if payload.get("origin") == INSTANCE_ID:
+                    continue
+                for key in payload.get("keys", []):
+                    _local_cache.delete(key)
+        except Exception as e:
+            # Messages may have been missed while disconnected, so nothing local can be trusted
+            print(f"Cache invalidation listener error: {e}")
+            _local_cache.clear()
+            _record_error(e)
+            time.sleep(max(1, get_circuit_state()["retry_in_seconds"] or 0))
+        finally:
+            if pubsub is not None:
+                try:
+                    pubsub.close()
+                except Exception:
+                    pass
+
+def start_invalidation_listener(client):
+    """Start the per-process pub/sub listener once."""
+    global _listener_thread
+    if LOCAL_CACHE_SIZE <= 0:
+        return
+    with _listener_lock:
+        if _listener_thread is not None and _listener_thread.is_alive():
+            return
+        _listener_thread = threading.Thread(
+            target=_listen_for_invalidations, args=(client,), name="cache-invalidation", daemon=True
+        )
+        _listener_thread.start()
+
 def cache_get(key: str) -> Optional[Any]:
-    """Get value from cache."""
+    """Get value from cache, trying the in-process tier before Redis."""
+    return _cache_get(key, json.loads)
+
+def cache_get_raw(key: str) -> Optional[bytes]:
+    """Get a body stored with cache_set_raw as bytes, without decoding it."""
+    return _cache_get(key, str.encode)
+
+def _cache_get(key: str, load) -> Optional[Any]:
+    # While the breaker is not closed a local entry may have missed its invalidation
+    if _breaker.state == CLOSED:
+        value = _local_cache.get(key, _MISSING)
+        if value is not _MISSING:
+            metrics.observe_cache_lookup("local", "hit")
+            return value
+        metrics.observe_cache_lookup("local", "miss")
     try:
         client = get_redis_client()
         if not client:
             return None
         
-        value = client.get(key)
-        if value:
-            return json.loads(value)
+        generation = _local_cache.generation
+        with _timed("get"):
+            raw = client.get(key)
+        if raw:
+            value = load(raw)
+            _count("hits")
+            _local_cache.set(key, value, generation=generation)
+            _breaker.record_success()
+            return value
+        _count("misses")
+        _breaker.record_success()
         return None
     except Exception as e:
+        _count("errors")
+        _record_error(e)
         print(f"Cache get error: {e}")
         return None
 
 def cache_set(key: str, value: Any, ttl: int = 3600):
-    """Set value in cache with TTL (default 1 hour)."""
+    """Set value in cache with TTL (default 1 hour) and tell other processes to drop their copy."""
+    raw = json.dumps(value, cls=CustomJSONEncoder)
+    # Keep the decoded form locally so both tiers return the same types (floats, ISO
+    # strings) and a caller mutating its result can't reach the cached copy
+    return _cache_set(key, raw, json.loads(raw), ttl)
+
+def cache_set_raw(key: str, body: bytes, ttl: int = 3600):
+    """Store an already-encoded UTF-8 body as-is; read it back with cache_get_raw."""
+    return _cache_set(key, body, body, ttl)
+
+def _cache_set(key: str, raw, value, ttl: int):
     try:
         client = get_redis_client()
         if not client:
             return False
         
-        client.setex(key, ttl, json.dumps(value, cls=CustomJSONEncoder))
+        pipe = client.pipeline(transaction=False)
+        pipe.setex(key, ttl, raw)
+        pipe.publish(INVALIDATION_CHANNEL, _invalidation_message([key]))
+        with _timed("set"):
+            pipe.execute()
+        _local_cache.set(key, value, ttl)
+        _breaker.record_success()
         return True
     except Exception as e:
+        _local_cache.delete(key)
+        _record_error(e)
         print(f"Cache set error: {e}")
         return False
 
 def cache_delete(key: str):
-    """Delete key from cache."""
+    """Delete key from cache, locally and in every other process."""
+    _local_cache.delete(key)
     try:
         client = get_redis_client()
         if client:
-            client.delete(key)
+            pipe = client.pipeline(transaction=False)
+            pipe.delete(key)
+            pipe.publish(INVALIDATION_CHANNEL, _invalidation_message([key]))
+            with _timed("delete"):
+                pipe.execute()
+            _breaker.record_success()
     except Exception as e:
+        _record_error(e)
         print(f"Cache delete error: {e}")
 
-def get_cache_key_for_recommendation(username: str, query_hash: str) -> str:
-    """Generate cache key for recommendation."""
-    return f"recommendation:{username}:{query_hash}"
+def get_cache_stats() -> dict:
+    """Hit/miss counters for both tiers."""
+    with _redis_stats_lock:
+        redis_stats = dict(_redis_stats)
+    return {
+        "local": _local_cache.stats(),
+        "redis": redis_stats,
+        "invalidation_listener": bool(_listener_thread and _listener_thread.is_alive()),
+        "circuit": _breaker.snapshot(),
+    }
+
+# Per-user data version. Keys derived from a user's intake or profile embed it, so one
+# INCR makes every older entry unreachable; those entries then age out on their TTL.
+# The version key outlives any data entry, so an expired counter restarting at 0 can
+# never resurface live entries.
+CACHE_VERSION_TTL = int(os.getenv('CACHE_VERSION_TTL', 86400 * 30))
+
+def get_cache_key_for_user_version(username: str) -> str:
+    """Generate cache key for a user's data version counter."""
+    return f"cache_version:{username}"
+
+def get_user_cache_version(username: str) -> int:
+    """Current data version of a user (0 when never bumped or Redis is unavailable)."""
+    try:
+        client = get_redis_client()
+        if not client:
+            return 0
+        key = get_cache_key_for_user_version(username)
+        version = _local_cache.get(key)
+        if version is None:
+            generation = _local_cache.generation
+            with _timed("version"):
+                value = client.get(key)
+            version = int(value) if value else 0
+            _local_cache.set(key, version, generation=generation)
+            _breaker.record_success()
+        return version
+    except Exception as e:
+        _record_error(e)
+        print(f"Cache version error: {e}")
+        return 0
+
+def _version(username: str, version) -> str:
+    """The version a key helper embeds: the one given, or the user's current version."""
+    return get_user_cache_version(username) if version is None else version
+
+# Stands in for the version when a versioned key is split around it for _VERSIONED_GET
+_VERSION_SLOT = "\x00"
+
+# Reads a user's version and the entry keyed by it in one round trip (KEYS[1] is the
+# version key; the entry key is ARGV[1] .. version .. ARGV[2])
+_VERSIONED_GET = """
+local version = redis.call('GET', KEYS[1]) or '0'
+return {version, redis.call('GET', ARGV[1] .. version .. ARGV[2]) or false}
+"""
+_versioned_get_supported = True
+
+def cache_get_versioned(username: str, build_key) -> tuple:
+    """Read a versioned entry: build_key(version) names it. Returns (key, value or None)."""
+    return _cache_get_versioned(username, build_key, json.loads)
+
+def cache_get_raw_versioned(username: str, build_key) -> tuple:
+    """cache_get_versioned for bodies stored with cache_set_raw."""
+    return _cache_get_versioned(username, build_key, str.encode)
+
+def _cache_get_versioned(username: str, build_key, load) -> tuple:
+    global _versioned_get_supported
+    client = get_redis_client()
+    version_key = get_cache_key_for_user_version(username)
+    version = _local_cache.get(version_key) if client else 0
+    if version is not None or not _versioned_get_supported:
+        key = build_key(version if version is not None else get_user_cache_version(username))
+        return key, _cache_get(key, load)
+
+    # Local tier has no version: fetch it and the entry together rather than in two GETs
+    prefix, suffix = build_key(_VERSION_SLOT).split(_VERSION_SLOT)
+    key = build_key(0)
+    try:
+        generation = _local_cache.generation
+        with _timed("get"):
+            version, raw = client.eval(_VERSIONED_GET, 1, version_key, prefix, suffix)
+        version = int(version)
+        _local_cache.set(version_key, version, generation=generation)
+        key = build_key(version)
+        value = None
+        if raw:
+            value = load(raw)
+            _count("hits")
+            _local_cache.set(key, value, generation=generation)
+        else:
+            _count("misses")
+        _breaker.record_success()
+        return key, value
+    except redis.ResponseError as e:
+        # Scripting disabled on this server: stay on separate GETs from now on
+        print(f"Versioned cache get unavailable ({e}), using two round trips")
+        _versioned_get_supported = False
+        key = build_key(get_user_cache_version(username))
+        return key, _cache_get(key, load)
+    except Exception as e:
+        _count("errors")
+        _record_error(e)
+        print(f"Cache get error: {e}")
+        return key, None
+
+def get_cache_key_for_recommendation(username: str, query_hash: str, version=None) -> str:
+    """Generate cache key for recommendation (answers depend on the user's logged data)."""
+    return f"recommendation:{username}:v{_version(username, version)}:{query_hash}"
 
 def get_cache_key_for_chat(username: str) -> str:
     """Generate cache key for chat history."""
     return f"chat_history:{username}"
 
-def get_cache_key_for_daily_nutrition(username: str, target_date: str) -> str:
+def get_cache_key_for_profile(user_id: int) -> str:
+    """Not versioned: only profile_edit changes it, and it deletes the key directly."""
+    return f"profile:{user_id}"
+
+def get_cache_key_for_daily_nutrition(username: str, target_date: str, version=None) -> str:
     """Generate cache key for daily nutrition data."""
-    return f"nutrition:{username}:{target_date}"
+    return f"nutrition:{username}:v{_version(username, version)}:{target_date}"
 
-def get_cache_key_for_7day_history(username: str) -> str:
+def get_cache_key_for_7day_history(username: str, version=None) -> str:
     """Generate cache key for 7-day nutrition history."""
-    return f"history_7days:{username}"
-
-def get_cache_key_for_logs(username: str, date_filter: str = None) -> str:
-    """Generate cache key for food intake logs."""
-    if date_filter:
-        return f"logs:{username}:{date_filter}"
-    return f"logs:{username}:all"
-
-def invalidate_nutrition_cache(username: str, affected_date: str = None):
-    """Invalidate all nutrition-related cache for a user.
-    If affected_date is provided, only invalidates cache for that date and 7-day history.
-    Otherwise, invalidates all nutrition cache for the user.
+    return f"history_7days:{username}:v{_version(username, version)}"
+
+def get_cache_key_for_response(key: str) -> str:
+    """Namespace for full response bodies (cache_set_raw) derived from a data key."""
+    return f"response:{key}"
+
+def get_cache_key_for_trends(username: str, params_key: str, version=None) -> str:
+    """Generate cache key for a trends request."""
+    return f"trends:{username}:v{_version(username, version)}:{params_key}"
+
+def get_cache_key_for_logs(username: str, page_key: str = None, version=None) -> str:
+    """Generate cache key for one page of food intake logs."""
+    return f"logs:{username}:v{_version(username, version)}:{page_key or 'all'}"
+
+def invalidate_nutrition_cache(username: str):
+    """Invalidate every cached view of a user's intake and profile data.
+
+    Bumps the user's data version with a single INCR (its TTL refresh and the pub/sub
+    notice to other processes ride in the same round trip), so logs, daily nutrition, history and recommendations are all
+    recomputed on next read.
     """
+    key = get_cache_key_for_user_version(username)
+    _local_cache.delete(key)
     try:
         client = get_redis_client()
         if not client:
             return
-        cache_delete(get_cache_key_for_7day_history(username))
-        cache_delete(get_cache_key_for_logs(username))
-        if affected_date:
-            cache_delete(get_cache_key_for_logs(username, affected_date))
-        
-        # Invalidate daily nutrition cache
-        if affected_date:
-            cache_delete(get_cache_key_for_daily_nutrition(username, affected_date))
-        else:
-            # If no specific date, invalidate all dates in past 7 days
-            from datetime import date, timedelta
-            today = date.today()
-            for i in range(7):
-                target_date = today - timedelta(days=i)
-                cache_delete(get_cache_key_for_daily_nutrition(username, str(target_date)))
+        pipe = client.pipeline(transaction=True)
+        pipe.incr(key)
+        pipe.expire(key, CACHE_VERSION_TTL)
+        pipe.publish(INVALIDATION_CHANNEL, _invalidation_message([key]))
+        with _timed("invalidate"):
+            pipe.execute()
+        # A reader in this process may have fetched and cached the old version while the
+        # INCR was in flight; our own pub/sub notice is ignored, so drop it again here
+        _local_cache.delete(key)
+        _breaker.record_success()
     except Exception as e:
+        _record_error(e)
         print(f"Cache invalidation error: {e}")
 
-
+def invalidate_profile_cache(user_id: int):
+    """Drop the cached profile row after the profile changes."""
+    cache_delete(get_cache_key_for_profile(user_id))
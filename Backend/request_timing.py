@@ -0,0 +1,64 @@
+"""
+Per-request time breakdown, sent back in a Server-Timing header.
+
+    Server-Timing: db;dur=12.4;desc="3 calls", cache;dur=0.9;desc="2 calls", usda;dur=0.0,
+                   llm;dur=0.0, serialize;dur=0.3, total;dur=15.1
+
+The dependency time comes from the same observation points as the Prometheus metrics
+(metrics.py); serialize is the JSON encoding in functions.response(). Anything
+outside a request (Celery tasks, manage.py) is not accumulated. Browser dev tools show
+the header in the request's Timing tab. SERVER_TIMING=false leaves it out.
+"""
+import os
+import time
+from flask import g, has_request_context
+
+SERVER_TIMING = os.getenv('SERVER_TIMING', 'true').lower() == 'true'
+
+COMPONENTS = ("db", "cache", "usda", "llm", "serialize")
+
+
+def start():
+    g.request_start = time.perf_counter()
+    g.request_timings = {}
+
+
+def add(component: str, seconds: float):
+    """Charge `seconds` to a component of the current request, if there is one."""
+    if not has_request_context() or 'request_timings' not in g:
+        return
+    spent, calls = g.request_timings.get(component, (0.0, 0))
+    g.request_timings[component] = (spent + seconds, calls + 1)
+
+
+def merge_concurrent(task_timings):
+    """Fold the timings of tasks that ran side by side (each with its own dict) into the
+    current request. They overlapped, so a component is charged the longest task's time
+    rather than the sum; call counts add up."""
+    if not has_request_context() or 'request_timings' not in g:
+        return
+    merged = {}
+    for timings in task_timings:
+        for component, (spent, calls) in timings.items():
+            longest, total_calls = merged.get(component, (0.0, 0))
+            merged[component] = (max(longest, spent), total_calls + calls)
+    for component, (spent, calls) in merged.items():
+        previous, previous_calls = g.request_timings.get(component, (0.0, 0))
+        g.request_timings[component] = (previous + spent, previous_calls + calls)
+
+
+def elapsed() -> float:
+    return time.perf_counter() - g.request_start
+
+
+def server_timing_header(total: float) -> str:
+    timings = g.get('request_timings', {})
+    parts = []
+    for component in COMPONENTS:
+        spent, calls = timings.get(component, (0.0, 0))
+        part = f"{component};dur={spent * 1000:.1f}"
+        if calls > 1:
+            part += f';desc="{calls} calls"'
+        parts.append(part)
+    parts.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(parts)
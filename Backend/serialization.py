@@ -0,0 +1,81 @@
+"""
+JSON encoding for API responses.
+
+Two backends:
+    stdlib  json.dumps with sorted keys, byte-identical to the original response()
+            output; always available
+    orjson  native encoder; dates and datetimes are encoded in C, Decimals through
+            a single default hook, keys stay in insertion order
+
+JSON_BACKEND selects one: "stdlib", "orjson", or "auto" (default: orjson when it
+is installed, stdlib otherwise).
+
+encode_response() wraps an already-encoded data payload in the response() envelope
+without touching the payload again, so cached bodies can be assembled by concatenation.
+"""
+import json
+import os
+from datetime import date, datetime
+from decimal import Decimal
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+def _default(obj):
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    elif isinstance(obj, Decimal):
+        return float(obj)
+    raise TypeError(f"Type {type(obj)} not serializable")
+
+
+class StdlibBackend:
+    name = 'stdlib'
+
+    def dumps(self, obj) -> bytes:
+        return json.dumps(obj, sort_keys=True, ensure_ascii=False, default=_default).encode('utf-8')
+
+    def envelope(self, code: int, message: bytes, data: bytes) -> bytes:
+        return b'{"code": %d, "data": %s, "message": %s}' % (code, data, message)
+
+
+class OrjsonBackend:
+    name = 'orjson'
+
+    def dumps(self, obj) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_NON_STR_KEYS)
+
+    def envelope(self, code: int, message: bytes, data: bytes) -> bytes:
+        return b'{"code":%d,"message":%s,"data":%s}' % (code, message, data)
+
+
+BACKENDS = {'stdlib': StdlibBackend}
+if orjson is not None:
+    BACKENDS['orjson'] = OrjsonBackend
+
+
+def load_backend(name: str = None):
+    """Instantiate the backend called `name` (or JSON_BACKEND), falling back to stdlib."""
+    name = (name or os.getenv('JSON_BACKEND', 'auto')).lower()
+    if name == 'auto':
+        name = 'orjson' if 'orjson' in BACKENDS else 'stdlib'
+    if name not in BACKENDS:
+        print(f"JSON backend '{name}' is not available, using stdlib")
+        name = 'stdlib'
+    return BACKENDS[name]()
+
+
+backend = load_backend()
+
+
+def dumps(obj) -> bytes:
+    """Encode obj as UTF-8 JSON with the configured backend."""
+    return backend.dumps(obj)
+
+
+def encode_response(code: int, message: str, data: bytes) -> bytes:
+    """The response(code, message, ...) body around `data`, which is already dumps() output."""
+    return backend.envelope(code, backend.dumps(message), data)
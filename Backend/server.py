@@ -1,11 +1,18 @@
 import os
+# Before anything imports socket, ssl or threading (see cooperative.py)
+if __name__ == '__main__':
+    import cooperative
+    if cooperative.GEVENT_COOPERATIVE:
+        cooperative.enable()
 from datetime import timedelta, datetime
-from flask import Flask, request
+from flask import Flask, g, request
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager, get_jwt_identity, verify_jwt_in_request, jwt_required
 from gevent import pywsgi
 from dotenv import load_dotenv
-from database import db
+from database import db, engine_options, get_pool_stats
+import metrics
+import request_timing
 from functions import (
     register_user,
     login_user,
@@ -18,9 +25,14 @@ from functions import (
     delete_log,
     dv_summation,
     get_7_day_history,
-    get_daily_needs
+    get_nutrition_history,
+    get_nutrition_trends,
+    get_daily_needs,
+    search_food_catalog,
+    get_log_status,
+    batch_logs
 )
-from chat_handler import handle_chat_message
+from chat_handler import handle_chat_message, handle_chat_stream
 env_file = os.getenv('ENV_FILE', '.env.dev')
 
 
@@ -46,6 +58,8 @@ DB_DEBUG = os.getenv('DB_DEBUG', 'False').lower() == 'true'
 
 # Environment
 ENVIRONMENT = os.getenv('ENVIRONMENT', 'development')
+# /debug/cache and /debug/pool show cache and pool internals; off unless asked for
+DEBUG_ENDPOINTS = os.getenv('DEBUG_ENDPOINTS', 'false').lower() == 'true'
 
 print(f"Starting in {ENVIRONMENT} mode")
 app = Flask(__name__)
@@ -76,7 +90,7 @@ else:
         f"?sslmode=require"
     )
 app.config['SQLALCHEMY_ECHO'] = DB_DEBUG
-app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'connect_timeout': 10}}
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
 db.init_app(app)
 
 # Initialize Redis connection on startup
@@ -86,16 +100,32 @@ try:
 except Exception as e:
     print(f"Redis initialization failed")
 
+@app.before_request
+def start_request_timer():
+    # Registered before the auth check so rejected requests are timed too
+    request_timing.start()
+
 @app.after_request
 def after_request(resp):
-    resp.headers['Content-Type'] = 'application/json'
+    # Views that choose their own content type (/metrics) keep it
+    if resp.mimetype == app.response_class.default_mimetype:
+        resp.headers['Content-Type'] = 'application/json'
+    if 'request_start' in g:
+        total = request_timing.elapsed()
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.observe_request(request.method, endpoint, getattr(resp, 'api_code', resp.status_code), total)
+        if request_timing.SERVER_TIMING:
+            resp.headers['Server-Timing'] = request_timing.server_timing_header(total)
     return resp
 
 @app.before_request
 def before_request():
-    public_endpoints = ['/login', '/register', '/debug/db']
+    public_endpoints = ['/login', '/register', '/health', '/debug/db']
     if request.path in public_endpoints:
         return None
+    if request.path == '/metrics':
+        # Scrapers present METRICS_TOKEN instead of a user JWT (checked in the view)
+        return None
     try:
         verify_jwt_in_request()
         if not get_jwt_identity():
@@ -149,20 +179,49 @@ def modify_log():
 @app.route('/retrieve_log', methods=['GET'])
 @jwt_required()
 def get_log():
-    date_str = request.args.get('date')
-    time_constraint = None
-    if date_str:
-        try:
-            time_constraint = datetime.strptime(date_str, '%Y-%m-%d').date()
-        except ValueError:
-            return response(400, 'Invalid date format. Use YYYY-MM-DD')
-    return retrieve_log(time_constraint)
+    # `date` is the original name of the upper bound and is still accepted
+    bounds = {}
+    for param in ('from', 'to', 'date'):
+        value = request.args.get(param)
+        if value:
+            try:
+                bounds[param] = datetime.strptime(value, '%Y-%m-%d').date()
+            except ValueError:
+                return response(400, 'Invalid date format. Use YYYY-MM-DD')
+    start_date = bounds.get('from')
+    end_date = bounds.get('to', bounds.get('date'))
+    if start_date and end_date and start_date > end_date:
+        return response(400, "'from' must not be after 'to'")
+    return retrieve_log(
+        start_date,
+        end_date,
+        cursor=request.args.get('cursor'),
+        limit=request.args.get('limit', type=int)
+    )
+
+@app.route('/log_status', methods=['GET'])
+@jwt_required()
+def log_status():
+    intake_id = request.args.get('id', type=int)
+    if intake_id is None:
+        return response(400, 'Missing intake entry ID')
+    return get_log_status(intake_id)
 
 @app.route('/delete_log', methods=['POST'])
 @jwt_required()
 def remove_log():
     return delete_log(request)
 
+@app.route('/logs/batch', methods=['POST'])
+@jwt_required()
+def logs_batch():
+    return batch_logs(request)
+
+@app.route('/foods/search', methods=['GET'])
+@jwt_required()
+def food_search():
+    return search_food_catalog(request.args.get('q'), request.args.get('limit', type=int))
+
 @app.route('/dv_summation', methods=['GET'])
 @jwt_required()
 def daily_summary():
@@ -178,6 +237,33 @@ def daily_needs():
 def history_7days():
     return get_7_day_history()
 
+@app.route('/history', methods=['GET'])
+@jwt_required()
+def history_range():
+    try:
+        to_str = request.args.get('to')
+        end_date = datetime.strptime(to_str, '%Y-%m-%d').date() if to_str else datetime.now().date()
+        from_str = request.args.get('from')
+        start_date = datetime.strptime(from_str, '%Y-%m-%d').date() if from_str else end_date - timedelta(days=6)
+    except ValueError:
+        return response(400, 'Invalid date format. Use YYYY-MM-DD')
+    return get_nutrition_history(start_date, end_date)
+
+@app.route('/trends', methods=['GET'])
+@jwt_required()
+def trends():
+    try:
+        to_str = request.args.get('to')
+        end_date = datetime.strptime(to_str, '%Y-%m-%d').date() if to_str else datetime.now().date()
+    except ValueError:
+        return response(400, 'Invalid date format. Use YYYY-MM-DD')
+    return get_nutrition_trends(
+        end_date,
+        days=request.args.get('days', 30, type=int),
+        window=request.args.get('window', 7, type=int),
+        points=request.args.get('points', 60, type=int)
+    )
+
 @app.route('/api/chat', methods=['POST'])
 @jwt_required()
 def chat():
@@ -186,6 +272,15 @@ def chat():
     except Exception as e:
         return response(500, f'Chat endpoint error: {str(e)}')
 
+@app.route('/api/chat/stream', methods=['POST'])
+@jwt_required()
+def chat_stream():
+    # Server-Timing and request metrics for this route cover the time to the first byte
+    try:
+        return handle_chat_stream(request)
+    except Exception as e:
+        return response(500, f'Chat endpoint error: {str(e)}')
+
 @app.route('/api/chat/history', methods=['GET', 'POST', 'DELETE'])
 @jwt_required()
 def chat_history():
@@ -240,6 +335,41 @@ def debug_db():
     except Exception as e:
         return {"status": "error", "message": str(e), "db_connected": False}
 
+@app.route('/health')
+def health():
+    # Liveness only; a degraded Redis is reported for alerting but never fails the check
+    from redis_client import get_circuit_state
+    circuit = get_circuit_state()
+    return {
+        "status": "ok" if circuit["state"] == "closed" else "degraded",
+        "redis": {"state": circuit["state"], "retry_in_seconds": circuit["retry_in_seconds"]}
+    }
+
+@app.route('/debug/cache')
+@jwt_required()
+def debug_cache():
+    if not DEBUG_ENDPOINTS:
+        return response(404, 'Endpoint not found')
+    from redis_client import get_cache_stats
+    return get_cache_stats()
+
+@app.route('/debug/pool')
+@jwt_required()
+def debug_pool():
+    if not DEBUG_ENDPOINTS:
+        return response(404, 'Endpoint not found')
+    # Wait time here versus request latency separates pool starvation from slow queries
+    return get_pool_stats(db.engine)
+
+@app.route('/metrics')
+def prometheus_metrics():
+    if not metrics.METRICS_TOKEN:
+        return response(404, 'Endpoint not found')
+    if not metrics.scrape_authorized(request.headers.get('Authorization')):
+        return response(401, 'Invalid metrics token')
+    body, content_type = metrics.render_metrics()
+    return app.response_class(body, content_type=content_type)
+
 if __name__ == '__main__':
     # Use PORT environment variable (Cloud Run sets this) or SERVER_PORT from config
     port = int(os.getenv('PORT', SERVER_PORT))
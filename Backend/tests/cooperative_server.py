@@ -0,0 +1,63 @@
+"""
+Runs server.app under pywsgi for test_cooperative.py, in its own process so that
+monkey patching never leaks into the test runner.
+
+usage: python cooperative_server.py on|off UPSTREAM_DELAY
+
+/api/chat is replaced by a handler that makes a blocking HTTP call to a local upstream
+answering after UPSTREAM_DELAY seconds (standing in for the LLM API); /dv_summation
+gets canned totals instead of a database. Prints "<port> <token>" once listening.
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+if sys.argv[1] == 'on':
+    import cooperative
+    cooperative.enable()
+
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import requests
+from gevent import pywsgi
+from flask_jwt_extended import create_access_token
+
+import functions
+import server
+
+DELAY = float(sys.argv[2])
+
+
+class SlowUpstream(BaseHTTPRequestHandler):
+    def do_GET(self):
+        time.sleep(DELAY)
+        self.send_response(200)
+        self.end_headers()
+        self.wfile.write(b'{}')
+
+    def log_message(self, *args):
+        pass
+
+
+upstream = HTTPServer(('127.0.0.1', 0), SlowUpstream)
+threading.Thread(target=upstream.serve_forever, daemon=True).start()
+
+
+def slow_chat(request):
+    requests.get(f'http://127.0.0.1:{upstream.server_port}/', timeout=30)
+    return functions.response(200, 'ok', {'reply': 'done'})
+
+
+server.handle_chat_message = slow_chat
+functions.get_daily_nutrition = lambda target_date=None: {'calories': 1, 'protein': 1, 'carbs': 1, 'fat': 1}
+
+with server.app.app_context():
+    token = create_access_token(identity='alice', additional_claims={'uid': 1})
+
+http = pywsgi.WSGIServer(('127.0.0.1', 0), server.app, log=None)
+http.start()
+print(http.server_port, token, flush=True)
+http.serve_forever()
@@ -0,0 +1,93 @@
+"""
+Unit tests for analytics.py
+"""
+import math
+import random
+from datetime import date, timedelta
+
+import numpy as np
+
+from analytics import bucket_means, compute_trends, dense_series, rolling_mean
+from serialization import StdlibBackend
+
+TARGETS = {"calories": 2000, "protein_g": 120, "fat_g": 70, "carbs_g": 220}
+
+
+def random_rows(start, days, seed=3, logged_share=0.7):
+    rng = random.Random(seed)
+    return [{
+        "day": start + timedelta(days=i),
+        "calories": rng.uniform(1500, 2600),
+        "protein": rng.uniform(60, 180),
+        "carbs": rng.uniform(150, 320),
+        "fat": rng.uniform(40, 110),
+    } for i in range(days) if rng.random() < logged_share]
+
+
+class TestRollingStatistics:
+    """Test the vectorized building blocks against plain loops"""
+
+    def test_rolling_mean_skips_unlogged_days(self):
+        """Test that each point averages only the logged days of its window"""
+        values = np.array([1.0, np.nan, 3.0, np.nan, np.nan, np.nan, 8.0])
+        expected = []
+        for i in range(len(values)):
+            window = [v for v in values[max(0, i - 2):i + 1] if not math.isnan(v)]
+            expected.append(sum(window) / len(window) if window else np.nan)
+        np.testing.assert_allclose(rolling_mean(values, 3), expected)
+
+    def test_buckets_end_on_latest_day(self):
+        """Test that the short bucket is the oldest one"""
+        means, counts = bucket_means(np.arange(1.0, 11.0), 4)
+        np.testing.assert_allclose(means, [1.5, 4.5, 8.5])
+        assert counts.tolist() == [2, 4, 4]
+
+
+class TestComputeTrends:
+    """Test compute_trends"""
+
+    def test_summary_matches_reference(self):
+        """Test averages and adherence against a straightforward computation"""
+        start = date(2024, 1, 1)
+        rows = random_rows(start, 90)
+        trends = compute_trends(rows, start, 90, TARGETS, window=7, max_points=30)
+
+        calories = [r["calories"] for r in rows]
+        within = [abs(c - 2000) / 2000 <= 0.10 for c in calories]
+        summary = trends["summary"]
+        assert summary["logged_days"] == len(rows)
+        assert summary["average"]["calories"] == round(sum(calories) / len(calories), 1)
+        assert summary["adherence_pct"]["calories"] == round(sum(within) / len(within) * 100, 1)
+        deviations = [(c - 2000) / 2000 * 100 for c in calories]
+        assert summary["deviation_pct"]["calories"] == round(sum(deviations) / len(deviations), 1)
+
+        assert trends["bucket_days"] == 3
+        assert len(trends["series"]["date"]) == 30
+        assert trends["series"]["date"][-1] == str(start + timedelta(days=87))
+        assert sum(trends["weekly"]["logged_days"]) == len(rows)
+        assert trends["weekly"]["week_start"][0] == str(start)
+
+    def test_empty_range(self):
+        """Test that a range without logs yields nulls instead of NaN"""
+        trends = compute_trends([], date(2024, 1, 1), 30, TARGETS)
+        assert trends["summary"]["logged_days"] == 0
+        assert trends["summary"]["average"]["calories"] is None
+        assert set(trends["series"]["calories"]) == {None}
+
+    def test_zero_target_yields_nulls(self):
+        """Test that a zero target gives None rather than inf/NaN, which strict JSON rejects"""
+        start = date(2024, 1, 1)
+        trends = compute_trends(random_rows(start, 30), start, 30, {**TARGETS, "carbs_g": 0})
+        summary = trends["summary"]
+        assert summary["deviation_pct"]["carbs"] is None
+        assert summary["adherence_pct"]["carbs"] is None
+        assert summary["adherence_pct"]["calories"] is not None
+        body = StdlibBackend().dumps(trends)
+        assert b"NaN" not in body and b"Infinity" not in body
+
+    def test_dense_series_places_rows_by_day(self):
+        """Test that sparse rows land at their day offset"""
+        start = date(2024, 1, 1)
+        series = dense_series([{"day": date(2024, 1, 3), "calories": 1800, "protein": 1, "carbs": 2, "fat": 3}], start, 5)
+        assert series["calories"][2] == 1800
+        assert np.isnan(series["calories"][[0, 1, 3, 4]]).all()
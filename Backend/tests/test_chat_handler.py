@@ -0,0 +1,185 @@
+"""
+Unit tests for chat_handler.py
+"""
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+from flask import Flask, g, request
+
+import request_timing
+from chat_handler import run_tool_calls, sse_event, stream_anthropic_api
+from tool_memo import ToolMemo
+
+MESSAGES = [{"role": "system", "content": "coach"}, {"role": "user", "content": "How am I doing?"}]
+USAGE = SimpleNamespace(input_tokens=100, output_tokens=20)
+
+
+def text_block(text):
+    return SimpleNamespace(type="text", text=text)
+
+
+def tool_block(block_id, name):
+    return SimpleNamespace(type="tool_use", id=block_id, name=name, input={})
+
+
+def fake_stream(events, final_content):
+    """A client.messages.stream(...) context manager replaying `events`."""
+    stream = MagicMock()
+    stream.__enter__.return_value = stream
+    stream.__iter__.return_value = iter(events)
+    stream.get_final_message.return_value = SimpleNamespace(content=final_content, usage=USAGE)
+    return stream
+
+
+class TestChatStream:
+    """Test the streaming Anthropic loop"""
+
+    def test_streams_text_and_tool_progress(self):
+        """Test that deltas and tool calls are forwarded and the result matches /api/chat"""
+        tool_turn = fake_stream(
+            [SimpleNamespace(type="text", text="Let me check."),
+             SimpleNamespace(type="content_block_start", content_block=tool_block("t1", "get_today_nutrition"))],
+            [text_block("Let me check."), tool_block("t1", "get_today_nutrition")])
+        answer_turn = fake_stream(
+            [SimpleNamespace(type="text", text="On "), SimpleNamespace(type="text", text="track.")],
+            [text_block("On track.")])
+        client = MagicMock()
+        client.messages.stream.side_effect = [tool_turn, answer_turn]
+
+        with patch('anthropic.Anthropic', return_value=client), \
+             patch('chat_handler.call_mcp_tool', return_value='{"calories": 1200}') as mock_tool:
+            events = list(stream_anthropic_api('key', MESSAGES, [], 'alice'))
+
+        assert events == [
+            ("text", {"delta": "Let me check."}),
+            ("tool_call", {"name": "get_today_nutrition"}),
+            ("tool_result", {"name": "get_today_nutrition", "arguments": {}}),
+            ("text", {"delta": "On "}),
+            ("text", {"delta": "track."}),
+            ("done", {"message": "On track.", "usage": {"input_tokens": 100, "output_tokens": 20},
+                      "tools_called": [{"name": "get_today_nutrition", "arguments": {}}],
+                      "tool_memo": {"hits": 0, "misses": 0}}),
+        ]
+        assert mock_tool.call_args.args[:3] == ("get_today_nutrition", {}, 'alice')
+        second_call = client.messages.stream.call_args_list[1].kwargs
+        assert second_call["messages"][-1]["content"][0] == {
+            "type": "tool_result", "tool_use_id": "t1", "content": '{"calories": 1200}'}
+
+    def test_api_failure_ends_with_error_event(self):
+        """Test that an SDK error becomes a final error event"""
+        client = MagicMock()
+        client.messages.stream.side_effect = RuntimeError("overloaded")
+        with patch('anthropic.Anthropic', return_value=client):
+            events = list(stream_anthropic_api('key', MESSAGES, [], 'alice'))
+        assert events == [("error", {"message": "Anthropic API error: overloaded"})]
+
+    def test_sse_event_format(self):
+        """Test that each event is one data line terminated by a blank line"""
+        frame = sse_event("text", {"delta": "line one\nline two"})
+        name, data, blank, end = frame.split(b"\n")
+        assert (name, blank, end) == (b"event: text", b"", b"")
+        assert json.loads(data[len(b"data: "):]) == {"delta": "line one\nline two"}
+
+
+class TestToolCalls:
+    """Test running the tool calls of one turn"""
+
+    def test_runs_concurrently_in_block_order(self):
+        """Test that slow tools overlap, results keep block order and workers see the request context"""
+        app = Flask(__name__)
+        blocks = [tool_block("t1", "get_user_profile"), tool_block("t2", "get_today_nutrition"),
+                  tool_block("t3", "get_user_daily_needs")]
+        delays = {"get_user_profile": 0.3, "get_today_nutrition": 0.1, "get_user_daily_needs": 0.2}
+
+        def slow_tool(name, arguments, username, memo=None, call_info=None):
+            time.sleep(delays[name])
+            return json.dumps({"tool": name, "user": g.identity, "path": request.path})
+
+        tools_called = []
+        with app.test_request_context('/api/chat'), patch('chat_handler.call_mcp_tool', side_effect=slow_tool):
+            g.identity = 'alice-identity'
+            start = time.perf_counter()
+            results = run_tool_calls(blocks, 'alice', tools_called)
+            elapsed = time.perf_counter() - start
+
+        assert elapsed < 0.5
+        assert [r["tool_use_id"] for r in results] == ["t1", "t2", "t3"]
+        assert [json.loads(r["content"]) for r in results] == [
+            {"tool": name, "user": "alice-identity", "path": "/api/chat"} for name in delays]
+        assert [c["name"] for c in tools_called] == list(delays)
+
+    def test_workers_time_into_their_own_dicts(self):
+        """Test that concurrent tools don't share g.request_timings and overlap isn't double-counted"""
+        blocks = [tool_block("t1", "get_user_profile"), tool_block("t2", "get_today_nutrition")]
+        seen = []
+
+        def tool(name, arguments, username, memo=None, call_info=None):
+            seen.append(id(g.request_timings))
+            request_timing.add('db', 0.3 if name == "get_user_profile" else 0.1)
+            return '{}'
+
+        with Flask(__name__).test_request_context('/api/chat'), \
+             patch('chat_handler.call_mcp_tool', side_effect=tool):
+            request_timing.start()
+            request_timing.add('db', 0.05)
+            run_tool_calls(blocks, 'alice', [])
+            assert len(set(seen)) == 2 and id(g.request_timings) not in seen
+            spent, calls = g.request_timings['db']
+        assert round(spent, 3) == 0.35 and calls == 3
+
+    def test_failing_tool_does_not_sink_the_turn(self):
+        """Test that an exception becomes that block's error result"""
+        blocks = [tool_block("t1", "get_user_profile"), tool_block("t2", "get_today_nutrition")]
+
+        def tool(name, arguments, username, memo=None, call_info=None):
+            if name == "get_user_profile":
+                raise RuntimeError("db down")
+            return '{"calories": 1200}'
+
+        with Flask(__name__).app_context(), patch('chat_handler.call_mcp_tool', side_effect=tool):
+            results = run_tool_calls(blocks, 'alice', [])
+        assert json.loads(results[0]["content"]) == {"error": "Tool execution failed: db down"}
+        assert results[1]["content"] == '{"calories": 1200}'
+
+
+class TestToolMemo:
+    """Test per-turn memoization of tool calls"""
+
+    def test_concurrent_duplicates_run_once(self):
+        """Test that callers of an in-flight key wait for its result instead of running it again"""
+        memo = ToolMemo()
+        calls = []
+
+        def slow():
+            calls.append(1)
+            time.sleep(0.1)
+            return '{"ok": true}'
+
+        with ThreadPoolExecutor(max_workers=4) as pool:
+            results = list(pool.map(lambda _: memo.call("get_user_profile", {"username": "alice"}, slow),
+                                    range(4)))
+        assert len(calls) == 1
+        assert sorted(hit for _, hit in results) == [False, True, True, True]
+        assert memo.stats() == {"hits": 3, "misses": 1}
+
+    def test_daily_needs_reuses_profile_across_iterations(self):
+        """Test that the profile is fetched once per chat turn and hits are reported in tools_called"""
+        profile = {"id": 1, "username": "alice", "age": 30, "sex": "female", "height_cm": 165,
+                   "weight_kg": 60, "activity_level": "moderate", "goal": "maintain"}
+        memo = ToolMemo()
+        tools_called = []
+        with Flask(__name__).app_context(), \
+             patch('mcp_tools.resolve_identity', return_value=SimpleNamespace(user_id=1)), \
+             patch('mcp_tools.fetch_profile', return_value=profile) as mock_fetch:
+            first = run_tool_calls([tool_block("t1", "get_user_profile")], 'alice', tools_called, memo)
+            second = run_tool_calls([tool_block("t2", "get_user_daily_needs"),
+                                     tool_block("t3", "get_user_profile")], 'alice', tools_called, memo)
+
+        mock_fetch.assert_called_once_with(1)
+        assert json.loads(second[0]["content"])["profile"]["weight_kg"] == 60.0
+        assert second[1]["content"] == first[0]["content"]
+        assert [(c["name"], c["arguments"], c["memo_hit"]) for c in tools_called] == [
+            ("get_user_profile", {}, False), ("get_user_daily_needs", {}, False), ("get_user_profile", {}, True)]
+        assert memo.stats() == {"hits": 2, "misses": 2}
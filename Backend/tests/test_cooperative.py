@@ -0,0 +1,115 @@
+"""
+Concurrency tests for cooperative.py
+"""
+import os
+import select
+import subprocess
+import sys
+import threading
+import time
+from unittest.mock import Mock, patch
+
+import pytest
+import requests
+
+import cooperative
+
+SERVER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cooperative_server.py')
+UPSTREAM_DELAY = 1.5
+QUERY_DELAY = 0.3
+
+
+@pytest.fixture
+def run_server():
+    processes = []
+
+    def start(mode):
+        process = subprocess.Popen([sys.executable, SERVER_SCRIPT, mode, str(UPSTREAM_DELAY)],
+                                   stdout=subprocess.PIPE, text=True)
+        processes.append(process)
+        while True:
+            line = process.stdout.readline()
+            if not line:
+                pytest.fail(f"server exited with {process.wait()}")
+            parts = line.split()
+            if len(parts) == 2 and parts[0].isdigit():
+                return f"http://127.0.0.1:{parts[0]}", {'Authorization': f'Bearer {parts[1]}'}
+
+    yield start
+    for process in processes:
+        process.kill()
+        process.wait()
+
+
+def dv_summation_latency_during_slow_chat(base_url, headers):
+    """Seconds /dv_summation takes while a slow /api/chat is in flight."""
+    chat = threading.Thread(target=requests.post, args=(f'{base_url}/api/chat',),
+                            kwargs={'json': {'message': 'hi'}, 'headers': headers, 'timeout': 30})
+    chat.start()
+    time.sleep(0.3)  # let the chat request reach its upstream call
+    start = time.perf_counter()
+    result = requests.get(f'{base_url}/dv_summation', headers=headers, timeout=30)
+    elapsed = time.perf_counter() - start
+    chat.join()
+    assert result.json()['code'] == 200
+    return elapsed
+
+
+class TestCooperativeMode:
+    """Test that one slow request no longer stalls the process"""
+
+    def test_slow_chat_does_not_delay_other_requests(self, run_server):
+        """Test that /dv_summation is served while /api/chat waits on its upstream"""
+        assert dv_summation_latency_during_slow_chat(*run_server('on')) < 0.5
+
+    def test_without_patching_the_hub_is_blocked(self, run_server):
+        """Test the baseline the cooperative mode fixes"""
+        assert dv_summation_latency_during_slow_chat(*run_server('off')) > UPSTREAM_DELAY - 0.5
+
+
+class TestWaitCallback:
+    """Test the psycopg2 wait callback"""
+
+    def test_waits_for_readiness_until_poll_ok(self):
+        """Test that the callback parks on the socket for each poll state"""
+        from psycopg2 import extensions
+        conn = Mock()
+        conn.fileno.return_value = 7
+        conn.poll.side_effect = [extensions.POLL_WRITE, extensions.POLL_READ, extensions.POLL_OK]
+        with patch('gevent.socket.wait_read') as wait_read, patch('gevent.socket.wait_write') as wait_write:
+            cooperative.gevent_wait_callback(conn)
+        wait_write.assert_called_once_with(7, timeout=None)
+        wait_read.assert_called_once_with(7, timeout=None)
+
+    def test_unknown_poll_state_raises(self):
+        """Test that a bad poll result surfaces as an OperationalError"""
+        import psycopg2
+        conn = Mock()
+        conn.poll.return_value = 99
+        with pytest.raises(psycopg2.OperationalError):
+            cooperative.gevent_wait_callback(conn)
+
+    def test_concurrent_queries_overlap(self):
+        """Test that greenlets waiting on in-flight queries yield to each other"""
+        import gevent
+        from gevent import socket as gsocket
+        from psycopg2 import extensions
+
+        class SlowQuery:
+            """A connection whose server answers after QUERY_DELAY, like SELECT pg_sleep(QUERY_DELAY)"""
+            def __init__(self):
+                self.client, self.server = gsocket.socketpair()
+                gevent.spawn_later(QUERY_DELAY, self.server.send, b'x')
+
+            def fileno(self):
+                return self.client.fileno()
+
+            def poll(self):
+                ready = select.select([self.client], [], [], 0)[0]
+                return extensions.POLL_OK if ready else extensions.POLL_READ
+
+        queries = [SlowQuery() for _ in range(4)]
+        start = time.perf_counter()
+        gevent.joinall([gevent.spawn(cooperative.gevent_wait_callback, q) for q in queries], raise_error=True)
+        elapsed = time.perf_counter() - start
+        assert elapsed < QUERY_DELAY * 2  # serialized, four queries would take 4 * QUERY_DELAY
@@ -0,0 +1,148 @@
+"""
+Tests for the daily_totals backfill and reconcile commands.
+
+These run the real SQL, so they need a Postgres database: set TEST_DATABASE_URL
+(e.g. postgresql+psycopg2://postgres@localhost:5432/nutri). Every test works in a
+throwaway schema that is dropped afterwards.
+"""
+import os
+import uuid
+from datetime import date
+
+import pytest
+from flask import Flask
+from sqlalchemy import text
+
+import manage
+from database import db
+from functions import backfill_daily_totals, execute, query, reconcile_daily_totals
+
+TEST_DATABASE_URL = os.getenv('TEST_DATABASE_URL')
+
+# The create_schema.sql tables these commands touch (the full file also needs pg_trgm)
+SCHEMA = """
+    CREATE TABLE users (
+        id SERIAL PRIMARY KEY, username VARCHAR(50) UNIQUE NOT NULL, password_hash VARCHAR(255) NOT NULL,
+        age INTEGER NOT NULL, sex VARCHAR(10) NOT NULL, height_cm NUMERIC NOT NULL, weight_kg NUMERIC NOT NULL
+    );
+    CREATE TABLE food (
+        id SERIAL PRIMARY KEY, name VARCHAR(255) NOT NULL,
+        calories NUMERIC NOT NULL, protein NUMERIC NOT NULL, carbs NUMERIC NOT NULL, fat NUMERIC NOT NULL
+    );
+    CREATE TABLE user_intake (
+        id SERIAL PRIMARY KEY, user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE,
+        food_id INTEGER REFERENCES food(id) ON DELETE CASCADE, quantity NUMERIC NOT NULL, intake_date DATE NOT NULL
+    );
+    CREATE TABLE daily_totals (
+        user_id INTEGER NOT NULL REFERENCES users(id) ON DELETE CASCADE, day DATE NOT NULL,
+        calories NUMERIC NOT NULL DEFAULT 0, protein NUMERIC NOT NULL DEFAULT 0, carbs NUMERIC NOT NULL DEFAULT 0,
+        fat NUMERIC NOT NULL DEFAULT 0, entry_count INTEGER NOT NULL DEFAULT 0, updated_at TIMESTAMP DEFAULT NOW(),
+        PRIMARY KEY (user_id, day)
+    );
+"""
+
+pytestmark = pytest.mark.skipif(not TEST_DATABASE_URL, reason="TEST_DATABASE_URL not set")
+
+DAY_1 = date(2024, 1, 1)
+DAY_2 = date(2024, 1, 2)
+
+
+@pytest.fixture
+def app():
+    schema = f"test_daily_totals_{uuid.uuid4().hex[:8]}"
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = TEST_DATABASE_URL
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'options': f'-csearch_path={schema}'}}
+    db.init_app(app)
+    with app.app_context():
+        db.session.execute(text(f'CREATE SCHEMA {schema}'))
+        db.session.execute(text(SCHEMA))
+        db.session.commit()
+        try:
+            yield app
+        finally:
+            db.session.rollback()
+            db.session.execute(text(f'DROP SCHEMA {schema} CASCADE'))
+            db.session.commit()
+            db.engine.dispose()
+
+
+@pytest.fixture
+def intake(app):
+    """One user with two logged days: 150 + 100 kcal on DAY_1, 50 kcal on DAY_2."""
+    user_id = query("""
+        INSERT INTO users (username, password_hash, age, sex, height_cm, weight_kg)
+        VALUES ('rollup', 'x', 30, 'male', 180, 80) RETURNING id
+    """)[0]['id']
+    food_id = query("""
+        INSERT INTO food (name, calories, protein, carbs, fat) VALUES ('Oats', 100, 10, 20, 5) RETURNING id
+    """)[0]['id']
+    execute("""
+        INSERT INTO user_intake (user_id, food_id, quantity, intake_date) VALUES
+            (:user_id, :food_id, 150, :day_1), (:user_id, :food_id, 100, :day_1), (:user_id, :food_id, 50, :day_2)
+    """, {"user_id": user_id, "food_id": food_id, "day_1": DAY_1, "day_2": DAY_2})
+    return user_id
+
+
+def stored_totals():
+    return [(row['user_id'], row['day'], float(row['calories']), row['entry_count'])
+            for row in query("SELECT * FROM daily_totals ORDER BY user_id, day")]
+
+
+def run_command(*argv):
+    args = manage.build_parser().parse_args(list(argv))
+    return args.func(args)
+
+
+class TestBackfill:
+    """Test rebuilding the rollup from user_intake"""
+
+    def test_backfill_is_idempotent(self, intake):
+        """Test that a second backfill leaves the rollup unchanged"""
+        assert backfill_daily_totals() == {"upserted": 2, "removed": 0}
+        first = stored_totals()
+        assert first == [(intake, DAY_1, 250.0, 2), (intake, DAY_2, 50.0, 1)]
+
+        assert backfill_daily_totals() == {"upserted": 2, "removed": 0}
+        assert stored_totals() == first
+        assert reconcile_daily_totals() == []
+
+    def test_backfill_command(self, intake, capsys):
+        """Test that the command reports upserted and removed days"""
+        assert run_command('backfill-daily-totals', '--user-id', str(intake)) == 0
+        assert run_command('backfill-daily-totals') == 0
+        output = capsys.readouterr().out.splitlines()
+        assert output == ["daily_totals backfill complete: 2 day(s) upserted, 0 stale day(s) removed"] * 2
+
+
+class TestReconcile:
+    """Test finding and repairing rollup drift"""
+
+    def test_finds_and_repairs_drift(self, intake):
+        """Test that a wrong row and a stale row are reported, then fixed by a backfill"""
+        backfill_daily_totals()
+        execute("UPDATE daily_totals SET calories = 0 WHERE day = :day", {"day": DAY_1})
+        execute("INSERT INTO daily_totals (user_id, day, calories, entry_count) VALUES (:user_id, '2024-01-03', 80, 1)",
+                {"user_id": intake})
+
+        drift = reconcile_daily_totals(intake)
+        assert [(row['day'], float(row['expected_calories']), float(row['stored_calories'])) for row in drift] == [
+            (DAY_1, 250.0, 0.0), (date(2024, 1, 3), 0.0, 80.0)]
+
+        assert backfill_daily_totals(intake) == {"upserted": 2, "removed": 1}
+        assert reconcile_daily_totals(intake) == []
+
+    def test_reconcile_command_fix(self, intake, capsys):
+        """Test that the command fails on drift, --fix repairs it, and a clean rollup passes"""
+        backfill_daily_totals()
+        execute("UPDATE daily_totals SET entry_count = 7 WHERE day = :day", {"day": DAY_2})
+
+        assert run_command('reconcile-daily-totals') == 1
+        assert run_command('reconcile-daily-totals', '--fix') == 0
+        assert run_command('reconcile-daily-totals') == 0
+        assert stored_totals() == [(intake, DAY_1, 250.0, 2), (intake, DAY_2, 50.0, 1)]
+
+        output = capsys.readouterr().out
+        assert f"drift user_id={intake} day={DAY_2} calories expected=50.00 stored=50.00 entries expected=1 stored=7" in output
+        assert "Rebuilt daily_totals for 1 user(s)" in output
+        assert output.rstrip().endswith("0 drifting day(s) found")
@@ -0,0 +1,93 @@
+"""
+Unit tests for database.py
+"""
+import json
+import pytest
+from unittest.mock import patch
+from sqlalchemy import create_engine, exc, text
+
+import database
+from database import InstrumentedNullPool, InstrumentedQueuePool, engine_options, get_pool_stats, pool_stats
+
+
+@pytest.fixture(autouse=True)
+def reset_stats():
+    pool_stats.reset()
+    yield
+    pool_stats.reset()
+
+
+class TestEngineOptions:
+    """Test pool configuration"""
+
+    def test_queue_mode(self):
+        """Test that the default mode configures an instrumented QueuePool"""
+        options = engine_options('postgresql+psycopg2://u:p@h/db')
+        assert options['poolclass'] is InstrumentedQueuePool
+        assert options['pool_size'] == database.DB_POOL_SIZE
+        assert options['pool_pre_ping'] is database.DB_POOL_PRE_PING
+        assert 'prepare_threshold' not in options['connect_args']
+
+    def test_null_mode_for_transaction_poolers(self):
+        """Test that null mode keeps no connections and disables psycopg 3 auto-prepare"""
+        with patch('database.DB_POOL_MODE', 'null'):
+            options = engine_options('postgresql+psycopg://u:p@pooler:6543/postgres')
+        assert options == {'poolclass': InstrumentedNullPool,
+                           'connect_args': {'connect_timeout': database.DB_CONNECT_TIMEOUT, 'prepare_threshold': None}}
+
+
+class TestPoolStats:
+    """Test checkout instrumentation"""
+
+    def test_counts_checkouts_and_timeouts(self, tmp_path):
+        """Test that waits, timeouts and live checkouts are recorded"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedQueuePool,
+                               pool_size=1, max_overflow=0, pool_timeout=0.05)
+        with engine.connect() as conn:
+            conn.execute(text('SELECT 1'))
+            assert get_pool_stats(engine)['checked_out'] == 1
+            with pytest.raises(exc.TimeoutError):
+                engine.connect()
+
+        stats = get_pool_stats(engine)
+        assert (stats['checkouts'], stats['checked_out'], stats['connects'], stats['timeouts']) == (1, 0, 1, 1)
+        assert stats['wait_seconds_max'] >= 0.05
+        assert (stats['size'], stats['overflow'], stats['idle']) == (1, 0, 1)
+        engine.dispose()
+
+    def test_null_pool_connects_per_checkout(self, tmp_path):
+        """Test that NullPool opens a connection for every checkout"""
+        engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=InstrumentedNullPool)
+        for _ in range(3):
+            with engine.connect() as conn:
+                conn.execute(text('SELECT 1'))
+        stats = get_pool_stats(engine)
+        assert (stats['checkouts'], stats['connects'], stats['checked_out']) == (3, 3, 0)
+
+
+class TestSlowQueryLog:
+    """Test the slow-statement log"""
+
+    def test_parameter_shape_hides_values(self):
+        """Test that only parameter names and types are reported"""
+        assert database.parameter_shape({'user_id': 1, 'name': 'secret'}) == {'user_id': 'int', 'name': 'str'}
+        assert database.parameter_shape((1, 'secret')) == ['int', 'str']
+        assert database.parameter_shape([{'id': 1}, {'id': 2}], executemany=True) == {'rows': 2, 'row': {'id': 'int'}}
+
+    def test_logs_statements_over_threshold(self, capsys):
+        """Test that a slow statement is logged with its caller, and a fast one is not"""
+        engine = create_engine('sqlite://')
+        with engine.connect() as conn:
+            with patch('database.SLOW_QUERY_MS', 1e-6):
+                conn.execute(text('SELECT :secret'), {'secret': 'hunter2'})
+            with patch('database.SLOW_QUERY_MS', 0):
+                conn.execute(text('SELECT 2'))
+
+        lines = [line for line in capsys.readouterr().out.splitlines() if line.startswith('Slow query: ')]
+        assert len(lines) == 1
+        entry = json.loads(lines[0][len('Slow query: '):])
+        assert entry['sql'] == 'SELECT ?'
+        assert entry['params'] == ['str']
+        assert 'hunter2' not in lines[0]
+        assert entry['caller'].startswith('tests/test_database.py:')
+        assert entry['caller'].endswith('test_logs_statements_over_threshold')
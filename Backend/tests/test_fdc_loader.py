@@ -0,0 +1,102 @@
+"""
+Unit tests for fdc_loader.py
+"""
+import csv
+import json
+import pytest
+from unittest.mock import patch
+
+from fdc_loader import iter_csv_foods, iter_json_foods, to_food_row, load_fdc_release
+
+
+def write_csv(path, header, rows):
+    with open(path, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(header)
+        writer.writerows(rows)
+
+
+@pytest.fixture
+def csv_release(tmp_path):
+    write_csv(tmp_path / 'nutrient.csv', ['id', 'name', 'unit_name', 'nutrient_nbr', 'rank'], [
+        [1003, 'Protein', 'G', '203', '600'],
+        [1004, 'Total lipid (fat)', 'G', '204', '800'],
+        [1005, 'Carbohydrate, by difference', 'G', '205', '1110'],
+        [1008, 'Energy', 'KCAL', '208', '300'],
+        [1087, 'Calcium, Ca', 'MG', '301', '5300'],
+    ])
+    write_csv(tmp_path / 'food.csv', ['fdc_id', 'data_type', 'description', 'food_category_id', 'publication_date'], [
+        [100, 'sr_legacy_food', 'Bananas, raw', '9', '2019-04-01'],
+        [101, 'branded_food', 'BANANA CHIPS', '', '2021-01-01'],
+        [102, 'foundation_food', 'Water, tap', '14', '2020-10-30'],
+        [103, 'survey_fndds_food', 'Rice, white, cooked', '', '2020-10-30'],
+    ])
+    write_csv(tmp_path / 'food_nutrient.csv', ['id', 'fdc_id', 'nutrient_id', 'amount'], [
+        [1, 100, 1008, '89'],
+        [2, 100, 1003, '1.09'],
+        [3, 100, 1005, '22.84'],
+        [4, 100, 1004, '0.33'],
+        [5, 100, 1087, '5'],
+        [6, 101, 1008, '519'],
+        [7, 102, 1087, '3'],
+        [8, 103, 1008, '130'],
+        [9, 103, 1005, '28.2'],
+    ])
+    return str(tmp_path)
+
+
+class TestReleaseReaders:
+    """Test reading foods from release files"""
+
+    def test_csv_release_filters_data_types_and_nutrients(self, csv_release):
+        """Test that only selected data types and macro nutrients come through"""
+        foods = list(iter_csv_foods(csv_release))
+        assert [fdc_id for fdc_id, _, _ in foods] == [100, 102, 103]
+        banana = foods[0]
+        assert banana[1] == 'Bananas, raw'
+        assert {n['nutrientId'] for n in banana[2]} == {1003, 1004, 1005, 1008}
+
+    def test_json_release_uses_search_shape(self, tmp_path):
+        """Test that release JSON nutrients are mapped to the search API shape"""
+        path = tmp_path / 'foundation.json'
+        path.write_text(json.dumps({'FoundationFoods': [{
+            'fdcId': 200,
+            'description': 'Hummus, commercial',
+            'foodNutrients': [
+                {'nutrient': {'id': 1062, 'name': 'Energy', 'unitName': 'kJ'}, 'amount': 962.3},
+                {'nutrient': {'id': 1003, 'name': 'Protein', 'unitName': 'g'}, 'amount': 7.35},
+            ]
+        }]}))
+        with patch.dict('sys.modules', {'ijson': None}):
+            foods = list(iter_json_foods(str(path)))
+        assert len(foods) == 1
+        row = to_food_row(*foods[0])
+        assert row == {'fdc_id': 200, 'name': 'Hummus, commercial', 'calories': 230.0,
+                       'protein': 7.35, 'carbs': 0, 'fat': 0, 'serving_unit': 'g'}
+
+    def test_food_without_nutrition_is_skipped(self):
+        """Test that foods lacking calories or macros produce no row"""
+        assert to_food_row(102, 'Water, tap', []) is None
+
+
+class TestLoadFdcRelease:
+    """Test the batched, resumable load"""
+
+    def test_resumes_after_checkpoint_and_checkpoints_each_batch(self, csv_release):
+        """Test that foods before the checkpoint are skipped and every batch advances it"""
+        with patch('fdc_loader.get_progress', return_value=1), \
+             patch('fdc_loader.copy_food_batch', return_value=1) as mock_copy:
+            result = load_fdc_release(csv_release, batch_size=1, report=lambda message: None)
+
+        assert result['read'] == 3
+        assert result['resumed_from'] == 1
+        assert result['skipped'] == 1
+        assert [call.args[2] for call in mock_copy.call_args_list] == [2, 3]
+        assert [row['fdc_id'] for row in mock_copy.call_args_list[1].args[0]] == [103]
+
+    def test_unknown_data_type_rejected(self, csv_release):
+        """Test that an unknown data type fails before touching the database"""
+        with patch('fdc_loader.get_progress') as mock_progress:
+            with pytest.raises(ValueError):
+                load_fdc_release(csv_release, ['bogus'])
+            mock_progress.assert_not_called()
@@ -7,6 +7,7 @@ from datetime import date, datetime, timedelta
 from decimal import Decimal
 from unittest.mock import Mock, patch, MagicMock
 from flask import Flask
+from sqlalchemy.exc import OperationalError
 from werkzeug.security import generate_password_hash
 
 # Import functions to test
@@ -16,6 +17,7 @@ import os
 # Add parent directory to path
 sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
+from identity import Identity
 from functions import (
     response,
     register_user,
@@ -25,11 +27,22 @@ from functions import (
     insert_log,
     update_log,
     retrieve_log,
+    LOG_PAGE_MAX_LIMIT,
     delete_log,
+    batch_logs,
     get_daily_nutrition,
     dv_summation,
     get_daily_needs,
     get_7_day_history,
+    get_nutrition_history,
+    get_nutrition_trends,
+    build_daily_series,
+    search_food_catalog,
+    escape_like,
+    resolve_food,
+    fetch_usda_food,
+    finalize_pending_log,
+    FoodLookupUnavailable,
     search_food_in_usda
 )
 
@@ -79,10 +92,10 @@ def mock_execute():
 
 
 @pytest.fixture
-def mock_jwt_identity():
-    """Mock JWT identity"""
-    with patch('functions.get_jwt_identity') as mock_jwt:
-        yield mock_jwt
+def mock_identity():
+    """Mock the request identity resolved from the JWT"""
+    with patch('functions.get_current_identity') as mock_identity:
+        yield mock_identity
 
 
 class TestResponse:
@@ -209,6 +222,8 @@ class TestLoginUser:
             assert data['code'] == 200
             assert 'token' in data['data']
             assert data['data']['user']['username'] == 'testuser'
+            # The user id travels in the token so handlers skip the users lookup
+            assert mock_token.call_args.kwargs['additional_claims'] == {'uid': 1}
     
     def test_login_user_missing_credentials(self, app_context, mock_request):
         """Test login with missing credentials"""
@@ -248,9 +263,9 @@ class TestLoginUser:
 class TestGetMyProfile:
     """Test get_my_profile function"""
     
-    def test_get_my_profile_success(self, app_context, mock_jwt_identity, mock_query):
+    def test_get_my_profile_success(self, app_context, mock_identity, mock_query):
         """Test successful profile retrieval"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_query.return_value = [{
             'username': 'testuser',
             'age': 25,
@@ -266,9 +281,9 @@ class TestGetMyProfile:
         assert data['code'] == 200
         assert data['data']['username'] == 'testuser'
     
-    def test_get_my_profile_no_auth(self, app_context, mock_jwt_identity):
+    def test_get_my_profile_no_auth(self, app_context, mock_identity):
         """Test profile retrieval without authentication"""
-        mock_jwt_identity.return_value = None
+        mock_identity.return_value = None
         result = get_my_profile()
         data = json.loads(result.get_data(as_text=True))
         assert data['code'] == 400
@@ -277,31 +292,34 @@ class TestGetMyProfile:
 class TestProfileEdit:
     """Test profile_edit function"""
     
-    def test_profile_edit_success(self, app_context, mock_request, mock_jwt_identity, mock_execute):
+    def test_profile_edit_success(self, app_context, mock_request, mock_identity, mock_execute):
         """Test successful profile update"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {
             'age': 26,
             'weight_kg': 72
         }
         mock_execute.return_value = Mock(rowcount=1)
         
-        result = profile_edit(mock_request)
+        with patch('redis_client.invalidate_profile_cache') as mock_invalidate_profile, \
+             patch('redis_client.invalidate_nutrition_cache'):
+            result = profile_edit(mock_request)
         data = json.loads(result.get_data(as_text=True))
         assert data['code'] == 200
         assert 'successfully' in data['message'].lower()
+        mock_invalidate_profile.assert_called_once_with(1)
     
-    def test_profile_edit_no_data(self, app_context, mock_request, mock_jwt_identity):
+    def test_profile_edit_no_data(self, app_context, mock_request, mock_identity):
         """Test profile update with no data"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = None
         result = profile_edit(mock_request)
         data = json.loads(result.get_data(as_text=True))
         assert data['code'] == 400
     
-    def test_profile_edit_invalid_field(self, app_context, mock_request, mock_jwt_identity):
+    def test_profile_edit_invalid_field(self, app_context, mock_request, mock_identity):
         """Test profile update with invalid field"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {
             'invalid_field': 'value'
         }
@@ -309,17 +327,17 @@ class TestProfileEdit:
         data = json.loads(result.get_data(as_text=True))
         assert data['code'] == 400
     
-    def test_profile_edit_no_fields(self, app_context, mock_request, mock_jwt_identity):
+    def test_profile_edit_no_fields(self, app_context, mock_request, mock_identity):
         """Test profile update with no valid fields"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {}
         result = profile_edit(mock_request)
         data = json.loads(result.get_data(as_text=True))
         assert data['code'] == 400
     
-    def test_profile_edit_invalid_age(self, app_context, mock_request, mock_jwt_identity):
+    def test_profile_edit_invalid_age(self, app_context, mock_request, mock_identity):
         """Test profile update with invalid age"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {
             'age': 'not_a_number'
         }
@@ -331,9 +349,9 @@ class TestProfileEdit:
 class TestGetDailyNeeds:
     """Test get_daily_needs function"""
     
-    def test_get_daily_needs_male(self, app_context, mock_jwt_identity, mock_query):
+    def test_get_daily_needs_male(self, app_context, mock_identity, mock_query):
         """Test daily needs calculation for male"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_query.return_value = [{
             'username': 'testuser',
             'age': 30,
@@ -353,9 +371,9 @@ class TestGetDailyNeeds:
         assert 'fat_g' in data['data']
         assert data['data']['calories'] > 0
     
-    def test_get_daily_needs_female(self, app_context, mock_jwt_identity, mock_query):
+    def test_get_daily_needs_female(self, app_context, mock_identity, mock_query):
         """Test daily needs calculation for female"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_query.return_value = [{
             'username': 'testuser',
             'age': 25,
@@ -374,9 +392,20 @@ class TestGetDailyNeeds:
         assert 'goal' in data['data']
         assert data['data']['goal'] == 'cut'
     
-    def test_get_daily_needs_user_not_found(self, app_context, mock_jwt_identity, mock_query):
+    def test_get_daily_needs_uses_cached_profile(self, app_context, mock_identity, mock_query):
+        """Test that a cached profile skips the users query"""
+        mock_identity.return_value = Identity('testuser', 1)
+        profile = {'id': 1, 'username': 'testuser', 'age': 30, 'sex': 'male', 'height_cm': 180.0,
+                   'weight_kg': 75.0, 'activity_level': 'moderate', 'goal': 'maintain'}
+        with patch('redis_client.cache_get', return_value=profile):
+            data = json.loads(get_daily_needs().get_data(as_text=True))
+        assert data['code'] == 200
+        assert data['data']['protein_g'] == 120
+        mock_query.assert_not_called()
+
+    def test_get_daily_needs_user_not_found(self, app_context, mock_identity, mock_query):
         """Test daily needs with user not found"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_query.return_value = []
         result = get_daily_needs()
         data = json.loads(result.get_data(as_text=True))
@@ -386,54 +415,33 @@ class TestGetDailyNeeds:
 class TestGetDailyNutrition:
     """Test get_daily_nutrition function"""
     
-    def test_get_daily_nutrition_success(self, mock_jwt_identity, mock_query):
-        """Test successful daily nutrition retrieval"""
-        mock_jwt_identity.return_value = 'testuser'
-        mock_query.return_value = [{'id': 1}]
+    def test_get_daily_nutrition_success(self, mock_identity, mock_query):
+        """Test that totals come back as one row, summed and rounded by the database"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_query.return_value = [{'calories': 275.0, 'protein': 12.5, 'carbs': 40.0, 'fat': 6.5}]
         
-        with patch('functions.fetch_intake_rows') as mock_fetch:
-            mock_fetch.return_value = [
-                {
-                    'quantity': 100.0,
-                    'calories': 200.0,
-                    'protein': 10.0,
-                    'carbs': 30.0,
-                    'fat': 5.0
-                },
-                {
-                    'quantity': 50.0,
-                    'calories': 150.0,
-                    'protein': 5.0,
-                    'carbs': 20.0,
-                    'fat': 3.0
-                }
-            ]
-            
-            result = get_daily_nutrition(date.today())
-            assert result is not None
-            assert result['calories'] > 0
-            assert result['protein'] > 0
-            assert result['carbs'] > 0
-            assert result['fat'] > 0
+        result = get_daily_nutrition(date.today())
+        assert result == {'calories': 275.0, 'protein': 12.5, 'carbs': 40.0, 'fat': 6.5}
+
+        sql, params = mock_query.call_args.args
+        assert 'ROUND(SUM(calories), :digits)' in sql
+        assert params['digits'] == 2
+        assert params['start_date'] == params['end_date'] == date.today()
     
-    def test_get_daily_nutrition_no_data(self, mock_jwt_identity, mock_query):
+    def test_get_daily_nutrition_no_data(self, mock_identity, mock_query):
         """Test daily nutrition with no intake data"""
-        mock_jwt_identity.return_value = 'testuser'
-        # query is called once to get user_id
-        mock_query.return_value = [{'id': 1}]
+        mock_identity.return_value = Identity('testuser', 1)
         
-        with patch('functions.fetch_intake_rows') as mock_fetch, \
-             patch('redis_client.cache_set') as mock_cache_set, \
+        with patch('redis_client.cache_set') as mock_cache_set, \
              patch('redis_client.cache_get') as mock_cache_get:
             mock_cache_get.return_value = None  # No cache
-            mock_fetch.return_value = []  # No intake rows
+            mock_query.return_value = []  # HAVING filters out days without entries
             result = get_daily_nutrition(date.today())
             assert result is None
     
-    def test_get_daily_nutrition_user_not_found(self, app_context, mock_jwt_identity, mock_query):
+    def test_get_daily_nutrition_user_not_found(self, app_context, mock_identity):
         """Test daily nutrition with user not found"""
-        mock_jwt_identity.return_value = 'testuser'
-        mock_query.return_value = []  # User not found
+        mock_identity.return_value = None  # User not found
         
         # The function tries to import redis_client, catches ImportError if it fails
         # We'll patch the import to simulate redis not being available
@@ -455,9 +463,9 @@ class TestGetDailyNutrition:
 class TestDvSummation:
     """Test dv_summation function"""
     
-    def test_dv_summation_with_data(self, app_context, mock_jwt_identity):
+    def test_dv_summation_with_data(self, app_context, mock_identity):
         """Test dv_summation with nutrition data"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         
         with patch('functions.get_daily_nutrition') as mock_nutrition:
             mock_nutrition.return_value = {
@@ -471,9 +479,9 @@ class TestDvSummation:
             assert data['code'] == 200
             assert data['data']['calories'] == 2000.0
     
-    def test_dv_summation_no_data(self, app_context, mock_jwt_identity):
+    def test_dv_summation_no_data(self, app_context, mock_identity):
         """Test dv_summation with no nutrition data"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         
         with patch('functions.get_daily_nutrition') as mock_nutrition:
             mock_nutrition.return_value = None
@@ -486,61 +494,110 @@ class TestDvSummation:
 class TestRetrieveLog:
     """Test retrieve_log function"""
     
-    def test_retrieve_log_success(self, app_context, mock_jwt_identity, mock_query):
+    def test_retrieve_log_success(self, app_context, mock_identity, mock_query):
         """Test successful log retrieval"""
-        mock_jwt_identity.return_value = 'testuser'
-        # query is called twice: once for user_id, once for logs
+        mock_identity.return_value = Identity('testuser', 1)
         mock_query.side_effect = [
-            [{'id': 1}],  # User ID query
             [{
                 'id': 1,
                 'food_name': 'Apple',
                 'quantity': 100,
-                'intake_date': date.today()
+                'intake_date': date.today(),
+                'created_at': datetime.now()
             }]  # Logs query
         ]
         
-        with patch('redis_client.cache_get') as mock_cache_get, \
-             patch('redis_client.cache_set') as mock_cache_set:
-            mock_cache_get.return_value = None  # No cache
+        with patch('redis_client.cache_get_raw_versioned', return_value=('key', None)), \
+             patch('redis_client.cache_set_raw') as mock_cache_set:
             result = retrieve_log()
             data = json.loads(result.get_data(as_text=True))
             assert data['code'] == 200
-            assert len(data['data']) > 0
-    
-    def test_retrieve_log_with_date_filter(self, app_context, mock_jwt_identity, mock_query):
-        """Test log retrieval with date filter"""
-        mock_jwt_identity.return_value = 'testuser'
-        # query is called twice: once for user_id, once for logs
+            assert len(data['data']['logs']) == 1
+            assert data['data']['next_cursor'] is None
+
+            # The stored body is the replay of this response, marked as cached
+            cached = json.loads(mock_cache_set.call_args.args[1])
+            assert cached['message'] == "Logs retrieved successfully (cached)"
+            assert cached['data'] == data['data']
+
+    def test_retrieve_log_cache_hit_serves_stored_body(self, app_context, mock_identity, mock_query):
+        """Test that a cache hit returns the stored bytes without querying or re-encoding"""
+        mock_identity.return_value = Identity('testuser', 1)
+        body = b'{"code": 200, "data": {"logs": [], "next_cursor": null}, "message": "Logs retrieved successfully (cached)"}'
+        with patch('redis_client.cache_get_raw_versioned', return_value=('key', body)), \
+             patch('functions.serialization.dumps') as mock_dumps:
+            result = retrieve_log()
+        assert result.get_data() == body
+        mock_dumps.assert_not_called()
+        mock_query.assert_not_called()
+
+    def test_retrieve_log_with_date_range(self, app_context, mock_identity, mock_query):
+        """Test log retrieval bounded by from/to dates"""
+        mock_identity.return_value = Identity('testuser', 1)
         mock_query.side_effect = [
-            [{'id': 1}],  # User ID query
             []  # Logs query (empty)
         ]
         
-        with patch('redis_client.cache_get') as mock_cache_get, \
-             patch('redis_client.cache_set') as mock_cache_set:
-            mock_cache_get.return_value = None  # No cache
-            result = retrieve_log(date.today())
+        with patch('redis_client.cache_get_raw_versioned', return_value=('key', None)), \
+             patch('redis_client.cache_set_raw') as mock_cache_set:
+            result = retrieve_log(date.today() - timedelta(days=7), date.today())
             data = json.loads(result.get_data(as_text=True))
             assert data['code'] == 200
-            assert data['data'] == []  # Empty list
+            assert data['data'] == {'logs': [], 'next_cursor': None}
+
+        sql, params = mock_query.call_args.args
+        assert 'ui.intake_date >= :start_date' in sql
+        assert 'ui.intake_date <= :end_date' in sql
+
+    def test_retrieve_log_paginates_with_cursor(self, app_context, mock_identity, mock_query):
+        """Test that a full page returns a cursor that resumes after its last entry"""
+        mock_identity.return_value = Identity('testuser', 1)
+        created_at = datetime(2024, 1, 2, 8, 30)
+        mock_query.return_value = [
+            {'id': i, 'intake_date': date(2024, 1, 2), 'created_at': created_at} for i in (5, 4, 3)
+        ]
+
+        with patch('redis_client.cache_get_raw_versioned', return_value=('key', None)), patch('redis_client.cache_set_raw'):
+            data = json.loads(retrieve_log(limit=2).get_data(as_text=True))
+        assert [log['id'] for log in data['data']['logs']] == [5, 4]
+        assert mock_query.call_args.args[1]['limit'] == 3
+
+        with patch('redis_client.cache_get_raw_versioned', return_value=('key', None)), patch('redis_client.cache_set_raw'):
+            retrieve_log(cursor=data['data']['next_cursor'], limit=2)
+        sql, params = mock_query.call_args.args
+        assert '(ui.intake_date, ui.created_at, ui.id) <' in sql
+        assert (params['cursor_date'], params['cursor_created_at'], params['cursor_id']) == (date(2024, 1, 2), created_at, 4)
+
+    def test_retrieve_log_invalid_cursor(self, app_context, mock_identity, mock_query):
+        """Test that a malformed cursor is rejected without querying"""
+        mock_identity.return_value = Identity('testuser', 1)
+        data = json.loads(retrieve_log(cursor='not-a-cursor').get_data(as_text=True))
+        assert data['code'] == 400
+        mock_query.assert_not_called()
+
+    def test_retrieve_log_limit_is_bounded(self, app_context, mock_identity, mock_query):
+        """Test that the page size is capped"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_query.return_value = []
+        with patch('redis_client.cache_get_raw_versioned', return_value=('key', None)), patch('redis_client.cache_set_raw'):
+            retrieve_log(limit=100000)
+        assert mock_query.call_args.args[1]['limit'] == LOG_PAGE_MAX_LIMIT + 1
 
 
 class TestInsertLog:
     """Test insert_log function"""
     
-    def test_insert_log_success(self, app_context, mock_request, mock_jwt_identity, mock_query, mock_execute):
+    def test_insert_log_success(self, app_context, mock_request, mock_identity, mock_query, mock_execute):
         """Test successful log insertion"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {
             'food_name': 'Apple',
             'quantity': 100,
             'intake_date': '2024-01-01',
             'meal_type': 'breakfast'
         }
-        # query is called multiple times: user_id, food lookup, then food name lookup
+        # query is called for the food lookup, then the food name lookup
         mock_query.side_effect = [
-            [{'id': 1}],  # User ID query
             [{'id': 1, 'name': 'Apple', 'calories': 52, 'protein': 0.3, 'carbs': 14, 'fat': 0.2, 'serving_unit': 'g'}],  # Food lookup
             [{'name': 'Apple'}]  # Food name lookup after insert
         ]
@@ -558,10 +615,60 @@ class TestInsertLog:
             result = insert_log(mock_request)
             data = json.loads(result.get_data(as_text=True))
             assert data['code'] == 200
+        
+        # Intake insert stays uncommitted until the rollup upsert commits
+        insert_call, rollup_call = mock_execute.call_args_list
+        assert insert_call.kwargs['commit'] is False
+        assert 'daily_totals' in rollup_call.args[0]
+        assert rollup_call.args[1]['signs'] == [1]
+    
+    def test_insert_log_async_unknown_food(self, app_context, mock_request, mock_identity, mock_execute):
+        """Test that async mode accepts the entry without waiting on USDA"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_request.get_json.return_value = {
+            'food_name': 'Dragon fruit',
+            'quantity': 100,
+            'intake_date': '2024-01-01',
+            'async': True
+        }
+        mock_execute.return_value = Mock(fetchone=Mock(return_value={
+            'id': 5,
+            'food_id': None,
+            'quantity': 100,
+            'intake_date': date(2024, 1, 1),
+            'status': 'pending',
+            'created_at': datetime.now()
+        }))
+        
+        with patch('functions.lookup_food_locally', return_value=(None, False)), \
+             patch('functions.resolve_food') as mock_resolve, \
+             patch('celery_app.resolve_pending_intake.delay') as mock_delay, \
+             patch('redis_client.invalidate_nutrition_cache'):
+            result = insert_log(mock_request)
+            data = json.loads(result.get_data(as_text=True))
+            assert data['code'] == 202
+            assert data['data']['status'] == 'pending'
+            assert data['data']['food_name'] == 'Dragon fruit'
+            mock_delay.assert_called_once_with(5)
+            mock_resolve.assert_not_called()
+    
+    def test_insert_log_async_known_missing_food(self, app_context, mock_request, mock_identity):
+        """Test that async mode still rejects foods the lookup cache knows are missing"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_request.get_json.return_value = {
+            'food_name': 'Unobtainium',
+            'quantity': 100,
+            'intake_date': '2024-01-01',
+            'async': True
+        }
+        with patch('functions.lookup_food_locally', return_value=(None, True)):
+            result = insert_log(mock_request)
+            data = json.loads(result.get_data(as_text=True))
+            assert data['code'] == 400
     
-    def test_insert_log_missing_fields(self, app_context, mock_request, mock_jwt_identity):
+    def test_insert_log_missing_fields(self, app_context, mock_request, mock_identity):
         """Test log insertion with missing fields"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {'food_name': 'Apple'}
         result = insert_log(mock_request)
         data = json.loads(result.get_data(as_text=True))
@@ -571,16 +678,14 @@ class TestInsertLog:
 class TestUpdateLog:
     """Test update_log function"""
     
-    def test_update_log_success(self, app_context, mock_request, mock_jwt_identity, mock_query, mock_execute):
+    def test_update_log_success(self, app_context, mock_request, mock_identity, mock_query, mock_execute):
         """Test successful log update"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {
             'id': 1,
             'quantity': 150
         }
-        # query is called multiple times: user_id, then food name lookup
         mock_query.side_effect = [
-            [{'id': 1}],  # User ID query
             [{'name': 'Apple'}]  # Food name query (after update)
         ]
         # Create a dict-like object for the row
@@ -603,9 +708,44 @@ class TestUpdateLog:
             data = json.loads(result.get_data(as_text=True))
             assert data['code'] == 200
     
-    def test_update_log_missing_id(self, app_context, mock_request, mock_jwt_identity):
+    def test_update_log_moves_rollup(self, app_context, mock_request, mock_identity, mock_query, mock_execute):
+        """Test that an update subtracts the previous values and adds the new ones"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_request.get_json.return_value = {
+            'id': 1,
+            'quantity': 150,
+            'intake_date': '2024-01-02'
+        }
+        mock_query.side_effect = [
+            [{'name': 'Apple'}]  # Food name query (after update)
+        ]
+        mock_row = {
+            'id': 1,
+            'food_id': 1,
+            'quantity': 150,
+            'intake_date': date(2024, 1, 2),
+            'prev_food_id': 1,
+            'prev_quantity': 100,
+            'prev_intake_date': date(2024, 1, 1)
+        }
+        mock_execute.return_value = Mock(fetchone=Mock(return_value=mock_row))
+        
+        with patch('redis_client.invalidate_nutrition_cache') as mock_invalidate:
+            result = update_log(mock_request)
+            data = json.loads(result.get_data(as_text=True))
+            assert data['code'] == 200
+            assert 'prev_quantity' not in data['data']
+            # Moving an entry across days still takes a single version bump
+            mock_invalidate.assert_called_once_with('testuser')
+        
+        rollup_params = mock_execute.call_args_list[-1].args[1]
+        assert rollup_params['quantities'] == [100, 150]
+        assert rollup_params['days'] == [date(2024, 1, 1), date(2024, 1, 2)]
+        assert rollup_params['signs'] == [-1, 1]
+    
+    def test_update_log_missing_id(self, app_context, mock_request, mock_identity):
         """Test log update without ID"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {'quantity': 150}
         result = update_log(mock_request)
         data = json.loads(result.get_data(as_text=True))
@@ -615,11 +755,10 @@ class TestUpdateLog:
 class TestDeleteLog:
     """Test delete_log function"""
     
-    def test_delete_log_success(self, app_context, mock_request, mock_jwt_identity, mock_query, mock_execute):
+    def test_delete_log_success(self, app_context, mock_request, mock_identity, mock_query, mock_execute):
         """Test successful log deletion"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {'id': 1}
-        mock_query.return_value = [{'id': 1}]
         mock_execute.return_value = Mock(fetchone=Mock(return_value={
             'id': 1,
             'intake_date': date.today(),
@@ -631,24 +770,124 @@ class TestDeleteLog:
             data = json.loads(result.get_data(as_text=True))
             assert data['code'] == 200
     
-    def test_delete_log_missing_id(self, app_context, mock_request, mock_jwt_identity):
+    def test_delete_log_missing_id(self, app_context, mock_request, mock_identity):
         """Test log deletion without ID"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
         mock_request.get_json.return_value = {}
         result = delete_log(mock_request)
         data = json.loads(result.get_data(as_text=True))
         assert data['code'] == 400
 
 
+class TestBatchLogs:
+    """Test batch_logs function"""
+
+    def test_batch_logs_applies_all_operations_in_one_transaction(self, app_context, mock_request, mock_identity, mock_query, mock_execute):
+        """Test that inserts, updates and deletes share one transaction and one rollup upsert"""
+        mock_identity.return_value = Identity('testuser', 1)
+        today = date.today()
+        yesterday = today - timedelta(days=1)
+        mock_request.get_json.return_value = {
+            'inserts': [
+                {'food_name': 'Apple', 'quantity': 100, 'intake_date': str(today)},
+                {'food_name': 'apple', 'quantity': 50, 'intake_date': str(today), 'meal_type': 'snack'}
+            ],
+            'updates': [{'id': 5, 'quantity': 80}],
+            'deletes': [6]
+        }
+        # One catalog query resolves every food name
+        mock_query.return_value = [{'id': 1, 'name': 'Apple', 'calories': 52, 'protein': 0.3, 'carbs': 14, 'fat': 0.2, 'serving_unit': 'g'}]
+        mock_execute.side_effect = [
+            Mock(fetchall=Mock(return_value=[{'id': 6, 'food_id': 1, 'quantity': 30, 'intake_date': yesterday}])),
+            Mock(fetchall=Mock(return_value=[{'id': 5, 'food_id': 1, 'quantity': 40, 'intake_date': yesterday}])),
+            Mock(fetchall=Mock(return_value=[{
+                'id': 5, 'food_id': 1, 'quantity': 80, 'intake_date': today, 'food_name': 'Apple'
+            }])),
+            Mock(fetchall=Mock(return_value=[
+                {'id': 7, 'food_id': 1, 'quantity': 100, 'intake_date': today, 'food_name': 'Apple'},
+                {'id': 8, 'food_id': 1, 'quantity': 50, 'intake_date': today, 'food_name': 'Apple'}
+            ])),
+            Mock()
+        ]
+
+        with patch('redis_client.invalidate_nutrition_cache') as mock_invalidate:
+            result = batch_logs(mock_request)
+            data = json.loads(result.get_data(as_text=True))
+
+        assert data['code'] == 200
+        assert data['data']['deleted'] == [6]
+        assert [row['id'] for row in data['data']['inserted']] == [7, 8]
+        assert data['data']['updated'][0]['quantity'] == 80
+        assert mock_query.call_count == 1
+
+        delete_call, lock_call, update_call, insert_call, rollup_call = mock_execute.call_args_list
+        assert all(call.kwargs['commit'] is False for call in (delete_call, lock_call, update_call, insert_call))
+        assert 'FOR UPDATE' in lock_call.args[0] and lock_call.args[1]['ids'] == [5]
+        assert insert_call.args[1]['food_ids'] == [1, 1]
+        assert insert_call.args[1]['meal_types'] == [None, 'snack']
+        assert rollup_call.args[1]['signs'] == [-1, -1, 1, 1, 1]
+        # The whole batch is invalidated with a single version bump
+        mock_invalidate.assert_called_once_with('testuser')
+
+    def test_batch_logs_unknown_entry_rolls_back(self, app_context, mock_request, mock_identity, mock_db, mock_execute):
+        """Test that a missing entry aborts the whole batch"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_request.get_json.return_value = {'deletes': [6, 7]}
+        mock_execute.return_value = Mock(fetchall=Mock(return_value=[{'id': 6, 'food_id': 1, 'quantity': 30, 'intake_date': date.today()}]))
+
+        result = batch_logs(mock_request)
+        data = json.loads(result.get_data(as_text=True))
+        assert data['code'] == 400
+        mock_db.session.rollback.assert_called_once()
+        assert mock_execute.call_count == 1
+
+    def test_batch_logs_validates_before_writing(self, app_context, mock_request, mock_identity, mock_execute):
+        """Test that an invalid operation is reported with its position and nothing is written"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_request.get_json.return_value = {
+            'inserts': [
+                {'food_name': 'Apple', 'quantity': 100, 'intake_date': str(date.today())},
+                {'food_name': 'Apple', 'quantity': -1, 'intake_date': str(date.today())}
+            ]
+        }
+        result = batch_logs(mock_request)
+        data = json.loads(result.get_data(as_text=True))
+        assert data['code'] == 400
+        assert data['message'].startswith('inserts[1]')
+        mock_execute.assert_not_called()
+
+    def test_batch_logs_rejects_unknown_food_id(self, app_context, mock_request, mock_identity, mock_query, mock_execute):
+        """Test that a food_id missing from the catalog is a 400 naming the entry, not an FK error"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_request.get_json.return_value = {'updates': [{'id': 5, 'food_id': 1}, {'id': 6, 'food_id': 999}]}
+        mock_query.return_value = [{'id': 1}]
+        result = batch_logs(mock_request)
+        data = json.loads(result.get_data(as_text=True))
+        assert data['code'] == 400
+        assert data['message'] == 'updates[1]: Food not found: 999'
+        assert mock_query.call_args.args[1] == {'ids': [1, 999]}
+        mock_execute.assert_not_called()
+
+    def test_batch_logs_rejects_conflicting_operations(self, app_context, mock_request, mock_identity, mock_execute):
+        """Test that an entry cannot be updated and deleted in the same batch"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_request.get_json.return_value = {'updates': [{'id': 5, 'quantity': 10}], 'deletes': [5]}
+        result = batch_logs(mock_request)
+        data = json.loads(result.get_data(as_text=True))
+        assert data['code'] == 400
+        mock_execute.assert_not_called()
+
+
 class TestGet7DayHistory:
     """Test get_7_day_history function"""
     
-    def test_get_7_day_history_success(self, app_context, mock_jwt_identity, mock_query):
+    def test_get_7_day_history_success(self, app_context, mock_identity, mock_query):
         """Test successful 7-day history retrieval"""
-        mock_jwt_identity.return_value = 'testuser'
+        mock_identity.return_value = Identity('testuser', 1)
+        today = date.today()
         mock_query.side_effect = [
-            [{'id': 1}],  # User ID query
-            [{  # Profile query
+            [{  # Profile query (includes user id)
+                'id': 1,
                 'username': 'testuser',
                 'age': 30,
                 'sex': 'male',
@@ -656,25 +895,299 @@ class TestGet7DayHistory:
                 'weight_kg': 75,
                 'activity_level': 'moderate',
                 'goal': 'maintain'
-            }]
+            }],
+            [  # Per-day aggregate query
+                {'day': today, 'calories': Decimal('2000'), 'protein': Decimal('100'),
+                 'carbs': Decimal('250'), 'fat': Decimal('65')},
+                {'day': today - timedelta(days=2), 'calories': Decimal('1500.456'), 'protein': Decimal('80'),
+                 'carbs': Decimal('200'), 'fat': Decimal('50')}
+            ]
         ]
         
-        with patch('functions.get_daily_nutrition') as mock_nutrition, \
-             patch('redis_client.cache_get') as mock_cache_get, \
-             patch('redis_client.cache_set') as mock_cache_set:
-            mock_cache_get.return_value = None  # No cache
-            mock_nutrition.return_value = {
-                'calories': 2000,
-                'protein': 100,
-                'carbs': 250,
-                'fat': 65
-            }
+        with patch('redis_client.cache_get_raw_versioned', return_value=('key', None)), \
+             patch('redis_client.cache_set_raw') as mock_cache_set:
             result = get_7_day_history()
             data = json.loads(result.get_data(as_text=True))
             assert data['code'] == 200
             assert 'history' in data['data']
             assert len(data['data']['history']) == 7
             assert 'daily_needs' in data['data']
+            history = data['data']['history']
+            assert history[0]['date'] == str(today)
+            assert history[0]['calories'] == 2000.0
+            assert history[1]['calories'] is None
+            assert history[2]['calories'] == 1500.46
+            # Only the profile and the aggregate query are issued
+            assert mock_query.call_count == 2
+
+
+class TestGetNutritionHistory:
+    """Test get_nutrition_history function"""
+    
+    def test_get_nutrition_history_range(self, app_context, mock_identity, mock_query):
+        """Test history for an explicit date range"""
+        mock_identity.return_value = Identity('testuser', 1)
+        mock_query.side_effect = [
+            [{
+                'id': 1,
+                'username': 'testuser',
+                'age': 25,
+                'sex': 'female',
+                'height_cm': 165,
+                'weight_kg': 60,
+                'activity_level': 'light',
+                'goal': 'cut'
+            }],
+            [{'day': date(2024, 1, 3), 'calories': 1800, 'protein': 90, 'carbs': 200, 'fat': 60}]
+        ]
+        result = get_nutrition_history(date(2024, 1, 1), date(2024, 1, 10))
+        data = json.loads(result.get_data(as_text=True))
+        assert data['code'] == 200
+        assert data['data']['from'] == '2024-01-01'
+        assert data['data']['to'] == '2024-01-10'
+        assert len(data['data']['history']) == 10
+        assert data['data']['history'][-1]['date'] == '2024-01-01'
+    
+    def test_get_nutrition_history_inverted_range(self, app_context, mock_identity):
+        """Test history with 'from' after 'to'"""
+        mock_identity.return_value = Identity('testuser', 1)
+        result = get_nutrition_history(date(2024, 1, 10), date(2024, 1, 1))
+        data = json.loads(result.get_data(as_text=True))
+        assert data['code'] == 400
+    
+    def test_get_nutrition_history_range_too_long(self, app_context, mock_identity):
+        """Test history with a range beyond the allowed maximum"""
+        mock_identity.return_value = Identity('testuser', 1)
+        result = get_nutrition_history(date(2020, 1, 1), date(2024, 1, 1))
+        data = json.loads(result.get_data(as_text=True))
+        assert data['code'] == 400
+    
+    def test_build_daily_series_fills_gaps(self):
+        """Test that days without intake are present with None totals"""
+        rows = [{'day': date(2024, 1, 2), 'calories': 100, 'protein': 1, 'carbs': 2, 'fat': 3}]
+        series = build_daily_series(rows, date(2024, 1, 1), date(2024, 1, 3), {'calories': 2000})
+        assert [entry['date'] for entry in series] == ['2024-01-03', '2024-01-02', '2024-01-01']
+        assert series[0]['calories'] is None
+        assert series[1]['calories'] == 100.0
+        assert series[1]['optimal']['calories'] == 2000
+
+
+class TestGetNutritionTrends:
+    """Test get_nutrition_trends function"""
+
+    def test_get_nutrition_trends_success(self, app_context, mock_identity, mock_query):
+        """Test that trends come from one profile lookup and one aggregate query"""
+        mock_identity.return_value = Identity('testuser', 1)
+        end = date(2024, 3, 31)
+        mock_query.side_effect = [
+            [{'id': 1, 'username': 'testuser', 'age': 30, 'sex': 'male', 'height_cm': 180,
+              'weight_kg': 75, 'activity_level': 'moderate', 'goal': 'maintain'}],
+            [{'day': end - timedelta(days=i), 'calories': Decimal('2500'), 'protein': Decimal('120'),
+              'carbs': Decimal('300'), 'fat': Decimal('80'), 'entry_count': 3} for i in range(10)]
+        ]
+
+        with patch('redis_client.cache_get', return_value=None), \
+             patch('redis_client.cache_get_raw_versioned', return_value=('key', None)), \
+             patch('redis_client.cache_set_raw'):
+            data = json.loads(get_nutrition_trends(end, days=90, window=7, points=30).get_data(as_text=True))
+
+        assert data['code'] == 200
+        assert data['data']['from'] == '2024-01-02'
+        assert data['data']['summary']['logged_days'] == 10
+        assert data['data']['summary']['average']['calories'] == 2500.0
+        assert len(data['data']['series']['date']) == 30
+        assert mock_query.call_count == 2
+
+    def test_get_nutrition_trends_rejects_long_range(self, app_context, mock_identity, mock_query):
+        """Test that the range is bounded like /history"""
+        mock_identity.return_value = Identity('testuser', 1)
+        data = json.loads(get_nutrition_trends(date.today(), days=1000).get_data(as_text=True))
+        assert data['code'] == 400
+        mock_query.assert_not_called()
+
+
+class TestSearchFoodCatalog:
+    """Test search_food_catalog function"""
+    
+    def test_search_food_catalog_success(self, app_context, mock_query):
+        """Test autocomplete search returns catalog matches"""
+        mock_query.return_value = [{'id': 1, 'name': 'Apple', 'calories': 52, 'protein': 0.3,
+                                    'carbs': 14, 'fat': 0.2, 'serving_unit': 'g'}]
+        result = search_food_catalog('  App ')
+        data = json.loads(result.get_data(as_text=True))
+        assert data['code'] == 200
+        assert data['data'][0]['name'] == 'Apple'
+        params = mock_query.call_args.args[1]
+        assert params['term'] == 'app'
+        assert params['prefix'] == 'app%'
+        assert params['limit'] == 10
+
+    def test_search_prefix_candidates_follow_index_order(self, app_context, mock_query):
+        """Test that prefix candidates are limited in index order instead of sorting every match"""
+        mock_query.return_value = []
+        search_food_catalog('ch')
+        prefix_cte = mock_query.call_args.args[0].split('fuzzy AS')[0]
+        assert 'ORDER BY LOWER(name) USING ~<~' in prefix_cte
+        assert 'LENGTH(name)' not in prefix_cte
+    
+    def test_search_food_catalog_limit_is_bounded(self, app_context, mock_query):
+        """Test that the result size is capped"""
+        mock_query.return_value = []
+        search_food_catalog('apple', 1000)
+        assert mock_query.call_args.args[1]['limit'] == 25
+    
+    def test_search_food_catalog_short_query(self, app_context, mock_query):
+        """Test that one-character queries are rejected"""
+        result = search_food_catalog('a')
+        data = json.loads(result.get_data(as_text=True))
+        assert data['code'] == 400
+        mock_query.assert_not_called()
+    
+    def test_escape_like(self):
+        """Test that LIKE wildcards in user input are matched literally"""
+        assert escape_like('100%_bran') == '100\\%\\_bran'
+
+
+class TestResolveFood:
+    """Test resolve_food function"""
+    
+    def test_resolve_food_catalog_hit(self, app_context, mock_query):
+        """Test that catalog hits never consult the lookup cache or USDA"""
+        mock_query.return_value = [{'id': 1, 'name': 'Apple'}]
+        with patch('functions.fetch_usda_food') as mock_fetch:
+            assert resolve_food('apple')['id'] == 1
+            mock_fetch.assert_not_called()
+        assert mock_query.call_count == 1
+        # Duplicate names resolve deterministically to the oldest row
+        assert 'ORDER BY id' in mock_query.call_args.args[0]
+    
+    def test_resolve_food_negative_cache_hit(self, app_context, mock_query, mock_db):
+        """Test that a remembered miss is not retried against USDA"""
+        mock_query.side_effect = [
+            [],  # Catalog lookup
+            [{'status': 'not_found', 'id': None, 'name': None, 'calories': None, 'protein': None,
+              'carbs': None, 'fat': None, 'serving_unit': None}]  # Lookup cache
+        ]
+        with patch('functions.fetch_usda_food') as mock_fetch:
+            assert resolve_food('Unobtainium') is None
+            mock_fetch.assert_not_called()
+        mock_db.session.execute.assert_not_called()
+    
+    def test_resolve_food_miss_calls_usda_once(self, app_context, mock_query, mock_execute, mock_db):
+        """Test that a miss takes the claim, inserts the food and caches the result"""
+        usda_food = {'name': 'Yogurt, Greek, plain', 'calories': 59, 'protein': 10,
+                     'carbs': 3.6, 'fat': 0.4, 'serving_unit': 'g'}
+        mock_query.side_effect = [
+            [],  # Catalog lookup
+            [],  # Lookup cache
+            []   # Catalog lookup by USDA description
+        ]
+        mock_execute.return_value = Mock(fetchone=Mock(return_value={'id': 9, **usda_food}))
+        with patch('functions.fetch_usda_food', return_value=(usda_food, 'found')) as mock_fetch:
+            food = resolve_food('  Greek   YOGURT ')
+            assert food['id'] == 9
+            mock_fetch.assert_called_once()
+        claim_sql, claim_params = mock_execute.call_args_list[0].args
+        assert "'pending'" in claim_sql
+        assert claim_params == {'query_key': 'greek yogurt', 'ttl': 30}
+        mock_db.session.execute.assert_not_called()
+        cache_params = mock_execute.call_args_list[-1].args[1]
+        assert cache_params['query_key'] == 'greek yogurt'
+        assert cache_params['food_id'] == 9
+        assert cache_params['status'] == 'found'
+    
+    def test_resolve_food_caches_not_found(self, app_context, mock_query, mock_execute, mock_db):
+        """Test that USDA misses are remembered with the negative TTL"""
+        mock_query.side_effect = [[], [], []]
+        with patch('functions.fetch_usda_food', return_value=(None, 'not_found')):
+            assert resolve_food('Unobtainium') is None
+        cache_params = mock_execute.call_args.args[1]
+        assert cache_params['food_id'] is None
+        assert cache_params['status'] == 'not_found'
+        assert cache_params['ttl'] == 86400
+
+    def test_resolve_food_does_not_cache_errors(self, app_context, mock_query, mock_execute, mock_db):
+        """Test that a failed lookup releases the claim instead of blocking the food"""
+        mock_query.side_effect = [[], []]
+        with patch('functions.fetch_usda_food', return_value=(None, 'error')):
+            assert resolve_food('Unobtainium') is None
+        release_sql, release_params = mock_execute.call_args.args
+        assert release_sql.startswith('DELETE FROM usda_lookup_cache')
+        assert release_params == {'query_key': 'unobtainium'}
+
+    def test_resolve_food_waits_for_claim_holder(self, app_context, mock_query, mock_execute, mock_db):
+        """Test that a concurrent miss polls for the claim holder's result without calling USDA"""
+        pending = {'status': 'pending', 'id': None, 'name': None, 'calories': None, 'protein': None,
+                   'carbs': None, 'fat': None, 'serving_unit': None}
+        mock_query.side_effect = [
+            [],  # Catalog lookup
+            [],  # Lookup cache
+            [pending],
+            [{**pending, 'status': 'found', 'id': 9, 'name': 'Yogurt, Greek, plain'}]
+        ]
+        mock_execute.return_value = Mock(fetchone=Mock(return_value=None))
+        with patch('functions.fetch_usda_food') as mock_fetch, \
+             patch('functions.time.sleep') as mock_sleep:
+            assert resolve_food('greek yogurt')['id'] == 9
+            mock_fetch.assert_not_called()
+        mock_sleep.assert_called_once()
+        assert mock_db.session.commit.call_count == 2
+
+
+class TestFinalizePendingLog:
+    """Test finalize_pending_log function"""
+    
+    def test_finalize_pending_log_resolves_food(self, app_context, mock_query, mock_execute):
+        """Test that a resolved food settles the entry and updates the rollup"""
+        mock_query.return_value = [{'id': 5, 'pending_food_name': 'Dragon fruit', 'username': 'testuser'}]
+        mock_execute.return_value = Mock(fetchone=Mock(return_value={
+            'user_id': 1, 'food_id': 8, 'quantity': 100, 'intake_date': date(2024, 1, 1)
+        }))
+        with patch('functions.resolve_food', return_value={'id': 8}), \
+             patch('redis_client.invalidate_nutrition_cache') as mock_invalidate:
+            assert finalize_pending_log(5) == {'intake_id': 5, 'status': 'ready'}
+            mock_invalidate.assert_called_once_with('testuser')
+        rollup_params = mock_execute.call_args.args[1]
+        assert rollup_params['food_ids'] == [8]
+        assert rollup_params['signs'] == [1]
+    
+    def test_finalize_pending_log_retries_on_usda_error(self, app_context, mock_query, mock_execute):
+        """Test that transient USDA failures are retried rather than failing the entry"""
+        mock_query.side_effect = [
+            [{'id': 5, 'pending_food_name': 'Dragon fruit', 'username': 'testuser'}],
+            []  # Failed lookups are not cached
+        ]
+        with patch('functions.resolve_food', return_value=None):
+            with pytest.raises(FoodLookupUnavailable):
+                finalize_pending_log(5)
+        mock_execute.assert_not_called()
+
+    def test_finalize_pending_log_retries_on_database_error(self, app_context, mock_query, mock_execute):
+        """Test that a database error during the lookup is retried rather than left pending"""
+        mock_query.return_value = [{'id': 5, 'pending_food_name': 'Dragon fruit', 'username': 'testuser'}]
+        with patch('functions.resolve_food', side_effect=OperationalError('SELECT', {}, Exception('gone'))):
+            with pytest.raises(FoodLookupUnavailable):
+                finalize_pending_log(5)
+        mock_execute.assert_not_called()
+
+    def test_finalize_pending_log_fails_on_final_database_error(self, app_context, mock_query, mock_execute):
+        """Test that the final attempt marks the entry failed after a database error"""
+        mock_query.side_effect = [
+            [{'id': 5, 'pending_food_name': 'Dragon fruit', 'username': 'testuser'}],
+            []  # No remembered USDA result
+        ]
+        mock_execute.return_value = Mock(fetchone=Mock(return_value={'intake_date': date(2024, 1, 1)}))
+        with patch('functions.resolve_food', side_effect=OperationalError('SELECT', {}, Exception('gone'))), \
+             patch('redis_client.invalidate_nutrition_cache'):
+            assert finalize_pending_log(5, final_attempt=True) == {'intake_id': 5, 'status': 'failed'}
+        assert "status = 'failed'" in mock_execute.call_args.args[0]
+
+    def test_finalize_pending_log_already_settled(self, app_context, mock_query):
+        """Test that entries no longer pending are left alone"""
+        mock_query.return_value = []
+        with patch('functions.resolve_food') as mock_resolve:
+            assert finalize_pending_log(5)['status'] == 'skipped'
+            mock_resolve.assert_not_called()
 
 
 class TestSearchFoodInUsda:
@@ -726,6 +1239,15 @@ class TestSearchFoodInUsda:
         
         result = search_food_in_usda('Apple')
         assert result is None
+    
+    @patch('functions.requests.post')
+    @patch.dict(os.environ, {'USDA_API_KEY': 'test_api_key'})
+    def test_fetch_usda_food_statuses(self, mock_post):
+        """Test that misses and API errors are reported distinctly"""
+        mock_post.return_value = Mock(status_code=200, json=Mock(return_value={'foods': []}))
+        assert fetch_usda_food('NonexistentFood') == (None, 'not_found')
+        mock_post.return_value = Mock(status_code=503)
+        assert fetch_usda_food('Apple') == (None, 'error')
 
 
 if __name__ == '__main__':
@@ -0,0 +1,88 @@
+"""
+Unit tests for identity.py
+"""
+import pytest
+from unittest.mock import Mock, patch
+from flask import Flask
+
+import identity
+from identity import Identity, get_current_identity, resolve_user_id, remember_user_id
+
+
+@pytest.fixture
+def app():
+    """Create a Flask app for testing"""
+    app = Flask(__name__)
+    app.config['TESTING'] = True
+    return app
+
+
+@pytest.fixture(autouse=True)
+def clear_user_id_cache():
+    identity._user_ids.clear()
+    yield
+    identity._user_ids.clear()
+
+
+class TestGetCurrentIdentity:
+    """Test get_current_identity function"""
+
+    def test_identity_from_token_claim(self, app):
+        """Test that a token carrying the uid claim needs no database lookup"""
+        with app.test_request_context(), \
+             patch('identity.get_jwt_identity', return_value='testuser'), \
+             patch('identity.get_jwt', return_value={'uid': 7}), \
+             patch('identity.db') as mock_db:
+            result = get_current_identity()
+            assert result.username == 'testuser'
+            assert result.user_id == 7
+            mock_db.session.execute.assert_not_called()
+
+    def test_identity_is_request_scoped(self, app):
+        """Test that the identity is resolved once per request"""
+        with app.test_request_context(), \
+             patch('identity.get_jwt_identity', return_value='testuser') as mock_jwt_identity, \
+             patch('identity.get_jwt', return_value={'uid': 7}):
+            first = get_current_identity()
+            second = get_current_identity()
+            assert first is second
+            assert mock_jwt_identity.call_count == 1
+
+    def test_identity_for_legacy_token(self, app):
+        """Test that tokens without the uid claim fall back to the username lookup"""
+        with app.test_request_context(), \
+             patch('identity.get_jwt_identity', return_value='testuser'), \
+             patch('identity.get_jwt', return_value={}), \
+             patch('identity.db') as mock_db:
+            mock_db.session.execute.return_value = Mock(fetchone=Mock(return_value=(3,)))
+            result = get_current_identity()
+            assert result.user_id == 3
+
+    def test_identity_unknown_user(self, app):
+        """Test that an unresolvable user yields None"""
+        with app.test_request_context(), \
+             patch('identity.get_jwt_identity', return_value='ghost'), \
+             patch('identity.get_jwt', return_value={}), \
+             patch('identity.db') as mock_db:
+            mock_db.session.execute.return_value = Mock(fetchone=Mock(return_value=None))
+            assert get_current_identity() is None
+
+
+class TestResolveUserId:
+    """Test resolve_user_id LRU fallback"""
+
+    def test_resolve_user_id_is_cached(self):
+        """Test that repeated lookups hit the database once"""
+        with patch('identity.db') as mock_db:
+            mock_db.session.execute.return_value = Mock(fetchone=Mock(return_value=(5,)))
+            assert resolve_user_id('testuser') == 5
+            assert resolve_user_id('testuser') == 5
+            assert mock_db.session.execute.call_count == 1
+
+    def test_lru_is_bounded(self):
+        """Test that the least recently used usernames are evicted"""
+        with patch('identity.USER_ID_CACHE_SIZE', 2):
+            remember_user_id('a', 1)
+            remember_user_id('b', 2)
+            remember_user_id('c', 3)
+            assert list(identity._user_ids) == ['b', 'c']
@@ -0,0 +1,112 @@
+"""
+Unit tests for metrics.py and the instrumentation that feeds it
+"""
+import pytest
+from unittest.mock import Mock, patch
+from flask import Flask
+from prometheus_client import REGISTRY
+from sqlalchemy import create_engine, text
+
+import database  # registers the engine-wide statement timers
+import metrics
+import redis_client
+from functions import response
+
+
+def sample(name, **labels):
+    return REGISTRY.get_sample_value(name, labels) or 0.0
+
+
+@pytest.fixture(autouse=True)
+def clear_local_cache():
+    redis_client._local_cache.clear()
+    yield
+    redis_client._local_cache.clear()
+
+
+class TestLabels:
+    """Test label helpers"""
+
+    @pytest.mark.parametrize("statement,operation", [
+        ("SELECT 1", "select"),
+        ("\n  insert into food_intake VALUES (1)", "insert"),
+        ("WITH t AS (SELECT 1) SELECT * FROM t", "with"),
+        ("SELECT pg_advisory_xact_lock(1)", "select"),
+        ("COPY food FROM STDIN", "other"),
+        ("", "other"),
+    ])
+    def test_sql_operation(self, statement, operation):
+        """Test that statements are labelled by their leading keyword only"""
+        assert metrics.sql_operation(statement) == operation
+
+    def test_response_carries_api_code(self):
+        """Test that the JSON code is exposed for labelling despite the HTTP 200"""
+        with Flask(__name__).app_context():
+            resp = response(404, 'Log not found')
+        assert resp.status_code == 200
+        assert resp.api_code == 404
+
+
+class TestInstrumentation:
+    """Test that dependency calls are observed"""
+
+    def test_statements_are_timed(self):
+        """Test that every statement executed on an engine is recorded"""
+        before = sample('db_query_duration_seconds_count', operation='select')
+        engine = create_engine('sqlite://')
+        with engine.connect() as conn:
+            conn.execute(text("SELECT 1"))
+            conn.execute(text("SELECT 2"))
+        assert sample('db_query_duration_seconds_count', operation='select') == before + 2
+
+    def test_pool_usage_gauges(self, tmp_path):
+        """Test that checked-out and overflow connections are exported as gauges"""
+        database.pool_stats.reset()
+        engine = create_engine(f"sqlite:///{tmp_path / 'pool.db'}", poolclass=database.InstrumentedQueuePool,
+                               pool_size=1, max_overflow=1)
+        with engine.connect(), engine.connect():
+            assert sample('db_pool_checked_out') == 2
+            assert sample('db_pool_overflow') == 1
+        assert sample('db_pool_checked_out') == 0
+        assert sample('db_pool_overflow') == 0
+        engine.dispose()
+        database.pool_stats.reset()
+
+    def test_cache_tiers_and_redis_latency(self):
+        """Test that a Redis hit and the local hit after it are counted per tier"""
+        client = Mock()
+        client.get.return_value = '{"calories": 100}'
+        redis_hits = sample('cache_lookups_total', tier='redis', result='hit')
+        local_hits = sample('cache_lookups_total', tier='local', result='hit')
+        gets = sample('redis_operation_duration_seconds_count', operation='get')
+        with patch('redis_client.get_redis_client', return_value=client):
+            redis_client.cache_get('nutrition:alice:v0:2024-01-01')
+            redis_client.cache_get('nutrition:alice:v0:2024-01-01')
+        assert sample('cache_lookups_total', tier='redis', result='hit') == redis_hits + 1
+        assert sample('cache_lookups_total', tier='local', result='hit') == local_hits + 1
+        assert sample('redis_operation_duration_seconds_count', operation='get') == gets + 1
+
+    def test_usda_outcome(self):
+        """Test that FoodData Central calls are recorded with their outcome"""
+        from functions import fetch_usda_food
+        before = sample('usda_request_duration_seconds_count', outcome='not_found')
+        with patch('functions.requests.post') as mock_post:
+            mock_post.return_value = Mock(status_code=200, json=Mock(return_value={'foods': []}))
+            assert fetch_usda_food('unobtainium') == (None, 'not_found')
+        assert sample('usda_request_duration_seconds_count', outcome='not_found') == before + 1
+
+    def test_render_text_format(self):
+        """Test the exposition body and content type"""
+        metrics.observe_llm('anthropic', 'test-model', 'ok', 0.4, input_tokens=120, output_tokens=30)
+        body, content_type = metrics.render_metrics()
+        assert content_type.startswith('text/plain')
+        assert b'llm_tokens_total{direction="input",model="test-model",provider="anthropic"}' in body
+
+    def test_scrape_requires_token(self):
+        """Test that /metrics is closed without METRICS_TOKEN and needs the exact bearer token"""
+        with patch('metrics.METRICS_TOKEN', None):
+            assert not metrics.scrape_authorized('Bearer ')
+        with patch('metrics.METRICS_TOKEN', 's3cret'):
+            assert metrics.scrape_authorized('Bearer s3cret')
+            assert not metrics.scrape_authorized('Bearer wrong')
+            assert not metrics.scrape_authorized(None)
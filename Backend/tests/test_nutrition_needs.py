@@ -0,0 +1,122 @@
+"""
+Unit tests for nutrition_needs.py
+"""
+import random
+from decimal import Decimal
+
+import numpy as np
+import pytest
+
+from nutrition_needs import (
+    InvalidProfile,
+    compute_needs,
+    compute_needs_batch,
+    needs_for_profile,
+    _compute_needs,
+)
+
+
+def reference_needs(sex, weight_kg, height_cm, age, activity_level, goal):
+    """The formula as it was inlined at each call site before the engine existed"""
+    if sex == "male":
+        bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age + 5
+    else:
+        bmr = 10 * weight_kg + 6.25 * height_cm - 5 * age - 161
+    factors = {"sedentary": 1.2, "light": 1.375, "moderate": 1.55, "active": 1.725, "extra": 1.9}
+    tdee = bmr * factors[activity_level]
+    adjusted_tdee = tdee * (1.0 + {"cut": -0.20, "maintain": 0.0, "bulk": 0.20}[goal])
+    protein = round(1.6 * weight_kg)
+    fat = round((adjusted_tdee * 0.25) / 9)
+    carbs = round((adjusted_tdee - (protein * 4 + fat * 9)) / 4)
+    return {"calories": round(adjusted_tdee), "protein_g": protein, "fat_g": fat, "carbs_g": carbs,
+            "bmr": round(bmr), "tdee": round(tdee)}
+
+
+def random_profiles(n, seed=7):
+    rng = random.Random(seed)
+    return [(
+        rng.choice(["male", "female"]),
+        round(rng.uniform(40, 140), 1),
+        round(rng.uniform(145, 205), 1),
+        rng.randint(16, 90),
+        rng.choice(["sedentary", "light", "moderate", "active", "extra"]),
+        rng.choice(["cut", "maintain", "bulk"]),
+    ) for _ in range(n)]
+
+
+class TestComputeNeeds:
+    """Test the scalar API"""
+
+    def test_matches_reference_formula(self):
+        """Test that the engine reproduces the original inline computation"""
+        for profile in random_profiles(200):
+            needs = compute_needs(*profile)
+            expected = reference_needs(*profile)
+            assert {k: getattr(needs, k) for k in expected} == expected
+
+    def test_fractional_age_is_not_truncated(self):
+        """Test that a fractional age (as the chat tool may pass) goes into the formula as-is"""
+        needs = compute_needs('female', 60, 165, 30.5, 'light', 'maintain')
+        expected = reference_needs('female', 60, 165, 30.5, 'light', 'maintain')
+        assert {k: getattr(needs, k) for k in expected} == expected
+
+    def test_equivalent_inputs_share_a_cache_entry(self):
+        """Test that Decimal/str variants of a profile hit the same memoized result"""
+        _compute_needs.cache_clear()
+        first = needs_for_profile({'sex': 'Male', 'weight_kg': Decimal('75.0'), 'height_cm': Decimal('180'),
+                                   'age': 30, 'activity_level': 'moderate', 'goal': None})
+        second = compute_needs('male', 75, 180.0, 30, 'moderate', 'maintain')
+        assert first is second
+        assert _compute_needs.cache_info().hits == 1
+        assert first.targets() == {'calories': first.calories, 'protein_g': 120,
+                                   'fat_g': first.fat_g, 'carbs_g': first.carbs_g}
+
+    @pytest.mark.parametrize('profile, message', [
+        (('male', None, 180, 30, 'moderate', 'maintain'), 'missing required profile data'),
+        (('other', 75, 180, 30, 'moderate', 'maintain'), 'invalid sex value'),
+        (('male', 75, 180, 30, 'couch', 'maintain'), 'invalid activity_level'),
+        (('male', 75, 180, 30, 'moderate', 'shred'), 'invalid goal value'),
+        (('male', 75, 180, 'thirty', 'moderate', 'maintain'), 'must be numbers'),
+        (('male', 75, -180, 30, 'moderate', 'maintain'), 'must be positive numbers'),
+    ])
+    def test_invalid_profile(self, profile, message):
+        """Test that unusable values raise InvalidProfile"""
+        with pytest.raises(InvalidProfile, match=message):
+            compute_needs(*profile)
+
+
+class TestComputeNeedsBatch:
+    """Test the vectorized API"""
+
+    def test_matches_scalar_api(self):
+        """Test that the batch result equals compute_needs element for element"""
+        profiles = random_profiles(5000, seed=11)
+        profiles[1] = ('Female', Decimal('61.5'), '170', 30.5, 'light', None)
+        batch = compute_needs_batch(*map(list, zip(*profiles)))
+        for i in list(range(0, len(profiles), 37)) + [1]:
+            needs = compute_needs(*profiles[i])
+            for field, column in batch.items():
+                assert column[i] == getattr(needs, field), (profiles[i], field)
+        assert batch['calories'].dtype == np.int64
+
+    def test_missing_goal_means_maintain(self):
+        """Test that empty goals are treated like the scalar API treats them"""
+        batch = compute_needs_batch(['female'], [60], [165], [25], ['light'], [None])
+        assert batch['calories'][0] == compute_needs('female', 60, 165, 25, 'light').calories
+
+    @pytest.mark.parametrize('bad_profile', [
+        ('male', None, 180, 30, 'moderate', 'maintain'),
+        ('male', 75, 180, 'thirty', 'moderate', 'maintain'),
+        ('male', 75, -180, 30, 'moderate', 'maintain'),
+        ('other', 75, 180, 30, 'moderate', 'maintain'),
+        ('male', 75, 180, 30, 'couch', 'maintain'),
+        ('male', 75, 180, 30, 'moderate', 'shred'),
+    ])
+    def test_invalid_profile_raises_like_scalar_api(self, bad_profile):
+        """Test that one bad profile rejects the batch with the scalar API's error"""
+        with pytest.raises(InvalidProfile) as scalar_error:
+            compute_needs(*bad_profile)
+        profiles = [('female', 60, 165, 25, 'light', 'cut'), bad_profile]
+        with pytest.raises(InvalidProfile) as batch_error:
+            compute_needs_batch(*map(list, zip(*profiles)))
+        assert str(batch_error.value) == str(scalar_error.value)
@@ -0,0 +1,242 @@
+"""
+Unit tests for redis_client.py
+"""
+import json
+import pytest
+from datetime import date
+from decimal import Decimal
+from unittest.mock import Mock, patch
+
+import redis_client
+from local_cache import LocalCache
+from circuit_breaker import CircuitBreaker, CLOSED, OPEN, HALF_OPEN
+from redis_client import (
+    cache_get,
+    cache_set,
+    get_cache_key_for_logs,
+    get_cache_key_for_daily_nutrition,
+    get_cache_key_for_7day_history,
+    get_cache_key_for_chat,
+    invalidate_nutrition_cache,
+)
+
+
+@pytest.fixture(autouse=True)
+def clear_local_cache():
+    redis_client._local_cache.clear()
+    yield
+    redis_client._local_cache.clear()
+
+
+@pytest.fixture
+def mock_client():
+    client = Mock()
+    with patch('redis_client.get_redis_client', return_value=client):
+        yield client
+
+
+class TestVersionedKeys:
+    """Test per-user versioned cache namespaces"""
+
+    def test_keys_embed_user_version(self, mock_client):
+        """Test that data-derived keys carry the user's current version"""
+        mock_client.get.return_value = '4'
+        assert get_cache_key_for_daily_nutrition('alice', '2024-01-01') == 'nutrition:alice:v4:2024-01-01'
+        assert get_cache_key_for_7day_history('alice') == 'history_7days:alice:v4'
+        assert get_cache_key_for_logs('alice', 'page') == 'logs:alice:v4:page'
+        mock_client.get.assert_called_with('cache_version:alice')
+
+    def test_chat_history_is_not_versioned(self, mock_client):
+        """Test that chat history survives data writes"""
+        assert get_cache_key_for_chat('alice') == 'chat_history:alice'
+        mock_client.get.assert_not_called()
+
+    def test_version_defaults_to_zero(self):
+        """Test that keys still work without Redis"""
+        with patch('redis_client.get_redis_client', return_value=None):
+            assert get_cache_key_for_7day_history('alice') == 'history_7days:alice:v0'
+
+    def test_invalidate_is_one_round_trip(self, mock_client):
+        """Test that invalidation bumps the version in a single pipeline and deletes nothing"""
+        pipe = mock_client.pipeline.return_value
+        invalidate_nutrition_cache('alice')
+        pipe.incr.assert_called_once_with('cache_version:alice')
+        pipe.expire.assert_called_once_with('cache_version:alice', redis_client.CACHE_VERSION_TTL)
+        pipe.execute.assert_called_once()
+        mock_client.delete.assert_not_called()
+
+    def test_read_during_invalidation_is_not_kept(self, mock_client):
+        """Test that a version read while the INCR is in flight does not outlive the write"""
+        mock_client.get.return_value = '5'
+        pipe = mock_client.pipeline.return_value
+
+        def incr_in_flight():
+            assert redis_client.get_user_cache_version('alice') == 5
+            mock_client.get.return_value = '6'
+        pipe.execute.side_effect = incr_in_flight
+
+        invalidate_nutrition_cache('alice')
+        assert redis_client.get_user_cache_version('alice') == 6
+
+    def test_versioned_get_is_one_round_trip(self, mock_client):
+        """Test that the version and the entry keyed by it come back from one call"""
+        mock_client.eval.return_value = ['3', '{"calories": 100}']
+        build_key = lambda version: get_cache_key_for_daily_nutrition('alice', '2024-01-01', version)
+
+        assert redis_client.cache_get_versioned('alice', build_key) == ('nutrition:alice:v3:2024-01-01', {'calories': 100})
+        script, numkeys, *args = mock_client.eval.call_args.args
+        assert (numkeys, args) == (1, ['cache_version:alice', 'nutrition:alice:v', ':2024-01-01'])
+
+        # Version and entry are now held locally
+        assert redis_client.cache_get_versioned('alice', build_key) == ('nutrition:alice:v3:2024-01-01', {'calories': 100})
+        assert mock_client.eval.call_count == 1
+        mock_client.get.assert_not_called()
+
+    def test_versioned_get_miss(self, mock_client):
+        """Test that an unset version reads as 0 and a missing entry as None"""
+        mock_client.eval.return_value = ['0', None]
+        key, body = redis_client.cache_get_raw_versioned('alice', lambda v: get_cache_key_for_7day_history('alice', v))
+        assert (key, body) == ('history_7days:alice:v0', None)
+
+    def test_versioned_get_without_scripting(self, mock_client):
+        """Test that a server refusing EVAL falls back to separate GETs"""
+        mock_client.eval.side_effect = redis_client.redis.ResponseError("unknown command 'eval'")
+        mock_client.get.side_effect = ['2', '{"calories": 100}']
+        with patch('redis_client._versioned_get_supported', True):
+            key, value = redis_client.cache_get_versioned('alice', lambda v: get_cache_key_for_7day_history('alice', v))
+            assert (key, value) == ('history_7days:alice:v2', {'calories': 100})
+            assert redis_client._versioned_get_supported is False
+
+
+class TestTwoTierCache:
+    """Test the in-process tier in front of Redis"""
+
+    def test_local_hit_skips_redis(self, mock_client):
+        """Test that a value read once is served locally afterwards"""
+        mock_client.get.return_value = '{"calories": 100}'
+        assert cache_get('nutrition:alice:v0:2024-01-01') == {'calories': 100}
+        assert cache_get('nutrition:alice:v0:2024-01-01') == {'calories': 100}
+        assert mock_client.get.call_count == 1
+
+    def test_set_publishes_invalidation(self, mock_client):
+        """Test that writes tell other processes to drop their local copy"""
+        pipe = mock_client.pipeline.return_value
+        assert cache_set('chat_history:alice', ['hi'], ttl=60)
+        channel, message = pipe.publish.call_args.args
+        assert channel == redis_client.INVALIDATION_CHANNEL
+        assert json.loads(message) == {'origin': redis_client.INSTANCE_ID, 'keys': ['chat_history:alice']}
+        assert cache_get('chat_history:alice') == ['hi']
+        mock_client.get.assert_not_called()
+
+    def test_invalidation_during_fill_is_not_cached(self):
+        """Test that a value read before an invalidation is not stored locally"""
+        cache = LocalCache(10, 30)
+        generation = cache.generation
+        cache.delete('key')
+        cache.set('key', 'stale', generation=generation)
+        assert cache.get('key') is None
+
+    def test_lru_eviction_and_stats(self):
+        """Test that the local tier is size-bounded and counts hits and misses"""
+        cache = LocalCache(2, 30)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        assert cache.get('b') is None
+        assert cache.get('a') == 1
+        stats = cache.stats()
+        assert (stats['hits'], stats['misses'], stats['evictions'], stats['size']) == (2, 1, 1, 2)
+
+    def test_local_tier_returns_decoded_values(self, mock_client):
+        """Test that a local hit after cache_set matches what a Redis hit would return"""
+        value = {'calories': Decimal('120.5'), 'day': date(2024, 1, 1)}
+        assert cache_set('nutrition:alice:v0:2024-01-01', value, ttl=60)
+        value['calories'] = 0
+        assert cache_get('nutrition:alice:v0:2024-01-01') == {'calories': 120.5, 'day': '2024-01-01'}
+        mock_client.get.assert_not_called()
+
+    def test_raw_body_round_trip(self, mock_client):
+        """Test that response bodies are stored and returned as bytes without JSON decoding"""
+        body = '{"code": 200, "data": {"name": "Crème"}, "message": "ok"}'.encode('utf-8')
+        mock_client.get.return_value = body.decode('utf-8')  # decode_responses=True
+        with patch('redis_client.json.loads') as mock_loads:
+            assert redis_client.cache_get_raw('response:logs:alice:v0:all') == body
+            assert redis_client.cache_get_raw('response:logs:alice:v0:all') == body
+            mock_loads.assert_not_called()
+        assert mock_client.get.call_count == 1
+
+        pipe = mock_client.pipeline.return_value
+        assert redis_client.cache_set_raw('response:history_7days:alice:v0', body, ttl=60)
+        pipe.setex.assert_called_once_with('response:history_7days:alice:v0', 60, body)
+
+
+class TestCircuitBreaker:
+    """Test the Redis circuit breaker"""
+
+    def test_opens_after_threshold_and_backs_off_exponentially(self):
+        """Test closed -> open -> half-open -> open with doubled backoff -> closed"""
+        breaker = CircuitBreaker(failure_threshold=2, base_backoff=1, max_backoff=60)
+        with patch('circuit_breaker.time.monotonic', return_value=100.0):
+            breaker.record_failure(ConnectionError())
+            assert breaker.state == CLOSED
+            breaker.record_failure(ConnectionError())
+            assert breaker.state == OPEN
+            assert not breaker.allow_request()
+
+        with patch('circuit_breaker.time.monotonic', return_value=101.0):
+            assert breaker.allow_request()  # the single half-open probe
+            assert breaker.state == HALF_OPEN
+            assert not breaker.allow_request()
+            breaker.record_failure(ConnectionError())
+            assert breaker.state == OPEN
+            assert breaker.backoff == 2
+
+        with patch('circuit_breaker.time.monotonic', return_value=103.0):
+            assert breaker.allow_request()
+            breaker.record_success()
+            assert breaker.state == CLOSED
+            assert breaker.snapshot()['backoff_seconds'] == 0
+
+    def test_open_breaker_skips_connecting(self):
+        """Test that get_redis_client fails fast while the breaker is open"""
+        breaker = CircuitBreaker()
+        breaker.trip(ConnectionError())
+        with patch('redis_client._breaker', breaker), \
+             patch('redis_client.redis.Redis') as mock_redis:
+            assert redis_client.get_redis_client() is None
+            assert cache_get('some:key') is None
+            mock_redis.assert_not_called()
+
+    def test_connection_errors_count_towards_opening(self, mock_client):
+        """Test that operation timeouts trip the breaker but other errors do not"""
+        breaker = CircuitBreaker(failure_threshold=2)
+        with patch('redis_client._breaker', breaker):
+            mock_client.get.side_effect = ValueError('bad payload')
+            cache_get('a')
+            assert breaker.consecutive_failures == 0
+            mock_client.get.side_effect = redis_client.redis.TimeoutError()
+            cache_get('b')
+            cache_get('c')
+            assert breaker.state == OPEN
+
+
+    def test_open_breaker_bypasses_local_tier(self, mock_client):
+        """Test that local entries are dropped and not served once the breaker opens"""
+        mock_client.get.return_value = '{"calories": 100}'
+        breaker = CircuitBreaker(failure_threshold=1)
+        with patch('redis_client._breaker', breaker):
+            assert cache_get('nutrition:alice:v3:2024-01-01') == {'calories': 100}
+            redis_client._record_error(redis_client.redis.ConnectionError())
+            assert breaker.state == OPEN
+            assert redis_client._local_cache.stats()['size'] == 0
+            redis_client._local_cache.set('nutrition:alice:v3:2024-01-01', {'calories': 100})
+            with patch('redis_client.get_redis_client', return_value=None):
+                assert cache_get('nutrition:alice:v3:2024-01-01') is None
+
+    def test_invalidate_without_redis_drops_local_version(self):
+        """Test that a write still invalidates this process's copy of the version while Redis is down"""
+        redis_client._local_cache.set('cache_version:alice', 3)
+        with patch('redis_client.get_redis_client', return_value=None):
+            invalidate_nutrition_cache('alice')
+        assert redis_client._local_cache.get('cache_version:alice') is None
@@ -0,0 +1,28 @@
+"""
+Unit tests for request_timing.py
+"""
+from flask import Flask
+
+import request_timing
+
+
+class TestServerTiming:
+    """Test the per-request breakdown"""
+
+    def test_header_accumulates_components(self):
+        """Test that time is summed per component and repeated calls are counted"""
+        app = Flask(__name__)
+        with app.test_request_context('/dv_summation'):
+            request_timing.start()
+            request_timing.add('db', 0.010)
+            request_timing.add('db', 0.0025)
+            request_timing.add('cache', 0.001)
+            header = request_timing.server_timing_header(0.020)
+        assert header == ('db;dur=12.5;desc="2 calls", cache;dur=1.0, usda;dur=0.0, llm;dur=0.0, '
+                          'serialize;dur=0.0, total;dur=20.0')
+
+    def test_outside_request_is_ignored(self):
+        """Test that Celery tasks and scripts can hit the instrumented paths"""
+        with Flask(__name__).app_context():
+            request_timing.add('db', 0.5)
+        request_timing.add('db', 0.5)
@@ -0,0 +1,72 @@
+"""
+Unit tests for serialization.py
+"""
+import json
+import pytest
+from datetime import date, datetime
+from decimal import Decimal
+
+import serialization
+from serialization import load_backend, StdlibBackend
+
+
+PAYLOAD = {
+    'code': 200,
+    'message': 'Logs retrieved successfully',
+    'data': {
+        'logs': [{
+            'id': 1,
+            'food_name': 'Crème fraîche',
+            'quantity': Decimal('150.5'),
+            'intake_date': date(2024, 1, 2),
+            'created_at': datetime(2024, 1, 2, 8, 30, 15, 123456),
+            'meal_type': None,
+        }],
+        'next_cursor': None,
+    }
+}
+
+
+def legacy_dumps(res):
+    """The encoding response() used before the backend abstraction"""
+    def json_serial(obj):
+        if isinstance(obj, (datetime, date)):
+            return obj.isoformat()
+        elif isinstance(obj, Decimal):
+            return float(obj)
+        raise TypeError(f"Type {type(obj)} not serializable")
+    return json.dumps(res, sort_keys=True, ensure_ascii=False, default=json_serial)
+
+
+class TestBackends:
+    """Test JSON backends"""
+
+    def test_stdlib_is_byte_identical_to_legacy(self):
+        """Test that compatibility mode reproduces the original response bytes"""
+        assert StdlibBackend().dumps(PAYLOAD) == legacy_dumps(PAYLOAD).encode('utf-8')
+
+    @pytest.mark.skipif('orjson' not in serialization.BACKENDS, reason="orjson not installed")
+    def test_orjson_matches_stdlib_semantically(self):
+        """Test that the fast backend decodes to the same document"""
+        fast = load_backend('orjson')
+        assert fast.name == 'orjson'
+        assert json.loads(fast.dumps(PAYLOAD)) == json.loads(legacy_dumps(PAYLOAD))
+
+    def test_unknown_backend_falls_back_to_stdlib(self):
+        """Test that a misconfigured JSON_BACKEND does not break responses"""
+        assert load_backend('simdjson').name == 'stdlib'
+
+    def test_unserializable_type_raises(self):
+        """Test that unsupported types still fail loudly in both backends"""
+        for name in serialization.BACKENDS:
+            with pytest.raises(TypeError):
+                load_backend(name).dumps({'value': object()})
+
+    def test_envelope_matches_full_encoding(self):
+        """Test that wrapping pre-encoded data gives the same bytes as encoding the whole response"""
+        for name in serialization.BACKENDS:
+            encoder = load_backend(name)
+            with pytest.MonkeyPatch.context() as mp:
+                mp.setattr(serialization, 'backend', encoder)
+                body = serialization.encode_response(200, PAYLOAD['message'], encoder.dumps(PAYLOAD['data']))
+            assert body == encoder.dumps(PAYLOAD)
@@ -0,0 +1,71 @@
+"""
+Per-turn memo for chat tool calls.
+
+One chat message can run the same tool several times: the model asks for
+get_user_profile in one iteration and get_user_daily_needs (which needs the profile
+again) in the next, or repeats a call it already made. A ToolMemo lives for one chat
+message and keys results on tool name plus arguments, so each distinct invocation
+runs once; concurrent requests for the same key wait for the first one.
+
+While a tool runs, its memo is the current one, and tools that build on other tools
+go through memoized() to share results.
+"""
+import json
+import threading
+from concurrent.futures import Future
+from contextvars import ContextVar
+
+_current_memo = ContextVar('tool_memo', default=None)
+
+
+class ToolMemo:
+    """Tool results for one chat message, with hit/miss counters."""
+
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self._results = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(name: str, arguments: dict) -> tuple:
+        return name, json.dumps(arguments or {}, sort_keys=True, default=str)
+
+    def call(self, name: str, arguments: dict, func):
+        """(result, hit): func() on the first call for these arguments, the stored result after."""
+        key = self.key(name, arguments)
+        with self._lock:
+            future = self._results.get(key)
+            hit = future is not None
+            if hit:
+                self.hits += 1
+            else:
+                future = self._results[key] = Future()
+                self.misses += 1
+        if hit:
+            return future.result(), True
+
+        token = _current_memo.set(self)
+        try:
+            future.set_result(func())
+        except BaseException as e:
+            # Let a later call retry instead of replaying the failure
+            with self._lock:
+                del self._results[key]
+            future.set_exception(e)
+            raise
+        finally:
+            _current_memo.reset(token)
+        return future.result(), False
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+
+def memoized(name: str, arguments: dict, func):
+    """func() through the current tool memo, if a tool is running under one."""
+    memo = _current_memo.get()
+    if memo is None:
+        return func()
+    return memo.call(name, arguments, func)[0]
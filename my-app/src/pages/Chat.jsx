@@ -2,10 +2,18 @@ import { useState, useRef, useEffect } from 'react';
 import { chatAPI } from '../services/api';
 import '../index.css';
 
+const TOOL_LABELS = {
+  get_user_profile: 'your profile',
+  get_today_nutrition: "today's intake",
+  calculate_daily_needs: 'daily needs',
+  get_user_daily_needs: 'your daily needs',
+};
+
 export default function ChatPage() {
   const [messages, setMessages] = useState([]);
   const [input, setInput] = useState('');
   const [loading, setLoading] = useState(false);
+  const [status, setStatus] = useState('');
   const [error, setError] = useState('');
   const messagesEndRef = useRef(null);
 
@@ -29,23 +37,45 @@ export default function ChatPage() {
     setMessages((prev) => [...prev, newUserMessage]);
     setLoading(true);
 
+    // Grow the assistant reply as text arrives; `replace` swaps in the final message
+    const updateReply = (text, replace = false) => {
+      setMessages((prev) => {
+        const last = prev[prev.length - 1];
+        if (last?.role === 'assistant' && last.streaming) {
+          return [...prev.slice(0, -1), { ...last, content: replace ? text : last.content + text, streaming: !replace }];
+        }
+        return [...prev, { role: 'assistant', content: text, streaming: !replace }];
+      });
+    };
+
     try {
-      const response = await chatAPI.sendMessage(userMessage, messages);
-      const data = response.data;
+      const result = await chatAPI.streamMessage(userMessage, messages, (event, data) => {
+        if (event === 'text') {
+          setStatus('');
+          updateReply(data.delta);
+        } else if (event === 'tool_call') {
+          setStatus(`Checking ${TOOL_LABELS[data.name] || data.name}...`);
+        } else if (event === 'done') {
+          updateReply(data.message, true);
+        } else if (event === 'error') {
+          setError(data.message || 'Failed to get response');
+        }
+      });
 
-      if (data.code === 200) {
-        const assistantMessage = { role: 'assistant', content: data.data.message };
-        setMessages((prev) => [...prev, assistantMessage]);
-      } else {
-        setError(data.message || 'Failed to get response');
+      if (result.code !== 200) {
+        setError(result.message || 'Failed to get response');
       }
     } catch (err) {
-      setError(err.response?.data?.message || 'Failed to send message. Please try again.');
+      setError('Failed to send message. Please try again.');
     } finally {
+      setMessages((prev) => prev.map(({ streaming, ...msg }) => msg));
+      setStatus('');
       setLoading(false);
     }
   };
 
+  const replying = messages[messages.length - 1]?.streaming;
+
   return (
     <div className="max-w-4xl mx-auto" style={{ padding: '1rem 1.5rem' }}>
       <div style={{ marginBottom: '1.5rem' }}>
@@ -90,10 +120,10 @@ export default function ChatPage() {
               </div>
             ))
           )}
-          {loading && (
+          {loading && (status || !replying) && (
             <div style={{ display: 'flex', justifyContent: 'flex-start' }}>
               <div style={{ backgroundColor: '#e5e7eb', color: '#111827', padding: '0.5rem 1rem', borderRadius: '0.5rem' }}>
-                <p style={{ fontSize: '0.875rem', margin: 0 }}>Thinking...</p>
+                <p style={{ fontSize: '0.875rem', margin: 0 }}>{status || 'Thinking...'}</p>
               </div>
             </div>
           )}
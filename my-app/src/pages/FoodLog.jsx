@@ -4,6 +4,8 @@ import '../index.css';
 
 export default function FoodLogPage() {
   const [logs, setLogs] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [showAddForm, setShowAddForm] = useState(false);
@@ -27,10 +29,11 @@ export default function FoodLogPage() {
 
   const fetchLogs = async () => {
     try {
-      const response = await foodLogAPI.getAll();
+      const response = await foodLogAPI.getPage();
       const data = response.data;
       if (data.code === 200) {
-        setLogs(data.data || []);
+        setLogs(data.data.logs || []);
+        setNextCursor(data.data.next_cursor);
       } else {
         setError(data.message);
       }
@@ -41,6 +44,24 @@ export default function FoodLogPage() {
     }
   };
 
+  const loadMoreLogs = async () => {
+    setLoadingMore(true);
+    try {
+      const response = await foodLogAPI.getPage({ cursor: nextCursor });
+      const data = response.data;
+      if (data.code === 200) {
+        setLogs((current) => [...current, ...(data.data.logs || [])]);
+        setNextCursor(data.data.next_cursor);
+      } else {
+        setError(data.message);
+      }
+    } catch (err) {
+      setError(err.response?.data?.message || 'Failed to load food logs');
+    } finally {
+      setLoadingMore(false);
+    }
+  };
+
   const handleSubmit = async (e) => {
     e.preventDefault();
     setError('');
@@ -264,6 +285,13 @@ export default function FoodLogPage() {
             )}
           </tbody>
         </table>
+        {nextCursor && (
+          <div style={{ textAlign: 'center', marginTop: '1rem' }}>
+            <button className="btn-secondary" onClick={loadMoreLogs} disabled={loadingMore}>
+              {loadingMore ? 'Loading...' : 'Load more'}
+            </button>
+          </div>
+        )}
       </div>
     </div>
   );
@@ -7,11 +7,32 @@ export default function HistoryPage() {
   const [dailyNeeds, setDailyNeeds] = useState(null);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
+  const [trendDays, setTrendDays] = useState(30);
+  const [trends, setTrends] = useState(null);
 
   useEffect(() => {
     fetchHistory();
   }, []);
 
+  useEffect(() => {
+    fetchTrends(trendDays);
+  }, [trendDays]);
+
+  const fetchTrends = async (days) => {
+    try {
+      const response = await historyAPI.getTrends({ days });
+      if (response.data.code === 200) {
+        setTrends(response.data.data);
+      }
+    } catch (err) {
+      // Trends are supplementary; the 7-day table still renders without them
+      setTrends(null);
+    }
+  };
+
+  const formatTrendValue = (value, suffix = '') =>
+    value === null || value === undefined ? 'N/A' : `${value.toLocaleString()}${suffix}`;
+
   const fetchHistory = async () => {
     try {
       setLoading(true);
@@ -458,6 +479,72 @@ export default function HistoryPage() {
           </span>
         </div>
       </div>
+
+      {/* Long-range Trends */}
+      <div style={{
+        marginTop: '2.5rem',
+        backgroundColor: '#ffffff',
+        borderRadius: '0.75rem',
+        boxShadow: '0 1px 3px 0 rgba(0, 0, 0, 0.1), 0 1px 2px 0 rgba(0, 0, 0, 0.06)',
+        padding: '1.5rem'
+      }}>
+        <div style={{ display: 'flex', justifyContent: 'space-between', alignItems: 'center', marginBottom: '1.25rem' }}>
+          <h2 style={{ fontSize: '1.25rem', fontWeight: 600, color: '#111827' }}>Trends</h2>
+          <div style={{ display: 'flex', gap: '0.5rem' }}>
+            {[30, 90, 365].map((days) => (
+              <button
+                key={days}
+                className={days === trendDays ? 'btn-primary' : 'btn-secondary'}
+                onClick={() => setTrendDays(days)}
+              >
+                {days} days
+              </button>
+            ))}
+          </div>
+        </div>
+        {trends ? (
+          <div style={{
+            display: 'grid',
+            gridTemplateColumns: 'repeat(auto-fit, minmax(200px, 1fr))',
+            gap: '1.5rem'
+          }}>
+            <div>
+              <div style={{ fontSize: '0.875rem', fontWeight: 500, color: '#6b7280', marginBottom: '0.5rem' }}>
+                Average Calories
+              </div>
+              <div style={{ fontSize: '1.5rem', fontWeight: 700, color: '#111827' }}>
+                {formatTrendValue(trends.summary.average.calories)}
+              </div>
+            </div>
+            <div>
+              <div style={{ fontSize: '0.875rem', fontWeight: 500, color: '#6b7280', marginBottom: '0.5rem' }}>
+                Days Within 10% of Goal
+              </div>
+              <div style={{ fontSize: '1.5rem', fontWeight: 700, color: '#111827' }}>
+                {formatTrendValue(trends.summary.adherence_pct.calories, '%')}
+              </div>
+            </div>
+            <div>
+              <div style={{ fontSize: '0.875rem', fontWeight: 500, color: '#6b7280', marginBottom: '0.5rem' }}>
+                {trends.window}-Day Average Change
+              </div>
+              <div style={{ fontSize: '1.5rem', fontWeight: 700, color: '#111827' }}>
+                {formatTrendValue(trends.summary.delta.calories, ' kcal')}
+              </div>
+            </div>
+            <div>
+              <div style={{ fontSize: '0.875rem', fontWeight: 500, color: '#6b7280', marginBottom: '0.5rem' }}>
+                Days Logged
+              </div>
+              <div style={{ fontSize: '1.5rem', fontWeight: 700, color: '#111827' }}>
+                {trends.summary.logged_days} / {trends.days}
+              </div>
+            </div>
+          </div>
+        ) : (
+          <div style={{ color: '#9ca3af' }}>No trend data</div>
+        )}
+      </div>
     </div>
   );
 }
@@ -23,14 +23,18 @@ api.interceptors.request.use(
   }
 );
 
+const redirectToLogin = () => {
+  localStorage.removeItem('token');
+  localStorage.removeItem('user');
+  localStorage.removeItem('chat_messages');
+  window.location.href = '/login';
+};
+
 api.interceptors.response.use(
   (response) => {
     // Check for custom error codes in response body (backend returns 200 with code field)
     if (response.data?.code === 401 || response.data?.code === 999) {
-      localStorage.removeItem('token');
-      localStorage.removeItem('user');
-      localStorage.removeItem('chat_messages');
-      window.location.href = '/login';
+      redirectToLogin();
       return Promise.reject(new Error('Authentication required'));
     }
     return response;
@@ -38,15 +42,56 @@ api.interceptors.response.use(
   (error) => {
     // Check HTTP status codes
     if (error.response?.status === 401 || error.response?.status === 999) {
-      localStorage.removeItem('token');
-      localStorage.removeItem('user');
-      localStorage.removeItem('chat_messages');
-      window.location.href = '/login';
+      redirectToLogin();
     }
     return Promise.reject(error);
   }
 );
 
+// POST to an SSE endpoint and call onEvent(event, data) for each event as it arrives.
+// Axios cannot read a response body incrementally in the browser, so this uses fetch.
+// Resolves with the JSON body when the request is rejected before streaming starts.
+const streamEvents = async (path, body, onEvent) => {
+  const token = localStorage.getItem('token');
+  const res = await fetch(`${API_BASE_URL}${path}`, {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      ...(token ? { Authorization: `Bearer ${token}` } : {}),
+    },
+    body: JSON.stringify(body),
+  });
+  if (!res.headers.get('Content-Type')?.startsWith('text/event-stream')) {
+    const data = await res.json();
+    if (data.code === 401 || data.code === 999) {
+      redirectToLogin();
+    }
+    return data;
+  }
+
+  const reader = res.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  for (;;) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    let end;
+    while ((end = buffer.indexOf('\n\n')) !== -1) {
+      const frame = buffer.slice(0, end);
+      buffer = buffer.slice(end + 2);
+      let event = 'message';
+      let data = '';
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event: ')) event = line.slice(7);
+        else if (line.startsWith('data: ')) data += line.slice(6);
+      }
+      onEvent(event, data ? JSON.parse(data) : {});
+    }
+  }
+  return { code: 200 };
+};
+
 export const authAPI = {
   register: (data) => api.post('/register', data),
   login: (data) => api.post('/login', data),
@@ -61,7 +106,12 @@ export const foodLogAPI = {
   create: (data) => api.post('/insert_log', data),
   update: (data) => api.post('/update_log', data),
   delete: (data) => api.post('/delete_log', data),
-  getAll: (date) => api.get('/retrieve_log', { params: { date } }),
+  batch: (operations) => api.post('/logs/batch', operations),
+  getPage: ({ from, to, cursor, limit } = {}) => api.get('/retrieve_log', { params: { from, to, cursor, limit } }),
+};
+
+export const foodAPI = {
+  search: (q, limit) => api.get('/foods/search', { params: { q, limit } }),
 };
 
 export const dailySummaryAPI = {
@@ -74,10 +124,14 @@ export const dailyNeedsAPI = {
 
 export const historyAPI = {
   get7Days: () => api.get('/history_7days'),
+  getRange: (from, to) => api.get('/history', { params: { from, to } }),
+  getTrends: ({ days = 30, window = 7, points = 60 } = {}) =>
+    api.get('/trends', { params: { days, window, points } }),
 };
 
 export const chatAPI = {
   sendMessage: (message, history) => api.post('/api/chat', { message, history }),
+  streamMessage: (message, history, onEvent) => streamEvents('/api/chat/stream', { message, history }, onEvent),
   getHistory: () => api.get('/api/chat/history'),
   saveHistory: (history) => api.post('/api/chat/history', { history }),
   clearHistory: () => api.delete('/api/chat/history'),